@@ -0,0 +1,93 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_table(db_name, n_rows):
+    # An order-lines table: integer keys, a DECIMAL amount with some NULLs, low-cardinality text
+    rng = random.Random(0)
+    connection = sqlite3.connect(db_name)
+    connection.execute("""
+        CREATE TABLE ORDERS (id INTEGER PRIMARY KEY, customer INT, amount DECIMAL(10, 2),
+                             status VARCHAR(10), region VARCHAR(20), created DATE);
+    """)
+    statuses = ["open", "paid", "shipped", "returned"]
+    regions = [f"region {i}" for i in range(40)]
+    connection.executemany("INSERT INTO ORDERS VALUES (?, ?, ?, ?, ?, ?);",
+                           ((i, rng.randrange(10000), None if i % 50 == 0 else round(rng.uniform(1, 500), 2),
+                             rng.choice(statuses), rng.choice(regions), f"2024-{rng.randint(1, 12):02d}-01")
+                            for i in range(n_rows)))
+    connection.commit()
+    connection.close()
+
+
+def measure(function):
+    # Timed without tracemalloc, which slows allocations down, then run again for the peak memory
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare columnar export to fetching Python tuples")
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_columnar_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import DatabaseManager, read_columnar
+
+    build_table("ORDERS.db", args.rows)
+    db_manager = DatabaseManager("ORDERS.db")
+    db_manager.save_metadata()
+
+    rows, tuple_seconds, tuple_peak = measure(lambda: db_manager.connection.execute("SELECT * FROM ORDERS;").fetchall())
+    start = time.perf_counter()
+    tuple_sum = sum(row[2] for row in rows if row[2] is not None)
+    tuple_aggregate = time.perf_counter() - start
+    del rows
+
+    table, columnar_seconds, columnar_peak = measure(lambda: db_manager.export_columns("ORDERS"))
+    start = time.perf_counter()
+    columnar_sum = sum(table["amount"].data)  # NULLs are stored as 0
+    columnar_aggregate = time.perf_counter() - start
+    size = table.write("ORDERS.cols")
+
+    print(f"{args.rows:,} rows ({work_dir})")
+    print(f"tuples:   fetch {tuple_seconds:.2f}s, peak {tuple_peak / 2 ** 20:,.1f} MiB, "
+          f"sum(amount) {tuple_aggregate * 1000:.1f}ms")
+    print(f"columnar: export {columnar_seconds:.2f}s, peak {columnar_peak / 2 ** 20:,.1f} MiB, "
+          f"buffers {table.nbytes() / 2 ** 20:,.1f} MiB, sum(amount) {columnar_aggregate * 1000:.1f}ms")
+    if abs(tuple_sum - columnar_sum) > 1e-6 * abs(tuple_sum):
+        print(f"sums differ: {tuple_sum} != {columnar_sum}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    with read_columnar("ORDERS.cols") as mapped:
+        opened = time.perf_counter() - start
+        mapped_sum = sum(mapped["amount"].data)
+        try:
+            numpy_sum = mapped["amount"].numpy().sum()
+            print(f"numpy sum over the mapped file: {numpy_sum:,.2f}")
+        except ImportError:
+            pass
+    print(f"file: {size / 2 ** 20:,.1f} MiB, mapped in {opened * 1000:.2f}ms, sum {mapped_sum:,.2f}")
+    db_manager.close_connection()
+
+
+if __name__ == "__main__":
+    main()
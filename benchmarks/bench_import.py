@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter: records every file opened and every sqlite3 connection made
+# while the module is imported, through audit hooks
+PROBE = """
+import json, sys, time
+events = []
+def hook(event, args):
+    if event == "sqlite3.connect":
+        events.append([event, str(args[0])])
+    elif event == "open" and isinstance(args[0], str) and not args[0].endswith((".py", ".pyc", ".so")):
+        events.append([event, args[0]])
+sys.addaudithook(hook)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "events": [e for e in events if not e[1].startswith(sys.prefix)]}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing the library does no file I/O")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_import_")
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    failed = False
+    for module in ("metadatabase", "main"):
+        timings = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=work_dir, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output)
+            timings.append(result["seconds"])
+            if result["events"]:
+                failed = True
+                print(f"{module}: I/O during import: {result['events']}")
+        print(f"import {module}: median {statistics.median(timings) * 1000:.1f}ms over {args.repeat} runs")
+
+    created = os.listdir(work_dir)
+    if created:
+        failed = True
+        print(f"files created by the imports: {created}")
+    print("FAIL" if failed else "OK: no file I/O at import time")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
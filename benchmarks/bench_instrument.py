@@ -0,0 +1,87 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_database(db_name, n_tables, n_columns, n_rows):
+    connection = sqlite3.connect(db_name)
+    for t in range(n_tables):
+        columns = ", ".join(f"c{c} VARCHAR(30)" for c in range(n_columns))
+        fk = f", parent INT REFERENCES T{t - 1}(id)" if t else ""
+        connection.execute(f"CREATE TABLE T{t} (id INTEGER PRIMARY KEY, {columns}{fk});")
+    connection.executemany(f"INSERT INTO T0 (id, {', '.join(f'c{c}' for c in range(n_columns))}) "
+                           f"VALUES (?, {', '.join('?' for _ in range(n_columns))});",
+                           ((i, *(f"value {i} {c}" for c in range(n_columns))) for i in range(n_rows)))
+    connection.commit()
+    connection.close()
+
+
+def workload(DatabaseManager, n_rows):
+    # A forced re-harvest, a load in batches and a read of every row
+    db_manager = DatabaseManager("BENCH.db")
+    db_manager.save_metadata(force=True)
+    db_manager.bulk_insert("T1", ({"id": i, "c0": f"row {i}"} for i in range(n_rows)), batch_size=5000,
+                           progress=False)
+    db_manager.export_columns("T0")
+    db_manager.connection.execute("DELETE FROM T1;")
+    db_manager.connection.commit()
+    db_manager.close_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of the instrumentation, disabled and enabled")
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--calls", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_instrument_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import DatabaseManager, instruments
+    from metadatabase.instrument import instrumented, metrics_report
+
+    # Per call: a plain function against the same function instrumented but disabled
+    def plain():
+        return None
+
+    timed = instrumented("noop")(plain)
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        plain()
+    plain_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(args.calls):
+        timed()
+    disabled_seconds = time.perf_counter() - start
+    print(f"disabled overhead: {(disabled_seconds - plain_seconds) / args.calls * 1e9:.0f}ns per instrumented call")
+
+    build_database("BENCH.db", args.tables, args.columns, args.rows)
+    results = {}
+    for label in ("disabled", "enabled", "disabled"):
+        if label == "enabled":
+            instruments.enable()
+        else:
+            instruments.disable()
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            workload(DatabaseManager, args.rows)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[label] = min(best, results.get(label, best))
+    print(f"workload: disabled {results['disabled']:.3f}s, enabled {results['enabled']:.3f}s "
+          f"({(results['enabled'] / results['disabled'] - 1) * 100:+.1f}% with every statement traced)")
+    print()
+    print(metrics_report(instruments.metrics(), top=5))
+
+
+if __name__ == "__main__":
+    main()
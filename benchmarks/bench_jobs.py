@@ -0,0 +1,76 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from generate import generate_database
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQL = "SELECT count(*), sum(length(code)), max(code), min(id) FROM {table}"
+COMBINE = ["count", "sum", "max", "min"]
+
+
+def serial(db_names):
+    # The same aggregate, one database after the other in this process
+    total = [0, 0, None, None]
+    for db_name in db_names:
+        connection = sqlite3.connect(db_name)
+        count, length, high, low = connection.execute(SQL.replace("{table}", "T00000")).fetchone()
+        connection.close()
+        total[0] += count
+        total[1] += length
+        total[2] = high if total[2] is None else max(total[2], high)
+        total[3] = low if total[3] is None else min(total[3], low)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a partitioned aggregate job against a serial loop, and resuming it")
+    parser.add_argument("--databases", type=int, default=16)
+    parser.add_argument("--rows", type=int, default=500000, help="rows per database")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--split-rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_jobs_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import Job, connect_metadata, register_all
+
+    start = time.perf_counter()
+    db_names = [f"DATA{i:03d}.db" for i in range(args.databases)]
+    for i, db_name in enumerate(db_names):
+        generate_database(db_name, tables=1, columns=4, fk_density=0, rows=args.rows, seed=i)
+    register_all()
+    print(f"{args.databases} databases of {args.rows:,} rows built in {time.perf_counter() - start:.1f}s ({work_dir})")
+    total_rows = args.databases * args.rows
+
+    start = time.perf_counter()
+    expected = serial(db_names)
+    elapsed = time.perf_counter() - start
+    print(f"{'serial':<22}{elapsed:7.2f}s  {total_rows / elapsed:>13,.0f} rows/s")
+
+    for label, split_rows in (("job, per table", None), (f"job, {args.split_rows:,} rowids", args.split_rows)):
+        job = Job(label, SQL, combine=COMBINE, split_rows=split_rows, workers=args.workers)
+        summary = job.run()
+        assert summary["rows"] == [expected], (summary["rows"], expected)
+        print(f"{label:<22}{summary['seconds']:7.2f}s  {total_rows / summary['seconds']:>13,.0f} rows/s  "
+              f"{summary['partitions']} partitions")
+
+    # Resume: forget the checkpoints of half the partitions, as if the run had been interrupted
+    metadata_connection = connect_metadata()
+    with metadata_connection:
+        metadata_connection.execute("UPDATE JOB_PARTITIONS SET status='pending', result=NULL "
+                                    "WHERE job=? AND part % 2 = 0;", (label,))
+    metadata_connection.close()
+    summary = job.run()
+    assert summary["rows"] == [expected]
+    print(f"{'resume half':<22}{summary['seconds']:7.2f}s  {summary['ran']} run, {summary['resumed']} from checkpoints")
+    summary = job.run()
+    print(f"{'rerun, all done':<22}{summary['seconds']:7.2f}s  {summary['resumed']} from checkpoints")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_star(directory, n_dimensions, fact_rows, dimension_rows, categories):
+    # A fact table in one database and each dimension in a database of its own: every join of a
+    # query crosses databases, and no foreign key says how, so the joins are given explicitly
+    rng = random.Random(0)
+    connection = sqlite3.connect(os.path.join(directory, "FACTS.db"))
+    keys = ", ".join(f"d{i} INT" for i in range(n_dimensions))
+    connection.execute(f"CREATE TABLE FACT (id INTEGER PRIMARY KEY, {keys}, amount REAL);")
+    connection.executemany(f"INSERT INTO FACT VALUES ({', '.join('?' * (n_dimensions + 2))});",
+                           ((r, *(rng.randrange(dimension_rows) for _ in range(n_dimensions)), rng.random())
+                            for r in range(fact_rows)))
+    connection.commit()
+    connection.close()
+    for i in range(n_dimensions):
+        connection = sqlite3.connect(os.path.join(directory, f"DIMENSION_{i}.db"))
+        connection.execute(f"CREATE TABLE DIM{i} (id INTEGER PRIMARY KEY, category TEXT, label TEXT);")
+        connection.executemany(f"INSERT INTO DIM{i} VALUES (?, ?, ?);",
+                               ((r, f"c{rng.randrange(categories)}", f"label {r}") for r in range(dimension_rows)))
+        connection.commit()
+        connection.close()
+
+
+def workload(n_queries, n_dimensions, categories, seed=1):
+    # Random subsets of the dimensions, written in a random order, with one or two filtered dimensions
+    rng = random.Random(seed)
+    for _ in range(n_queries):
+        dimensions = rng.sample(range(n_dimensions), rng.randint(2, n_dimensions))
+        tables = ["FACT"] + [f"DIM{i}" for i in dimensions]
+        rng.shuffle(tables)
+        joins = [("FACT", f"d{i}", f"DIM{i}", "id") for i in dimensions]
+        filtered = rng.sample(dimensions, min(len(dimensions), rng.randint(1, 2)))
+        filters = {f"DIM{i}": f"category = 'c{rng.randrange(categories)}'" for i in filtered}
+        yield tables, joins, filters
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cost-based join plans to left-to-right execution")
+    parser.add_argument("--dimensions", type=int, default=4)
+    parser.add_argument("--fact-rows", type=int, default=100000)
+    parser.add_argument("--dimension-rows", type=int, default=2000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=10)
+    parser.add_argument("--profile", action="store_true", help="profile the tables first (COLUMN_STATS)")
+    parser.add_argument("--attach-limit", type=int, help="lower it to force Python hash joins")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_planner_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import DatabaseManager, register_all
+    from metadatabase.planner import JoinPlanner
+
+    build_star(work_dir, args.dimensions, args.fact_rows, args.dimension_rows, args.categories)
+    register_all(work_dir)
+    if args.profile:
+        for db_name in sorted(f for f in os.listdir(work_dir) if f.endswith(".db") and f != "metadata.db"):
+            db_manager = DatabaseManager(os.path.join(work_dir, db_name), read_only=True)
+            db_manager.save_statistics(sample_size=20000)
+            db_manager.close_connection()
+
+    planner = JoinPlanner(attach_limit=args.attach_limit)
+    totals = {"planning": 0.0, "planned": 0.0, "naive": 0.0}
+    print(f"{args.fact_rows:,} fact rows, {args.dimensions} dimensions of {args.dimension_rows:,} rows ({work_dir})")
+    for n, (tables, joins, filters) in enumerate(workload(args.queries, args.dimensions, args.categories), 1):
+        plan, planning = timed(planner.plan, tables, joins, filters)
+        naive = planner.naive_plan(tables, joins, filters)
+        planned_rows, planned_seconds = timed(lambda p: list(planner.execute(p)), plan)
+        naive_rows, naive_seconds = timed(lambda p: list(planner.execute(p)), naive)
+        if len(planned_rows) != len(naive_rows):
+            print(f"query {n}: row counts differ ({len(planned_rows)} != {len(naive_rows)})")
+            sys.exit(1)
+        totals["planning"] += planning
+        totals["planned"] += planned_seconds
+        totals["naive"] += naive_seconds
+        print(f"query {n:>2}: {' -> '.join(plan.tables):<40} {len(planned_rows):>7} rows  "
+              f"planned {planned_seconds:.3f}s (est. {plan.cost:,.0f})  "
+              f"naive {naive_seconds:.3f}s (est. {naive.cost:,.0f})")
+        if n == 1:
+            print(plan.explain())
+    print(f"total: planned {totals['planned']:.3f}s + {totals['planning'] * 1000:.1f}ms planning, "
+          f"naive {totals['naive']:.3f}s ({totals['naive'] / totals['planned']:.1f}x)")
+    planner.close()
+
+
+if __name__ == "__main__":
+    main()
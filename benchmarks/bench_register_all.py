@@ -0,0 +1,55 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_tenants(directory, n_databases, n_tables):
+    # One small per-tenant database per file, all with the same shape
+    for d in range(n_databases):
+        connection = sqlite3.connect(os.path.join(directory, f"tenant_{d:05d}.db"))
+        for t in range(n_tables):
+            fk = f", parent_id INT, FOREIGN KEY (parent_id) REFERENCES T{t - 1}(id)" if t > 0 else ""
+            connection.execute(f"CREATE TABLE T{t} (id INT PRIMARY KEY, name VARCHAR(20), value DECIMAL(5){fk});")
+        connection.commit()
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark register_all over many per-tenant databases")
+    parser.add_argument("--databases", type=int, default=500)
+    parser.add_argument("--tables", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--processes", action="store_true")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_register_all_")
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import register_all
+
+    tenants = os.path.join(work_dir, "tenants")
+    os.mkdir(tenants)
+    build_tenants(tenants, args.databases, args.tables)
+
+    for label, workers in (("serial", 1), (f"{args.workers} workers", args.workers)):
+        # Every run gets a fresh working directory, and so a fresh metadata.db
+        run_dir = os.path.join(work_dir, label.replace(" ", "_"))
+        os.mkdir(run_dir)
+        os.chdir(run_dir)
+
+        summary = register_all(tenants, workers=workers, processes=args.processes)
+        print(f"{label:>12}: {summary['changed']} databases, {summary['rows']} rows in {summary['seconds']:.3f}s "
+              f"({summary['changed'] / summary['seconds']:,.0f} databases/s)")
+
+    start = time.perf_counter()
+    summary = register_all(tenants, workers=args.workers, processes=args.processes)
+    print(f"{'re-sync':>12}: {summary['changed']} changed of {summary['databases']} "
+          f"in {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
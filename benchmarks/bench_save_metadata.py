@@ -0,0 +1,71 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_schema(db_name, n_tables, n_columns):
+    # Synthetic schema: every table has an id primary key, a unique code column,
+    # n_columns payload columns and a foreign key to the previous table
+    connection = sqlite3.connect(db_name)
+    cursor = connection.cursor()
+    for t in range(n_tables):
+        columns = ["id INT NOT NULL", "code VARCHAR(20)"]
+        columns += [f"c{c} VARCHAR(30)" for c in range(n_columns)]
+        constraints = ["PRIMARY KEY (id)", "UNIQUE (code)"]
+        if t > 0:
+            columns.append("parent_id INT")
+            constraints.append(f"FOREIGN KEY (parent_id) REFERENCES T{t - 1}(id)")
+        cursor.execute(f"CREATE TABLE T{t} ({', '.join(columns + constraints)});")
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DatabaseManager.save_metadata on a synthetic schema")
+    parser.add_argument("--tables", type=int, default=500)
+    parser.add_argument("--columns", type=int, default=20)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_save_metadata_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import DatabaseManager
+
+    build_schema("SYNTHETIC.db", args.tables, args.columns)
+    db_manager = DatabaseManager("SYNTHETIC.db")
+
+    start = time.perf_counter()
+    catalog = db_manager.harvest_catalog()
+    harvested = time.perf_counter()
+    rows = db_manager.save_metadata(catalog)
+    written = time.perf_counter()
+
+    total = written - start
+    print(f"schema: {args.tables} tables x {args.columns + 2} columns ({work_dir})")
+    print(f"harvest: {harvested - start:.3f}s")
+    print(f"write:   {written - harvested:.3f}s")
+    print(f"total:   {total:.3f}s for {rows} metadata rows ({rows / total:,.0f} rows/s)")
+
+    # Re-sync with nothing changed: only the schema_version is compared
+    start = time.perf_counter()
+    rows = db_manager.save_metadata()
+    print(f"unchanged refresh: {time.perf_counter() - start:.4f}s ({rows} rows written)")
+
+    # Change a few tables and refresh again: only those tables are re-harvested
+    changed = max(1, args.tables // 100)
+    for t in range(changed):
+        db_manager.cursor.execute(f"ALTER TABLE T{t} ADD COLUMN extra_{t} TEXT;")
+    db_manager.connection.commit()
+    start = time.perf_counter()
+    rows = db_manager.save_metadata()
+    print(f"refresh after {changed} altered tables: {time.perf_counter() - start:.4f}s ({rows} rows written)")
+    db_manager.close_connection()
+
+
+if __name__ == "__main__":
+    main()
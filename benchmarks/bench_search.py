@@ -0,0 +1,102 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ["customer", "order", "invoice", "payment", "account", "employee", "salary", "address", "city",
+         "country", "product", "price", "amount", "status", "created", "updated", "name", "email", "phone",
+         "ssn", "department", "manager", "project", "hours", "balance", "currency", "region", "shipment",
+         "vendor", "contract", "discount", "tax", "total", "quantity", "category", "description", "code"]
+TYPES = ["INT", "INTEGER", "VARCHAR(30)", "TEXT", "DECIMAL(10, 2)", "DATE", "REAL"]
+
+
+def catalog(rng, d, n_tables, n_columns, version=1):
+    # A harvested catalog (as manager.harvest_catalog returns it) with generated names
+    db_name = f"db_{d:03d}.db"
+    tables, columns, fingerprints = [], [], {}
+    for t in range(n_tables):
+        table_name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{d}_{t}".upper()
+        tables.append((table_name, db_name))
+        fingerprints[table_name] = f"{version}"
+        used = set()
+        for c in range(n_columns):
+            col_name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}"
+            if col_name in used:
+                col_name = f"{col_name}_{c}"
+            used.add(col_name)
+            columns.append((col_name, table_name, rng.choice(TYPES), int(c == 0), 0, 0, None))
+    return {"database": db_name, "tables": tables, "columns": columns, "foreign_keys": [],
+            "fingerprints": fingerprints, "schema_version": version}
+
+
+def latency(search, queries, **options):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        search.search(query, **options)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[int(len(timings) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the catalog search index and time queries against it")
+    parser.add_argument("--databases", type=int, default=50)
+    parser.add_argument("--tables", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_search_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import CatalogSearch, connect_metadata, write_catalog
+
+    # Every catalog goes through write_catalog, so the index is refreshed (index_catalog) as it would be
+    # by save_metadata
+    rng = random.Random(0)
+    metadata_connection = connect_metadata()
+    start = time.perf_counter()
+    for d in range(args.databases):
+        metadata_connection.execute("BEGIN;")
+        write_catalog(metadata_connection.cursor(), catalog(rng, d, args.tables, args.columns))
+        metadata_connection.commit()
+    build = time.perf_counter() - start
+    entries = metadata_connection.execute("SELECT count(*) FROM CATALOG_ENTRIES;").fetchall()[0][0]
+    print(f"{entries:,} names indexed in {build:.1f}s ({os.path.getsize('metadata.db') / 2 ** 20:,.0f} MiB metadata.db)")
+
+    # Re-harvest one database with one table changed: only that table's rows (and index entries) move
+    changed = catalog(random.Random(1), 0, 1, args.columns, version=2)
+    previous = catalog(random.Random(0), 0, args.tables, args.columns)
+    previous["tables"][0] = changed["tables"][0]
+    previous["columns"][:args.columns] = changed["columns"]
+    previous["fingerprints"] = {table_name: "1" for table_name, _ in previous["tables"]}
+    start = time.perf_counter()
+    metadata_connection.execute("BEGIN;")
+    written = write_catalog(metadata_connection.cursor(), previous)
+    metadata_connection.commit()
+    print(f"incremental re-sync: {written} rows written in {(time.perf_counter() - start) * 1000:.1f}ms")
+    metadata_connection.close()
+
+    search = CatalogSearch()
+    query_rng = random.Random(2)
+    prefix = [f"{query_rng.choice(WORDS)[:4]} {query_rng.choice(WORDS)[:3]}" for _ in range(args.queries)]
+    substring = [f"*{query_rng.choice(WORDS)[1:5]}*" for _ in range(args.queries)]
+    typos = []
+    for _ in range(args.queries):
+        word = f"{query_rng.choice(WORDS)}_{query_rng.choice(WORDS)}"
+        i = query_rng.randrange(len(word))
+        typos.append(word[:i] + query_rng.choice("aeiourst") + word[i + 1:])
+    for label, queries, options in (("prefix", prefix, {"fuzzy": False}), ("substring", substring, {"fuzzy": False}),
+                                    ("fuzzy", typos, {})):
+        p50, p99 = latency(search, queries, **options)
+        print(f"{label:<9} p50 {p50:.2f}ms  p99 {p99:.2f}ms  e.g. {queries[0]!r} -> "
+              f"{[r['name'] for r in search.search(queries[0], limit=3, **options)]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def client(host, port, paths, n_requests, latencies, errors):
+    # One keep-alive connection issuing n_requests GETs back to back
+    reader, writer = await asyncio.open_connection(host, port)
+    for i in range(n_requests):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode().partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "content-length" in headers:
+            await reader.readexactly(int(headers["content-length"]))
+        else:
+            while True:
+                size = int(await reader.readline(), 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    writer.close()
+
+
+async def run(args, paths):
+    from metadatabase import MetadataService
+
+    service = MetadataService(workers=args.workers)
+    host, port = await service.start("127.0.0.1", 0)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, paths, args.requests, latencies, errors)
+                           for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    await service.close()
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP/JSON metadata service on a local instance")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_service_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase.demo import seed_company
+
+    seed_company("COMPANY.db")
+    paths = ["/databases", "/databases/COMPANY.db/metadata",
+             "/databases/COMPANY.db/tables/EMPLOYEE/rows", "/databases/COMPANY.db/tables/WORKS_ON/rows?page_size=10"]
+
+    latencies, errors, elapsed = asyncio.run(run(args, paths))
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{args.clients} clients x {args.requests} requests, {args.workers} workers ({work_dir})")
+    print(f"requests: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:,.0f} requests/s), "
+          f"{len(errors)} errors")
+    print(f"latency:  p50 {quantiles[49] * 1000:.2f}ms  p99 {quantiles[98] * 1000:.2f}ms  "
+          f"max {latencies[-1] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
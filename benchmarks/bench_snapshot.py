@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_databases(directory, n_databases, n_tables, n_columns):
+    for d in range(n_databases):
+        connection = sqlite3.connect(os.path.join(directory, f"db_{d:03d}.db"))
+        for t in range(n_tables):
+            columns = ", ".join(f"c{c} VARCHAR(30)" for c in range(n_columns))
+            fk = f", parent INT REFERENCES T{d}_{t - 1}(id)" if t else ""
+            connection.execute(f"CREATE TABLE T{d}_{t} (id INTEGER PRIMARY KEY, {columns}{fk});")
+        connection.commit()
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare catalog lookups through metadata.db and the snapshot")
+    parser.add_argument("--databases", type=int, default=20)
+    parser.add_argument("--tables", type=int, default=250)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_snapshot_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import CatalogSnapshot, connect_metadata, register_all
+
+    os.mkdir("sources")
+    build_databases("sources", args.databases, args.tables, args.columns)
+    start = time.perf_counter()
+    register_all("sources", snapshot="metadata.snapshot")
+    print(f"{args.databases * args.tables:,} tables registered with their snapshot in "
+          f"{time.perf_counter() - start:.2f}s ({os.path.getsize('metadata.snapshot') / 2 ** 20:.1f} MiB snapshot, "
+          f"{os.path.getsize('metadata.db') / 2 ** 20:.1f} MiB metadata.db)")
+
+    rng = random.Random(0)
+    names = [f"T{rng.randrange(args.databases)}_{rng.randrange(args.tables)}" for _ in range(args.lookups)]
+
+    # Cold start: open the catalog and answer one lookup
+    start = time.perf_counter()
+    connection = connect_metadata()
+    connection.execute("SELECT name, type FROM COLUMNS WHERE table_name=?;", (names[0],)).fetchall()
+    sqlite_open = time.perf_counter() - start
+    start = time.perf_counter()
+    snapshot = CatalogSnapshot("metadata.snapshot")
+    snapshot.columns(names[0])
+    snapshot_open = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in names:
+        connection.execute("SELECT name, type, pk, not_null, unique_col, dflt_val FROM COLUMNS WHERE table_name=?;",
+                           (name,)).fetchall()
+    sqlite_lookups = time.perf_counter() - start
+    start = time.perf_counter()
+    for name in names:
+        snapshot.columns(name)
+    snapshot_lookups = time.perf_counter() - start
+    start = time.perf_counter()
+    for name in names:
+        snapshot.table_exists(name)
+    exists_lookups = time.perf_counter() - start
+
+    print(f"metadata.db: open + first lookup {sqlite_open * 1000:.2f}ms, "
+          f"columns() {sqlite_lookups / args.lookups * 1e6:.1f}us per lookup")
+    print(f"snapshot:    open + first lookup {snapshot_open * 1000:.2f}ms, "
+          f"columns() {snapshot_lookups / args.lookups * 1e6:.1f}us, "
+          f"table_exists() {exists_lookups / args.lookups * 1e6:.1f}us per lookup")
+    snapshot.close()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
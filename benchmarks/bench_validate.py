@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build(n_parents, n_children, missing):
+    # ORDERS.db holds CUSTOMERS and ORDERS; REMOTE.db holds a copy of ORDERS only, so the same
+    # foreign key is checked with the anti-join (parent in the same database) and with the hash
+    # set (parent registered in another database)
+    rng = random.Random(0)
+    connection = sqlite3.connect("ORDERS.db")
+    connection.execute("CREATE TABLE CUSTOMERS (id INTEGER PRIMARY KEY, name VARCHAR(30));")
+    connection.execute("CREATE TABLE ORDERS (id INTEGER PRIMARY KEY, customer INT REFERENCES CUSTOMERS(id), "
+                       "amount REAL);")
+    connection.executemany("INSERT INTO CUSTOMERS VALUES (?, ?);", ((i, f"customer {i}") for i in range(n_parents)))
+    step = n_children // missing
+    connection.executemany("INSERT INTO ORDERS VALUES (?, ?, ?);",
+                           ((i, n_parents + i if i % step == 0 else rng.randrange(n_parents), rng.random())
+                            for i in range(n_children)))
+    connection.commit()
+    connection.execute("ATTACH 'REMOTE.db' AS remote;")
+    connection.execute("CREATE TABLE remote.ORDERS (id INTEGER PRIMARY KEY, customer INT REFERENCES CUSTOMERS(id), "
+                       "amount REAL);")
+    connection.execute("INSERT INTO remote.ORDERS SELECT * FROM main.ORDERS;")
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time set-based foreign key validation against row-at-a-time checks")
+    parser.add_argument("--parents", type=int, default=1000000)
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--missing", type=int, default=1000, help="child rows with a dangling key")
+    parser.add_argument("--row-sample", type=int, default=200000, help="rows checked one at a time (extrapolated)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_validate_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import DatabaseManager
+
+    start = time.perf_counter()
+    build(args.parents, args.rows, args.missing)
+    print(f"{args.rows:,} child rows, {args.parents:,} parents built in {time.perf_counter() - start:.1f}s ({work_dir})")
+    for db_name in ("ORDERS.db", "REMOTE.db"):
+        DatabaseManager(db_name).save_metadata()
+
+    for db_name, label in (("ORDERS.db", "anti-join"), ("REMOTE.db", "hash set")):
+        db_manager = DatabaseManager(db_name, read_only=True)
+        start = time.perf_counter()
+        report = db_manager.validate_foreign_keys()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<10} {elapsed:6.2f}s  {args.rows / elapsed:>13,.0f} rows/s  "
+              f"{report[0]['violations']:,} violations ({report[0]['method']})")
+        db_manager.close_connection()
+
+    # Row at a time: one primary-key lookup per child row
+    connection = sqlite3.connect("ORDERS.db")
+    start = time.perf_counter()
+    violations = 0
+    for (customer,) in connection.execute("SELECT customer FROM ORDERS LIMIT ?;", (args.row_sample,)).fetchall():
+        if connection.execute("SELECT 1 FROM CUSTOMERS WHERE id=?;", (customer,)).fetchone() is None:
+            violations += 1
+    elapsed = time.perf_counter() - start
+    print(f"{'per row':<10} {elapsed * args.rows / args.row_sample:6.2f}s  "
+          f"{args.row_sample / elapsed:>13,.0f} rows/s  (extrapolated from {args.row_sample:,} rows)")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build(n_databases):
+    for i in range(n_databases):
+        connection = sqlite3.connect(f"DB{i:05d}.db")
+        connection.execute("CREATE TABLE ITEMS (id INTEGER PRIMARY KEY, name VARCHAR(30), price REAL);")
+        connection.execute("CREATE TABLE TAGS (item INT REFERENCES ITEMS(id), tag TEXT);")
+        connection.executemany("INSERT INTO ITEMS VALUES (?, ?, ?);", ((j, f"item {j}", j * 0.5) for j in range(10)))
+        connection.commit()
+        connection.close()
+
+
+def naive_poll(db_names):
+    # The same check without the stat gate: open every database and read its schema_version
+    versions = {}
+    for db_name in db_names:
+        connection = sqlite3.connect(db_name)
+        versions[db_name] = connection.execute("PRAGMA schema_version;").fetchall()[0][0]
+        connection.close()
+    return versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the change-data capture watcher over many registered files")
+    parser.add_argument("--databases", type=int, default=5000)
+    parser.add_argument("--changed", type=int, default=50, help="databases changed between polls (half DDL)")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_watch_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import CatalogWatcher, register_all
+
+    start = time.perf_counter()
+    build(args.databases)
+    register_all()
+    db_names = sorted(filename for filename in os.listdir() if filename.startswith("DB"))
+    print(f"{args.databases:,} databases built and registered in {time.perf_counter() - start:.1f}s ({work_dir})")
+
+    watcher = CatalogWatcher()
+    start = time.perf_counter()
+    watcher.poll()
+    print(f"{'first poll':<24}{(time.perf_counter() - start) * 1000:9.1f}ms  (opens every database)")
+
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        watcher.poll()
+        timings.append(time.perf_counter() - start)
+    idle = statistics.median(timings)
+    print(f"{'idle poll':<24}{idle * 1000:9.1f}ms  {args.databases / idle:>12,.0f} files/s")
+
+    timings = []
+    for _ in range(args.repeat):
+        naive_poll(db_names)
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        naive_poll(db_names)
+        timings.append(time.perf_counter() - start)
+    print(f"{'open every file':<24}{statistics.median(timings) * 1000:9.1f}ms")
+
+    timings = []
+    events = 0
+    for round_number in range(args.repeat):
+        for i, db_name in enumerate(db_names[round_number::max(1, len(db_names) // args.changed)][:args.changed]):
+            connection = sqlite3.connect(db_name)
+            if i % 2:
+                connection.execute(f"ALTER TABLE TAGS ADD COLUMN extra_{round_number} TEXT;")
+            else:
+                connection.execute("UPDATE ITEMS SET price = price + 1;")
+            connection.commit()
+            connection.close()
+        start = time.perf_counter()
+        events += len(watcher.poll())
+        timings.append(time.perf_counter() - start)
+    print(f"{f'{args.changed} changed':<24}{statistics.median(timings) * 1000:9.1f}ms  "
+          f"{events / args.repeat:.0f} events per poll, DDL re-harvested")
+    watcher.close()
+
+
+if __name__ == "__main__":
+    main()
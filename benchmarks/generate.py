@@ -0,0 +1,102 @@
+import argparse
+import datetime
+import random
+import sqlite3
+
+# Column types of the generated payload columns, with how to draw a value of each
+COLUMN_TYPES = [
+    ("INT", lambda rng, i: rng.randrange(1000000)),
+    ("VARCHAR(30)", lambda rng, i: f"{rng.choice(('alpha', 'beta', 'gamma', 'delta'))} {rng.randrange(100000)}"),
+    ("DECIMAL(10, 2)", lambda rng, i: round(rng.uniform(0, 10000), 2)),
+    ("DATE", lambda rng, i: (datetime.date(2000, 1, 1) + datetime.timedelta(days=rng.randrange(9000))).isoformat()),
+    ("TEXT", lambda rng, i: f"note {i}"),
+    ("REAL", lambda rng, i: rng.random()),
+]
+
+# Named scales for the suite; every value can be overridden on the command line
+SCALES = {
+    "small": {"tables": 50, "columns": 10, "fk_density": 1.0, "rows": 1000},
+    "medium": {"tables": 500, "columns": 20, "fk_density": 1.5, "rows": 10000},
+    "large": {"tables": 2000, "columns": 30, "fk_density": 2.0, "rows": 5000},
+}
+
+
+def generate_schema(tables, columns, fk_density, seed=0):
+    # A synthetic schema as a list of table specs. Every table has an INTEGER id primary key, a
+    # unique code and `columns` payload columns of mixed types. fk_density is the average number
+    # of foreign keys per table; each references the id of an earlier table, so the schema is
+    # acyclic and rows can be generated parents first.
+    rng = random.Random(seed)
+    schema = []
+    for t in range(tables):
+        payload = [(f"c{c}", rng.randrange(len(COLUMN_TYPES))) for c in range(columns)]
+        n_foreign_keys = 0
+        if t > 0:
+            n_foreign_keys = int(fk_density) + (rng.random() < fk_density - int(fk_density))
+        parents = sorted({rng.randrange(t) for _ in range(n_foreign_keys)})
+        schema.append({"name": f"T{t:05d}", "payload": payload,
+                       "foreign_keys": [(f"ref_{i}", f"T{parent:05d}") for i, parent in enumerate(parents)]})
+    return schema
+
+
+def create_table_sql(table):
+    columns = ["id INTEGER PRIMARY KEY", "code VARCHAR(20) UNIQUE"]
+    columns += [f"{name} {COLUMN_TYPES[kind][0]}" for name, kind in table["payload"]]
+    columns += [f"{col} INT REFERENCES {parent}(id)" for col, parent in table["foreign_keys"]]
+    return f"CREATE TABLE {table['name']} ({', '.join(columns)});"
+
+
+def generate_database(db_name, tables=50, columns=10, fk_density=1.0, rows=1000, seed=0, batch_size=10000):
+    # Create db_name with a generated schema and `rows` rows per table (foreign keys always point
+    # at existing parent rows). Same arguments, same file contents. Returns the schema specs.
+    schema = generate_schema(tables, columns, fk_density, seed)
+    rng = random.Random(seed + 1)
+    connection = sqlite3.connect(db_name)
+    try:
+        for table in schema:
+            connection.execute(create_table_sql(table))
+            if table["foreign_keys"]:
+                connection.execute(f"CREATE INDEX {table['name']}_{table['foreign_keys'][0][0]} "
+                                   f"ON {table['name']} ({table['foreign_keys'][0][0]});")
+        connection.commit()
+        for table in schema:
+            makers = [COLUMN_TYPES[kind][1] for _, kind in table["payload"]]
+            n_columns = 2 + len(makers) + len(table["foreign_keys"])
+            query = f"INSERT INTO {table['name']} VALUES ({', '.join('?' for _ in range(n_columns))});"
+            batch = []
+            for i in range(1, rows + 1):
+                batch.append((i, f"{table['name']}-{i}", *(make(rng, i) for make in makers),
+                              *(rng.randint(1, rows) for _ in table["foreign_keys"])))
+                if len(batch) >= batch_size:
+                    connection.executemany(query, batch)
+                    batch = []
+            if batch:
+                connection.executemany(query, batch)
+            connection.commit()
+    finally:
+        connection.close()
+    return schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic database")
+    parser.add_argument("database")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--tables", type=int)
+    parser.add_argument("--columns", type=int, help="payload columns per table")
+    parser.add_argument("--fk-density", type=float, help="average foreign keys per table")
+    parser.add_argument("--rows", type=int, help="rows per table")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+    schema = generate_database(args.database, seed=args.seed, **scale)
+    print(f"'{args.database}': {len(schema)} tables, "
+          f"{sum(len(table['foreign_keys']) for table in schema)} foreign keys, {scale['rows']:,} rows per table")
+
+
+if __name__ == "__main__":
+    main()
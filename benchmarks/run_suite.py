@@ -0,0 +1,240 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate import SCALES, generate_database
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function, repeat, setup=None):
+    # function() returns how many operations it did; setup() runs untimed before each repeat
+    timings = []
+    operations = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        operations = function()
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {"seconds": timings, "median": median, "min": min(timings), "operations": operations,
+            "per_second": operations / median if operations and median else None}
+
+
+def run_scenarios(DatabaseManager, CatalogSnapshot, connect_metadata, write_snapshot, schema, rows, repeat, lookups):
+    # Every scenario runs against DATA.db in the current directory
+    results = {}
+    names = [table["name"] for table in schema]
+    largest = names[0]
+    devnull = open(os.devnull, "w")
+
+    # save_metadata: from an empty metadata.db (a fresh directory each time), after the change
+    # of one table, and with nothing changed
+    runs = iter(range(repeat))
+
+    def cold_setup():
+        run_dir = os.path.abspath(f"cold_{next(runs)}")
+        os.mkdir(run_dir)
+        os.chdir(run_dir)
+
+    def cold():
+        db_manager = DatabaseManager(os.path.join(os.pardir, "DATA.db"))
+        written = db_manager.save_metadata()
+        db_manager.close_connection()
+        os.chdir(os.pardir)
+        return written
+
+    results["save_metadata.cold"] = measure(cold, repeat, cold_setup)
+    db_manager = DatabaseManager("DATA.db")
+    db_manager.save_metadata()
+    versions = iter(range(repeat))
+
+    def change_one_table():
+        db_manager.connection.execute(f"CREATE INDEX IF NOT EXISTS suite_{next(versions)} ON {largest} (code, id);")
+        db_manager.connection.commit()
+
+    results["save_metadata.one_table_changed"] = measure(db_manager.save_metadata, repeat, change_one_table)
+    results["save_metadata.unchanged"] = measure(lambda: db_manager.save_metadata() or 1, repeat)
+    db_manager.close_connection()
+
+    # show_database_metadata with a new manager (cold MetadataCache) each time
+    def show_metadata():
+        db_manager = DatabaseManager("DATA.db", read_only=True)
+        with contextlib.redirect_stdout(devnull):
+            db_manager.show_database_metadata()
+        db_manager.close_connection()
+        return len(names)
+
+    results["show_database_metadata"] = measure(show_metadata, repeat)
+
+    # show_table_data: a whole table, and one page in the middle of it
+    db_manager = DatabaseManager("DATA.db", read_only=True)
+
+    def show_all():
+        with contextlib.redirect_stdout(devnull):
+            db_manager.show_table_data(largest)
+        return rows
+
+    def show_page():
+        with contextlib.redirect_stdout(devnull):
+            db_manager.show_table_data(largest, page_size=100, after=rows // 2)
+        return 100
+
+    results["show_table_data.full"] = measure(show_all, repeat)
+    results["show_table_data.page"] = measure(show_page, repeat)
+    db_manager.close_connection()
+
+    # insert_data, one row per call (each call commits), and bulk_insert of the same rows
+    db_manager = DatabaseManager("DATA.db")
+    n_inserts = max(100, min(rows, 2000))
+    next_id = [rows + 1]
+
+    def insert_rows():
+        start_id = next_id[0]
+        with contextlib.redirect_stdout(devnull):
+            for i in range(start_id, start_id + n_inserts):
+                db_manager.insert_data(largest, {"id": i, "code": f"suite-{i}"})
+        next_id[0] += n_inserts
+        return n_inserts
+
+    def bulk_insert_rows():
+        start_id = next_id[0]
+        db_manager.bulk_insert(largest, ({"id": i, "code": f"suite-{i}"} for i in range(start_id, start_id + n_inserts)),
+                               progress=False)
+        next_id[0] += n_inserts
+        return n_inserts
+
+    results["insert_data"] = measure(insert_rows, repeat)
+    results["bulk_insert"] = measure(bulk_insert_rows, repeat)
+    db_manager.connection.execute(f"DELETE FROM {largest} WHERE id > ?;", (rows,))
+    db_manager.connection.commit()
+
+    # Catalog lookups: MetadataCache, COLUMNS in metadata.db and the mapped snapshot
+    rng = random.Random(0)
+    probes = [rng.choice(names) for _ in range(lookups)]
+
+    def cache_lookups():
+        for name in probes:
+            db_manager.column_exists(name, "code")
+        return lookups
+
+    metadata_connection = connect_metadata()
+
+    def metadata_lookups():
+        for name in probes:
+            metadata_connection.execute("SELECT name, type FROM COLUMNS WHERE table_name=? AND database=?;",
+                                        (name, "DATA.db")).fetchall()
+        return lookups
+
+    write_snapshot(metadata_connection, "metadata.snapshot")
+    snapshot = CatalogSnapshot("metadata.snapshot")
+
+    def snapshot_lookups():
+        for name in probes:
+            snapshot.column(name, "code")
+        return lookups
+
+    results["lookup.metadata_cache"] = measure(cache_lookups, repeat)
+    results["lookup.metadata_db"] = measure(metadata_lookups, repeat)
+    results["lookup.snapshot"] = measure(snapshot_lookups, repeat)
+    snapshot.close()
+    metadata_connection.close()
+    db_manager.close_connection()
+    devnull.close()
+    return results
+
+
+def compare(baseline, results):
+    # Median of every scenario against the baseline run; lower is better
+    lines = [f"{'scenario':<34}{'baseline':>12}{'current':>12}{'change':>10}"]
+    for name, result in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            lines.append(f"{name:<34}{'-':>12}{result['median'] * 1000:>10.2f}ms")
+            continue
+        change = (result["median"] / before["median"] - 1) * 100 if before["median"] else 0.0
+        lines.append(f"{name:<34}{before['median'] * 1000:>10.2f}ms{result['median'] * 1000:>10.2f}ms{change:>+9.1f}%")
+    if baseline["scale"] != results["scale"]:
+        lines.append(f"warning: different scales, {baseline['scale']} against {results['scale']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Timed scenarios on a generated database, saved as JSON")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--tables", type=int)
+    parser.add_argument("--columns", type=int, help="payload columns per table")
+    parser.add_argument("--fk-density", type=float, help="average foreign keys per table")
+    parser.add_argument("--rows", type=int, help="rows per table")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--output", help="results file (default: suite-SCALE-VERSION.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+    version = git_version()
+    output = os.path.abspath(args.output or f"suite-{args.scale}-{version or 'unknown'}.json")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_suite_")
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    from metadatabase import CatalogSnapshot, DatabaseManager, connect_metadata, write_snapshot
+
+    start = time.perf_counter()
+    schema = generate_database("DATA.db", seed=args.seed, **scale)
+    generated = time.perf_counter() - start
+    print(f"{scale} generated in {generated:.1f}s ({work_dir})")
+
+    results = {
+        "version": version,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "scale": dict(scale, seed=args.seed, name=args.scale),
+        "repeat": args.repeat,
+        "generate_seconds": generated,
+        "scenarios": run_scenarios(DatabaseManager, CatalogSnapshot, connect_metadata, write_snapshot, schema,
+                                   scale["rows"], args.repeat, args.lookups),
+    }
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=1)
+
+    for name, result in results["scenarios"].items():
+        rate = f"{result['per_second']:>14,.0f}/s" if result["per_second"] else ""
+        print(f"{name:<34}{result['median'] * 1000:>10.2f}ms{rate}")
+    print(f"results written to {output}")
+    if baseline is not None:
+        print()
+        print(compare(baseline, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,426 +1,273 @@
-import sqlite3
+import argparse
+import json
 import os
-class DatabaseManager:
-    def __init__(self, db_name):
-        self.db_name = db_name
-        self.connection = sqlite3.connect(db_name)
-        self.cursor = self.connection.cursor()
-
-    def save_metadata(self):
-        metadata_connection = sqlite3.connect("metadata.db")
-        metadata_cursor = metadata_connection.cursor()
-
-        # Insert database name into DATABASES table
-        metadata_cursor.execute("INSERT OR IGNORE INTO DATABASES VALUES (?);", (self.db_name,))
-        metadata_connection.commit()
-
-        # Insert table names into TABLES table
-        tables_query = "SELECT name FROM sqlite_master WHERE type='table';"
-        self.cursor.execute(tables_query)
-        tables = self.cursor.fetchall()
-
-        for table in tables:
-            table_name = table[0]
-            metadata_cursor.execute("INSERT OR IGNORE INTO TABLES VALUES (?, ?);", (table_name, self.db_name))
-            metadata_connection.commit()
-
-            # Insert columns metadata into COLUMNS table
-            columns_query = f"PRAGMA table_info({table_name});"
-            self.cursor.execute(columns_query)
-            columns = self.cursor.fetchall()
-
-            # Get unique columns
-            unique_columns_query = f"PRAGMA index_list({table_name});"
-            self.cursor.execute(unique_columns_query)
-            index_list = self.cursor.fetchall()
-
-            unique_columns = []
-            for index_info in index_list:
-                index_name = index_info[1]
-                index_info_query = f"PRAGMA index_info({index_name});"
-                self.cursor.execute(index_info_query)
-                index_columns = [col[2] for col in self.cursor.fetchall()]
-                unique_columns.extend(index_columns)
-
-            for col in columns:
-                col_name, col_type, not_null,dflt_value, pk = col[1], col[2], col[3], col[4], col[5]
-                # default_value_query = f"SELECT {col_name} FROM {table_name} WHERE {col_name} IS NOT NULL LIMIT 1;"
-                # self.cursor.execute(default_value_query)
-                # default_value = self.cursor.fetchone()
-                unique_indicator = "   1" if col_name in unique_columns else "   0"
-                # # Handle cases where values are None
-                # not_null = 1 if not_null else 0
-                # pk = 1 if pk == 1 else 0
-                # default_value = default_value[0] if default_value else None
-
-                metadata_cursor.execute("INSERT OR IGNORE INTO COLUMNS VALUES (?, ?, ?, ?, ?, ?, ?);",
-                                    (col_name, table_name, col_type, pk, not_null, unique_indicator,dflt_value))
-                metadata_connection.commit()
-
-            # Insert foreign keys into FOREIGN_KEY table
-            foreign_keys_query = f"PRAGMA foreign_key_list({table_name});"
-            self.cursor.execute(foreign_keys_query)
-            foreign_keys = self.cursor.fetchall()
-
-            for fk in foreign_keys:
-                col_name, ref_table, ref_col = fk[3], fk[2], fk[4]
-                metadata_cursor.execute("INSERT OR IGNORE INTO FOREIGN_KEY VALUES (?,?, ?);", (col_name,ref_table, ref_col))
-                metadata_connection.commit()
-
-    def table_exists(self, table_name):
-        query = f"SELECT name FROM sqlite_master WHERE type='table' AND name=?;"
-        self.cursor.execute(query, (table_name,))
-        return self.cursor.fetchone() is not None
-
-    def column_exists(self, table_name, column_name):
-        query = f"PRAGMA table_info({table_name});"
-        self.cursor.execute(query)
-        columns = [col[1] for col in self.cursor.fetchall()]
-        return column_name in columns
-
-    def create_table(self, table_name, columns, foreign_keys=None):
-        # Check if the table already exists
-        if self.table_exists(table_name):
-            print(f"Table {table_name} already exists.")
-            return
-
-        # Check if referenced table and column exist for each foreign key
-        for fk in (foreign_keys or []):
-            referenced_table, referenced_column = fk['table'], fk['referenced_column']
-            if not self.table_exists(referenced_table):
-                print(f"Referenced table {referenced_table} does not exist.")
-                return
-            if not self.column_exists(referenced_table, referenced_column):
-                print(f"Referenced column {referenced_column} in table {referenced_table} does not exist.")
-                return
-
-        # Build columns string
-        columns_str = ', '.join(columns)
-
-        # Build foreign keys string
-        foreign_keys_str = ', '.join(
-            [f"FOREIGN KEY ({fk['column']}) REFERENCES {fk['table']}({fk['referenced_column']})" for fk in
-             (foreign_keys or [])])
-
-        # Combine columns and foreign keys in the CREATE TABLE query
-        if foreign_keys_str == '':
-            query = f"CREATE TABLE {table_name} ({columns_str})"
-        else:
-            query = f"CREATE TABLE {table_name} ({columns_str}, {foreign_keys_str})"
-
-        # Execute the query
-        self.cursor.execute(query)
-        self.connection.commit()
-        print(f"Table {table_name} created successfully.")
-
-    def insert_data(self, table_name, values):
-        # Check if the table exists
-        if not self.table_exists(table_name):
-            print(f"Table {table_name} does not exist.")
-            return
-
-        # Build the INSERT query
-        columns_str = ', '.join(values.keys())
-        values_str = ', '.join(['?' for _ in values.values()])
-        query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});"
-
-        # Execute the query
-        self.cursor.execute(query, tuple(values.values()))
-        self.connection.commit()
-        print("Data inserted successfully.")
-    def close_connection(self):
-        self.connection.close()
-
-    def show_database_metadata(self):
-        # Fetch and print tables, columns, and constraints information
-        tables_query = "SELECT name FROM sqlite_master WHERE type='table';"
-        self.cursor.execute(tables_query)
-        tables = self.cursor.fetchall()
-
-        for table in tables:
-            table_name = table[0]
-            print(f"\n\nTable: {table_name}")
-
-            # Columns
-            columns_query = f"PRAGMA table_info({table_name});"
-            self.cursor.execute(columns_query)
-            columns = self.cursor.fetchall()
-
-            # Get primary key columns
-            pk_columns_query = f"PRAGMA table_info({table_name});"
-            self.cursor.execute(pk_columns_query)
-            pk_columns = [col[1] for col in self.cursor.fetchall() if col[5] == 1]  # col[5] is the "pk" column
-
-            # Get unique columns
-            unique_columns_query = f"PRAGMA index_list({table_name});"
-            self.cursor.execute(unique_columns_query)
-            index_list = self.cursor.fetchall()
-
-            unique_columns = []
-            for index_info in index_list:
-                index_name = index_info[1]
-                index_info_query = f"PRAGMA index_info({index_name});"
-                self.cursor.execute(index_info_query)
-                index_columns = [col[2] for col in self.cursor.fetchall()]
-                unique_columns.extend(index_columns)
-
-            unique_columns = list(set(unique_columns))  # Remove duplicates
-
-            # Print header for columns
-            print("{:<15} {:<15} {:<8} {:<15} {:<3} {:<6}".format("name", "type", "notnull", "  dflt_value", "pk",
-                                                                  "unique"))
-            print("-" * 70)
-
-
-            for col in columns:
-                cid, name, data_type, not_null, default_value, pk = col
-
-                # Handle cases where values are None
-                not_null = "   1" if not_null else "   0"
-                default_value = f"      {default_value}" if default_value is not None else "    none"
-                pk_indicator = "1" if name in pk_columns else "0"
-                unique_indicator = "   1" if name in unique_columns else "   0"
-
-                print("{:<15} {:<15} {:<8} {:<15} {:<3} {:<6}".format(name, data_type, not_null, default_value,
-                                                                      pk_indicator, unique_indicator))
-
-            # Foreign Keys
-            foreign_keys_query = f"PRAGMA foreign_key_list({table_name});"
-            self.cursor.execute(foreign_keys_query)
-            foreign_keys = self.cursor.fetchall()
-
-            if foreign_keys:
-                print("\nForeign Keys:")
-                for fk in foreign_keys:
-                    print(f"{fk[3]} references {fk[2]}({fk[4]})\n")
-
-    def show_table_data(self, table_name):
-        # Check if the table exists
-        if not self.table_exists(table_name):
-            print(f"\nTable {table_name} does not exist.")
-            return
-
-        # Fetch and print data from the table
-        query = f"SELECT * FROM {table_name};"
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-
-        if not rows:
-            print(f"No data found in table {table_name}.")
-            return
-
-        # Get column names
-        column_names = [description[0] for description in self.cursor.description]
-
-        # Calculate column widths based on the maximum length of header and data values
-        col_widths = [max(len(str(header)), max(len(str(row[i])) for row in rows)) for i, header in enumerate(column_names)]
-
-        # Print table header
-        header = " | ".join(f"{header:<{width}}" for header, width in zip(column_names, col_widths))
-        print(header)
-        print("-" * sum(col_widths + [len(column_names) - 1] * 3))  # separator line
-
-        # Print data rows
-        for row in rows:
-            row_str = " | ".join(f"{str(value):<{width}}" for value, width in zip(row, col_widths))
-            # print(row_str)
-            print(row_str)
-def show_existing_databases():
-    print("\nExisting Databases:")
-    for filename in os.listdir():
-        if filename.endswith(".db"):
-            print(filename)
-# ----------------------------------------------------------------------------------------------------------------------
-# Create metadata.db and necessary tables if they don't exist
-metadata_db_name = "metadata.db"
-
-metadata_connection = sqlite3.connect(metadata_db_name)
-metadata_cursor = metadata_connection.cursor()
-
-# Create DATABASES table
-metadata_cursor.execute("""
-    CREATE TABLE IF NOT EXISTS DATABASES (
-        name TEXT PRIMARY KEY
-    );
-""")
-
-# Create TABLES table
-metadata_cursor.execute("""
-    CREATE TABLE IF NOT EXISTS TABLES (
-        name TEXT PRIMARY KEY,
-        database TEXT,
-        FOREIGN KEY (database) REFERENCES DATABASES(name)
-    );
-""")
-
-# Create COLUMNS table
-metadata_cursor.execute("""
-    CREATE TABLE IF NOT EXISTS COLUMNS (
-        name TEXT,
-        table_name TEXT,
-        type TEXT,
-        pk INTEGER,
-        not_null INTEGER,
-        unique_col INTEGER,
-        dflt_val TEXT,
-        PRIMARY KEY (name, table_name),
-        FOREIGN KEY (table_name) REFERENCES TABLES(name)
-    );
-""")
-
-# Create FOREIGN_KEY table
-metadata_cursor.execute("""
-    CREATE TABLE IF NOT EXISTS FOREIGN_KEY (
-        col TEXT,
-        refrenced_table TEXT,
-        refrenced_col TEXT,
-        PRIMARY KEY (col),
-        FOREIGN KEY (col) REFERENCES COLUMNS(name),
-        FOREIGN KEY (refrenced_table) REFERENCES TABLES(name)
-        FOREIGN KEY (refrenced_col) REFERENCES COLUMNS(name)
-    );
-""")
-
-metadata_connection.commit()
-metadata_connection.close()
-################################################################################################################
-# Creating an example database
-db_manager = DatabaseManager("COMPANY.db")
-connection = sqlite3.connect("COMPANY.db")
-cursor = connection.cursor()
-
-
-cursor.execute("""
-CREATE TABLE EMPLOYEE
-( Fname           VARCHAR(10)   NOT NULL,
-  Minit           CHAR,
-  Lname           VARCHAR(20)      NOT NULL,
-  Ssn             CHAR(9)          NOT NULL,
-  Bdate           DATE,
-  Address         VARCHAR(30),
-  Sex             CHAR(1),
-  Salary          DECIMAL(5),
-  Super_ssn       CHAR(9),
-  Dno             INT               NOT NULL,
-PRIMARY KEY   (Ssn),
-FOREIGN KEY (Super_ssn) REFERENCES EMPLOYEE(Ssn),
-FOREIGN KEY  (Dno) REFERENCES DEPARTMENT(Dnumber));
-""")
-cursor.execute("""CREATE TABLE DEPARTMENT
-( Dname           VARCHAR(15)       NOT NULL,
-  Dnumber         INT               NOT NULL,
-  Mgr_ssn         CHAR(9)           NOT NULL,
-  Mgr_start_date  DATE,
-PRIMARY KEY (Dnumber),
-UNIQUE      (Dname),
-FOREIGN KEY (Mgr_ssn) REFERENCES EMPLOYEE(Ssn) );""")
-
-cursor.execute("""CREATE TABLE DEPT_LOCATIONS
-( Dnumber         INT               NOT NULL,
-  Dlocation       VARCHAR(15)       NOT NULL,
-PRIMARY KEY (Dnumber, Dlocation),
-FOREIGN KEY (Dnumber) REFERENCES DEPARTMENT(Dnumber) );
-""")
-cursor.execute("""CREATE TABLE PROJECT
-( Pname           VARCHAR(15)       NOT NULL,
-  Pnumber         INT               NOT NULL,
-  Plocation       VARCHAR(15),
-  Dnum            INT               NOT NULL,
-PRIMARY KEY (Pnumber),
-UNIQUE      (Pname),
-FOREIGN KEY (Dnum) REFERENCES DEPARTMENT(Dnumber) );
-""")
-cursor.execute("""CREATE TABLE WORKS_ON
-( Essn            CHAR(9)           NOT NULL,
-  Pno             INT               NOT NULL,
-  Hours           DECIMAL(3,1)      NOT NULL,
-PRIMARY KEY (Essn, Pno),
-FOREIGN KEY (Essn) REFERENCES EMPLOYEE(Ssn),
-FOREIGN KEY (Pno) REFERENCES PROJECT(Pnumber) );""")
-
-cursor.execute("""CREATE TABLE DEPENDENT
-( Essn            CHAR(9)           NOT NULL,
-  Dependent_name  VARCHAR(15)       NOT NULL,
-  Sex             CHAR,
-  Bdate           DATE,
-  Relationship    VARCHAR(8),
-PRIMARY KEY (Essn, Dependent_name),
-FOREIGN KEY (Essn) REFERENCES EMPLOYEE(Ssn) );
-""")
-cursor.execute("""INSERT INTO EMPLOYEE
-VALUES      ('John','B','Smith',123456789,'1965-01-09','731 Fondren, Houston TX','M',30000,333445555,5),
-            ('Franklin','T','Wong',333445555,'1965-12-08','638 Voss, Houston TX','M',40000,888665555,5),
-            ('Alicia','J','Zelaya',999887777,'1968-01-19','3321 Castle, Spring TX','F',25000,987654321,4),
-            ('Jennifer','S','Wallace',987654321,'1941-06-20','291 Berry, Bellaire TX','F',43000,888665555,4),
-            ('Ramesh','K','Narayan',666884444,'1962-09-15','975 Fire Oak, Humble TX','M',38000,333445555,5),
-            ('Joyce','A','English',453453453,'1972-07-31','5631 Rice, Houston TX','F',25000,333445555,5),
-            ('Ahmad','V','Jabbar',987987987,'1969-03-29','980 Dallas, Houston TX','M',25000,987654321,4),
-            ('James','E','Borg',888665555,'1937-11-10','450 Stone, Houston TX','M',55000,null,1);
-""")
-cursor.execute("""INSERT INTO DEPARTMENT
-VALUES      ('Research',5,333445555,'1988-05-22'),
-            ('Administration',4,987654321,'1995-01-01'),
-            ('Headquarters',1,888665555,'1981-06-19');
-""")
-cursor.execute("""INSERT INTO PROJECT
-VALUES      ('ProductX',1,'Bellaire',5),
-            ('ProductY',2,'Sugarland',5),
-            ('ProductZ',3,'Houston',5),
-            ('Computerization',10,'Stafford',4),
-            ('Reorganization',20,'Houston',1),
-            ('Newbenefits',30,'Stafford',4);
-""")
-cursor.execute("""INSERT INTO WORKS_ON
-VALUES     (123456789,1,32.5),
-           (123456789,2,7.5),
-           (666884444,3,40.0),
-           (453453453,1,20.0),
-           (453453453,2,20.0),
-           (333445555,2,10.0),
-           (333445555,3,10.0),
-           (333445555,10,10.0),
-           (333445555,20,10.0),
-           (999887777,30,30.0),
-           (999887777,10,10.0),
-           (987987987,10,35.0),
-           (987987987,30,5.0),
-           (987654321,30,20.0),
-           (987654321,20,15.0),
-           (888665555,20,16.0);
-""")
-cursor.execute("""INSERT INTO DEPENDENT
-VALUES      (333445555,'Alice','F','1986-04-04','Daughter'),
-            (333445555,'Theodore','M','1983-10-25','Son'),
-            (333445555,'Joy','F','1958-05-03','Spouse'),
-            (987654321,'Abner','M','1942-02-28','Spouse'),
-            (123456789,'Michael','M','1988-01-04','Son'),
-            (123456789,'Alice','F','1988-12-30','Daughter'),
-            (123456789,'Elizabeth','F','1967-05-05','Spouse');
-""")
-cursor.execute("""INSERT INTO DEPT_LOCATIONS
-VALUES      (1,'Houston'),
-            (4,'Stafford'),
-            (5,'Bellaire'),
-            (5,'Sugarland'),
-            (5,'Houston');
-""")
-# cursor.execute("""ALTER TABLE DEPARTMENT
-#  ADD CONSTRAINT Dep_emp ;
-# """)
-# cursor.execute("""ALTER TABLE EMPLOYEE
-#  ADD CONSTRAINT Emp_emp ;""")
-# cursor.execute("""ALTER TABLE EMPLOYEE
-#  ADD CONSTRAINT Emp_dno ;""")
-# cursor.execute("""ALTER TABLE EMPLOYEE
-#  ADD CONSTRAINT Emp_super ;
-#  """)
-connection.commit()
-db_manager.save_metadata()
-connection.close()
-
-
-################################################################################################################
+import sqlite3
+import sys
+import time
+
+from metadatabase import (CatalogSearch, CatalogSnapshot, CatalogWatcher, ConnectionPool, DatabaseManager, Job,
+                          JoinPlanner, instruments, open_metadata, register_all, show_existing_databases,
+                          write_snapshot)
+from metadatabase.instrument import metrics_report
+from metadatabase.integrity import format_report
+from metadatabase.snapshot import snapshot_name
+from metadatabase.demo import seed_company
+
+
+def run_command(argv):
+    # Non-interactive entry points, e.g. python main.py show-table COMPANY.db EMPLOYEE --page-size 50
+    parser = argparse.ArgumentParser(prog="main.py", description="Metadatabase commands")
+    parser.add_argument("--instrument", action="store_true", help="time operations and trace SQL statements")
+    parser.add_argument("--metrics", metavar="FILE", help="instrument, and write the metrics to FILE at the end")
+    parser.add_argument("--slow-ms", type=float, default=100, help="statements slower than this go to the slow log")
+    parser.add_argument("--slow-sample", type=float, default=1.0, help="fraction of slow statements logged")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    show_table = commands.add_parser("show-table", help="print the rows of a table, one page at a time")
+    show_table.add_argument("database")
+    show_table.add_argument("table")
+    show_table.add_argument("--page-size", type=int)
+    show_table.add_argument("--after", help="primary key of the last row already shown (comma-separated when composite)")
+
+    load = commands.add_parser("load", help="bulk insert the rows of a CSV or JSONL file into a table")
+    load.add_argument("database")
+    load.add_argument("table")
+    load.add_argument("file", help="a .csv file with a header line, or a .jsonl file")
+    load.add_argument("--batch-size", type=int, default=10000)
+    load.add_argument("--validate", action="store_true", help="check each batch's foreign keys before committing it")
+
+    export = commands.add_parser("export", help="write a table to a memory-mappable columnar file")
+    export.add_argument("database")
+    export.add_argument("table")
+    export.add_argument("file")
+    export.add_argument("--chunk-size", type=int, default=65536)
+
+    seed_demo = commands.add_parser("seed-demo", help="create the example COMPANY database and register it")
+    seed_demo.add_argument("database", nargs="?", default="COMPANY.db")
+
+    register = commands.add_parser("register-all", help="register every .db file of a directory in metadata.db")
+    register.add_argument("directory", nargs="?", default=".")
+    register.add_argument("--workers", type=int)
+    register.add_argument("--processes", action="store_true")
+    register.add_argument("--snapshot", help="also rewrite this catalog snapshot file")
+
+    snapshot = commands.add_parser("snapshot", help="write a memory-mappable snapshot of the whole catalog")
+    snapshot.add_argument("file", nargs="?", default=snapshot_name)
+
+    profile = commands.add_parser("profile", help="compute column statistics and store them in metadata.db")
+    profile.add_argument("database")
+    profile.add_argument("tables", nargs="*", help="tables to profile (all by default)")
+    profile.add_argument("--sample-size", type=int, help="sample tables with more rows than this")
+    profile.add_argument("--top-k", type=int, default=10)
+
+    explain = commands.add_parser("explain", help="show the cost-based plan of a join over registered tables")
+    explain.add_argument("tables", nargs="+")
+    explain.add_argument("--join", action="append", default=None, metavar="A.col=B.col",
+                         help="join condition (repeatable); by default the foreign keys between the tables")
+    explain.add_argument("--where", action="append", default=[], metavar="TABLE:condition",
+                         help="filter on one table (repeatable)")
+    explain.add_argument("--naive", action="store_true", help="also show the left-to-right plan")
+
+    validate = commands.add_parser("validate", help="check the rows of a database against its foreign keys")
+    validate.add_argument("database")
+    validate.add_argument("tables", nargs="*", help="tables to check (all by default)")
+    validate.add_argument("--sample", type=int, default=10, help="missing values to show per foreign key")
+
+    search = commands.add_parser("search", help="find registered databases, tables and columns by name")
+    search.add_argument("query", help="words to match as prefixes, *text* for a substring")
+    search.add_argument("--kind", choices=["database", "table", "column"])
+    search.add_argument("--database")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--exact", action="store_true", help="no fuzzy matches")
+
+    job = commands.add_parser("job", help="run an SQL aggregate over registered tables in parallel, resumable")
+    job.add_argument("name", help="the job's checkpoints are kept under this name")
+    job.add_argument("sql", help="query with {table} for each partition, e.g. \"SELECT count(*) FROM {table}\"")
+    job.add_argument("--combine", default="sum", help="comma-separated: sum, count, min, max or top:K per value")
+    job.add_argument("--group-by", type=int, default=0, help="leading columns of the result that are keys")
+    job.add_argument("--tables", nargs="+", help="table names to run over (all registered tables by default)")
+    job.add_argument("--databases", nargs="+")
+    job.add_argument("--split-rows", type=int, help="split tables into rowid ranges of this many rowids")
+    job.add_argument("--workers", type=int)
+    job.add_argument("--restart", action="store_true", help="drop the job's checkpoints and run it from scratch")
+
+    watch = commands.add_parser("watch", help="log schema and data changes of registered databases, re-harvesting them")
+    watch.add_argument("--interval", type=float, default=1.0, help="seconds between polls")
+    watch.add_argument("--max-open", type=int, default=256, help="read-only connections kept open")
+    watch.add_argument("--no-data", action="store_true", help="only log schema changes")
+    watch.add_argument("--snapshot", help="also rewrite this catalog snapshot file after schema changes")
+    watch.add_argument("--once", action="store_true", help="poll once and exit")
+
+    report = commands.add_parser("report", help="summarize the hot spots of a metrics file written with --metrics")
+    report.add_argument("file", nargs="?", default="metrics.json")
+    report.add_argument("--top", type=int, default=10)
+
+    service = commands.add_parser("serve", help="run the HTTP/JSON metadata service")
+    service.add_argument("--host", default="127.0.0.1")
+    service.add_argument("--port", type=int, default=8765)
+    service.add_argument("--workers", type=int, default=8, help="threads running the SQLite calls")
+    service.add_argument("--base-dir", default=".", help="directory whose .db files may be registered over HTTP")
+
+    args = parser.parse_args(argv)
+    if args.instrument or args.metrics:
+        instruments.enable(slow_threshold=args.slow_ms / 1000, slow_sample=args.slow_sample)
+    try:
+        return run_parsed(args)
+    finally:
+        if args.metrics:
+            instruments.write_metrics(args.metrics)
+
+
+def run_parsed(args):
+    if args.command == "show-table":
+        if not os.path.exists(args.database):
+            print(f"Database '{args.database}' not found.")
+            return 1
+        db_manager = DatabaseManager(args.database)
+        after = args.after.split(",") if args.after is not None else None
+        db_manager.show_table_data(args.table, page_size=args.page_size, after=after)
+        db_manager.close_connection()
+    elif args.command == "load":
+        if not os.path.exists(args.database):
+            print(f"Database '{args.database}' not found.")
+            return 1
+        db_manager = DatabaseManager(args.database)
+        load = db_manager.load_jsonl if args.file.endswith(".jsonl") else db_manager.load_csv
+        try:
+            load(args.table, args.file, batch_size=args.batch_size, validate=args.validate)
+        except sqlite3.IntegrityError as e:
+            print(e)
+            return 1
+        finally:
+            db_manager.close_connection()
+    elif args.command == "export":
+        if not os.path.exists(args.database):
+            print(f"Database '{args.database}' not found.")
+            return 1
+        db_manager = DatabaseManager(args.database, read_only=True)
+        try:
+            table = db_manager.export_columns(args.table, args.chunk_size)
+        except ValueError as e:
+            print(e)
+            return 1
+        finally:
+            db_manager.close_connection()
+        size = table.write(args.file)
+        print(f"{table.rows} rows of {args.table} written to '{args.file}' ({size:,} bytes).")
+    elif args.command == "seed-demo":
+        seed_company(args.database)
+    elif args.command == "register-all":
+        summary = register_all(args.directory, workers=args.workers, processes=args.processes,
+                               snapshot=args.snapshot)
+        print(f"{summary['changed']} of {summary['databases']} databases changed, "
+              f"{summary['rows']} metadata rows written in {summary['seconds']:.2f}s")
+        for db_name, error in summary["failed"].items():
+            print(f"Failed to read '{db_name}': {error}")
+    elif args.command == "profile":
+        if not os.path.exists(args.database):
+            print(f"Database '{args.database}' not found.")
+            return 1
+        db_manager = DatabaseManager(args.database, read_only=True)
+        db_manager.save_metadata()
+        rows = db_manager.save_statistics(args.tables or None, args.sample_size, args.top_k)
+        print(f"{rows} statistics rows written for '{args.database}'.")
+        db_manager.close_connection()
+    elif args.command == "snapshot":
+        with open_metadata() as metadata_connection:
+            write_snapshot(metadata_connection, args.file)
+        with CatalogSnapshot(args.file) as catalog:
+            print(f"Snapshot of {catalog.n_tables} tables and {catalog.n_columns} columns "
+                  f"written to '{args.file}'.")
+    elif args.command == "explain":
+        joins = None
+        if args.join is not None:
+            joins = []
+            for join in args.join:
+                left, right = (side.strip().split(".", 1) for side in join.split("=", 1))
+                joins.append((left[0], left[1], right[0], right[1]))
+        filters = dict(where.split(":", 1) for where in args.where)
+        planner = JoinPlanner()
+        try:
+            print(planner.plan(args.tables, joins, filters).explain())
+            if args.naive:
+                print(planner.naive_plan(args.tables, joins, filters).explain())
+        except ValueError as e:
+            print(e)
+            return 1
+        finally:
+            planner.close()
+    elif args.command == "validate":
+        if not os.path.exists(args.database):
+            print(f"Database '{args.database}' not found.")
+            return 1
+        db_manager = DatabaseManager(args.database, read_only=True)
+        report = db_manager.validate_foreign_keys(args.tables or None, args.sample)
+        db_manager.close_connection()
+        if not report:
+            print(f"No foreign keys to check in '{args.database}'.")
+            return 0
+        print(format_report(report))
+        if any(result["violations"] for result in report):
+            return 1
+    elif args.command == "search":
+        results = CatalogSearch().search(args.query, args.kind, args.database, args.limit, fuzzy=not args.exact)
+        if not results:
+            print(f"Nothing matches '{args.query}'.")
+            return 1
+        for result in results:
+            location = ".".join(part for part in (result["database"], result["table"]) if part != result["name"])
+            col_type = f" {result['type']}" if result["type"] else ""
+            print(f"{result['kind']:<8} {result['name']}{col_type}  ({location})" if location else
+                  f"{result['kind']:<8} {result['name']}")
+    elif args.command == "job":
+        try:
+            job = Job(args.name, args.sql, combine=args.combine.split(","), group_by=args.group_by,
+                      tables=args.tables, databases=args.databases, split_rows=args.split_rows, workers=args.workers)
+            summary = job.run(restart=args.restart)
+        except (ValueError, sqlite3.Error) as e:
+            print(e)
+            return 1
+        for row in summary["rows"]:
+            print(" | ".join(str(value) for value in row))
+        print(f"{summary['ran']} of {summary['partitions']} partitions run ({summary['resumed']} from checkpoints) "
+              f"in {summary['seconds']:.2f}s")
+        for partition, error in summary["failed"].items():
+            print(f"Failed partition {partition}: {error}")
+        if summary["failed"]:
+            return 1
+    elif args.command == "watch":
+        watcher = CatalogWatcher(interval=args.interval, max_open=args.max_open, data_events=not args.no_data,
+                                 snapshot=args.snapshot)
+
+        def print_events(events):
+            for event in events:
+                table = f" {event['action']} {event['table']}" if event["table"] else ""
+                print(f"{time.strftime('%H:%M:%S', time.localtime(event['at']))} {event['database']}: "
+                      f"{event['kind']}{table}")
+
+        try:
+            watcher.watch(1 if args.once else None, print_events)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+    elif args.command == "report":
+        if not os.path.exists(args.file):
+            print(f"Metrics file '{args.file}' not found.")
+            return 1
+        with open(args.file) as metrics_file:
+            print(metrics_report(json.load(metrics_file), args.top))
+    elif args.command == "serve":
+        from metadatabase.service import serve  # asyncio is only needed here
+        serve(args.host, args.port, args.workers, args.base_dir)
+    return 0
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
+    # One pool for the whole session, so the menu does not reconnect on every action
+    pool = ConnectionPool()
     while True:
         print("\nDatabase Management Menu:")
         print("1. Create a new database")
@@ -436,7 +283,7 @@ if __name__ == "__main__":
             db_name = input("Enter the name of the new database: ")
             if not db_name.endswith(".db"):
                 db_name += ".db"
-            db_manager = DatabaseManager(db_name)
+            db_manager = DatabaseManager(db_name, pool=pool)
 
             while True:
                 table_name = input("Enter table name (or 'back' to go back): ")
@@ -477,7 +324,7 @@ if __name__ == "__main__":
                     db_name += ".db"
 
                 if os.path.exists(db_name):
-                    db_manager = DatabaseManager(db_name)
+                    db_manager = DatabaseManager(db_name, pool=pool)
                     db_manager.show_database_metadata()
                     db_manager.close_connection()
                 else:
@@ -486,6 +333,7 @@ if __name__ == "__main__":
         elif choice == "5":
             # Option to exit the application
             print("Bye ._.")
+            pool.close()
             break
 
         elif choice == "3":
@@ -500,15 +348,13 @@ if __name__ == "__main__":
                     db_name += ".db"
 
                 if os.path.exists(db_name):
-                    db_manager = DatabaseManager(db_name)
+                    db_manager = DatabaseManager(db_name, pool=pool)
                     db_manager.show_database_metadata()
 
                     table_name = input("Enter the name of the existing table to insert data: ")
                     if db_manager.table_exists(table_name):
                         # Get the columns of the table
-                        columns_query = f"PRAGMA table_info({table_name});"
-                        db_manager.cursor.execute(columns_query)
-                        columns = [col[1] for col in db_manager.cursor.fetchall()]
+                        columns = db_manager.metadata.column_names(table_name)
 
                         # Prompt for values for all columns
                         values = {}
@@ -535,7 +381,7 @@ if __name__ == "__main__":
                     db_name += ".db"
 
                 if os.path.exists(db_name):
-                    db_manager = DatabaseManager(db_name)
+                    db_manager = DatabaseManager(db_name, pool=pool)
                     #db_manager.show_database_info()
 
                     # Show data for each table
@@ -559,7 +405,6 @@ if __name__ == "__main__":
 
 # todo: add unique constraint,
 #       create database doesn't work
-#       check the foreign key constraint
 #       adding tuples to the tables
 #       showing the tables data
 
@@ -0,0 +1,73 @@
+# Metadatabase: metadata management, global query of independent databases and
+# distributed data processing over a catalog of SQLite databases (metadata.db).
+# Importing the package does no file I/O; metadata.db is created on first use.
+# The modules are imported on first use of one of their names (PEP 562), so `import metadatabase`
+# stays cheap: the service alone would pull in asyncio.
+import importlib
+
+_MODULES = {
+    "columnar": ["ColumnarTable", "export_table", "read_columnar"],
+    "global_query": ["GlobalQuery"],
+    "graph": ["ForeignKeyGraph"],
+    "instrument": ["Instrumentation", "instruments"],
+    "integrity": ["ForeignKeyValidator"],
+    "jobs": ["Job"],
+    "manager": ["DatabaseManager", "MetadataCache", "register_all", "show_existing_databases"],
+    "planner": ["JoinPlan", "JoinPlanner"],
+    "pool": ["ConnectionPool"],
+    "profiler": ["HyperLogLog", "profile_table"],
+    "search": ["CatalogSearch"],
+    "service": ["MetadataService", "serve"],
+    "snapshot": ["CatalogSnapshot", "write_snapshot"],
+    "store": ["connect_metadata", "ensure_metadata_schema", "open_metadata", "stored_statistics", "write_catalog",
+              "write_statistics"],
+    "watch": ["CatalogWatcher", "read_changes"],
+}
+_LOCATIONS = {name: module for module, names in _MODULES.items() for name in names}
+
+
+def __getattr__(name):
+    if name not in _LOCATIONS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_LOCATIONS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LOCATIONS))
+
+
+__all__ = [
+    "CatalogSearch",
+    "CatalogSnapshot",
+    "CatalogWatcher",
+    "ColumnarTable",
+    "ConnectionPool",
+    "DatabaseManager",
+    "ForeignKeyGraph",
+    "ForeignKeyValidator",
+    "GlobalQuery",
+    "HyperLogLog",
+    "Instrumentation",
+    "Job",
+    "JoinPlan",
+    "JoinPlanner",
+    "MetadataCache",
+    "MetadataService",
+    "connect_metadata",
+    "ensure_metadata_schema",
+    "export_table",
+    "instruments",
+    "open_metadata",
+    "profile_table",
+    "read_changes",
+    "read_columnar",
+    "register_all",
+    "serve",
+    "show_existing_databases",
+    "stored_statistics",
+    "write_catalog",
+    "write_snapshot",
+    "write_statistics",
+]
@@ -0,0 +1,290 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from .sqlutil import quote_name
+
+# On-disk layout of a columnar file:
+#   8 bytes magic, 4 bytes header length (little endian), JSON header, then every buffer at an
+#   offset aligned to 64 bytes. The header describes each column's buffers by (offset, length):
+#   "data" (int64, float64 or int32 dictionary codes), "validity" (one bit per row, 1 = not NULL,
+#   absent when the column has no NULLs), and for strings "dictionary_offsets" (int64, n + 1)
+#   and "dictionary_data" (the UTF-8 values back to back). Buffers are in native byte order,
+#   recorded in the header, so a reader maps them without copying.
+MAGIC = b"MDCOLS1\0"
+ALIGNMENT = 64
+
+# kind -> array typecode of the data buffer
+TYPECODES = {"int": "q", "float": "d", "string": "i"}
+NUMPY_DTYPES = {"q": "int64", "d": "float64", "i": "int32"}
+
+
+def column_kind(col_type):
+    # SQLite's type affinity rules applied to the declared type: INTEGER affinity gives int64,
+    # REAL and NUMERIC (DECIMAL, ...) give float64, TEXT, BLOB and dates are dictionary-encoded
+    col_type = (col_type or "").upper()
+    if "INT" in col_type:
+        return "int"
+    if any(word in col_type for word in ("CHAR", "CLOB", "TEXT")) or not col_type or "BLOB" in col_type:
+        return "string"
+    if any(word in col_type for word in ("DATE", "TIME")):
+        return "string"
+    return "float"
+
+
+class Column:
+    def __init__(self, name, col_type, kind, data, validity=None, dictionary=None):
+        self.name = name
+        self.type = col_type
+        self.kind = kind
+        self.data = data  # array.array, or a memoryview of a mapped file
+        self.validity = validity  # bytes-like bitmap, None when there are no NULLs (or for strings)
+        self.dictionary = dictionary  # list of str for string columns, whose NULLs have code -1
+
+    def __len__(self):
+        return len(self.data)
+
+    def is_valid(self, i):
+        return self.validity is None or bool(self.validity[i >> 3] & (1 << (i & 7)))
+
+    def null_count(self):
+        if self.kind == "string":
+            return self.data.tolist().count(-1)
+        if self.validity is None:
+            return 0
+        # The bits past the last row are padding (set), so they are masked off
+        rows = len(self)
+        valid = int.from_bytes(bytes(self.validity[:(rows + 7) // 8]), "little") & ((1 << rows) - 1)
+        return rows - bin(valid).count("1")
+
+    def numpy(self):
+        # The data buffer as a NumPy array, without copying (string columns give their codes)
+        import numpy
+        return numpy.frombuffer(self.data, dtype=NUMPY_DTYPES[TYPECODES[self.kind]])
+
+    def values(self):
+        # Back to Python values, with None for NULL
+        if self.kind == "string":
+            dictionary = self.dictionary
+            return [dictionary[code] if code >= 0 else None for code in self.data]
+        return [value if self.is_valid(i) else None for i, value in enumerate(self.data)]
+
+
+class ColumnarTable:
+    def __init__(self, name, columns, rows, mapped=None):
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+        self.mapped = mapped
+
+    def __getitem__(self, name):
+        for column in self.columns:
+            if column.name == name:
+                return column
+        raise KeyError(name)
+
+    def nbytes(self):
+        # Size of the buffers (dictionaries counted as their UTF-8 length)
+        total = 0
+        for column in self.columns:
+            total += len(column.data) * column.data.itemsize
+            total += len(column.validity) if column.validity is not None else 0
+            total += sum(len(value.encode()) + 8 for value in column.dictionary or [])
+        return total
+
+    def write(self, path):
+        buffers = []
+        header = {"table": self.name, "rows": self.rows, "byteorder": sys.byteorder, "columns": []}
+        for column in self.columns:
+            entry = {"name": column.name, "type": column.type, "kind": column.kind,
+                     "data": len(buffers)}
+            buffers.append(memoryview(column.data).cast("B"))
+            if column.validity is not None:
+                entry["validity"] = len(buffers)
+                buffers.append(bytes(column.validity))
+            if column.dictionary is not None:
+                encoded = [value.encode() for value in column.dictionary]
+                offsets = array("q", [0])
+                for value in encoded:
+                    offsets.append(offsets[-1] + len(value))
+                entry["dictionary_offsets"] = len(buffers)
+                buffers.append(memoryview(offsets).cast("B"))
+                entry["dictionary_data"] = len(buffers)
+                buffers.append(b"".join(encoded))
+            header["columns"].append(entry)
+
+        # The buffers start after the header, which is sized with room for the offsets it will
+        # hold (at most 20 digits each) before they are known
+        header["buffers"] = [[0, len(buffer)] for buffer in buffers]
+        position = _align(len(MAGIC) + 4 + len(json.dumps(header).encode()) + 20 * len(buffers))
+        for entry in header["buffers"]:
+            entry[0] = position
+            position = _align(position + entry[1])
+        encoded_header = json.dumps(header).encode()
+
+        with open(path, "wb") as columnar_file:
+            columnar_file.write(MAGIC + struct.pack("<I", len(encoded_header)) + encoded_header)
+            for (offset, _), buffer in zip(header["buffers"], buffers):
+                columnar_file.write(b"\0" * (offset - columnar_file.tell()))
+                columnar_file.write(buffer)
+            return columnar_file.tell()
+
+    def close(self):
+        # Release the views before the mapping they point into
+        if self.mapped is not None:
+            for column in self.columns:
+                column.data.release()
+                if column.validity is not None:
+                    column.validity.release()
+            self.mapped.close()
+            self.mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def read_columnar(path):
+    # Map a columnar file: the data and validity buffers are memoryviews of the mapping, so
+    # nothing is read until it is used and processes reading the same file share its pages
+    with open(path, "rb") as columnar_file:
+        mapped = mmap.mmap(columnar_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        mapped.close()
+        raise ValueError(f"'{path}' is not a columnar file.")
+    header_length = struct.unpack_from("<I", mapped, len(MAGIC))[0]
+    header = json.loads(mapped[len(MAGIC) + 4:len(MAGIC) + 4 + header_length])
+    if header["byteorder"] != sys.byteorder:
+        mapped.close()
+        raise ValueError(f"'{path}' was written on a {header['byteorder']} endian machine.")
+
+    view = memoryview(mapped)
+
+    def buffer(index):
+        offset, length = header["buffers"][index]
+        return view[offset:offset + length]
+
+    columns = []
+    for entry in header["columns"]:
+        data = buffer(entry["data"]).cast(TYPECODES[entry["kind"]])
+        validity = buffer(entry["validity"]) if "validity" in entry else None
+        dictionary = None
+        if "dictionary_offsets" in entry:
+            offsets = buffer(entry["dictionary_offsets"]).cast("q")
+            values = buffer(entry["dictionary_data"])
+            dictionary = [bytes(values[offsets[i]:offsets[i + 1]]).decode() for i in range(len(offsets) - 1)]
+            offsets.release()
+            values.release()
+        columns.append(Column(entry["name"], entry["type"], entry["kind"], data, validity, dictionary))
+    view.release()
+    return ColumnarTable(header["table"], columns, header["rows"], mapped)
+
+
+def export_table(connection, table_name, types, chunk_size=65536):
+    # Read a table in chunks of chunk_size rows into typed column buffers. types maps column
+    # names to declared types; the buffers are sized from count(*) up front and filled chunk by
+    # chunk, inside one read transaction so the count and the scan see the same rows.
+    in_transaction = connection.in_transaction
+    if not in_transaction:
+        connection.execute("BEGIN;")
+    try:
+        rows = connection.execute(f"SELECT count(*) FROM {quote_name(table_name)};").fetchall()[0][0]
+        cursor = connection.execute(f"SELECT * FROM {quote_name(table_name)};")
+        names = [description[0] for description in cursor.description]
+        builders = [_ColumnBuilder(name, types.get(name), rows) for name in names]
+        start = 0
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for builder, values in zip(builders, zip(*chunk)):
+                builder.fill(start, values)
+            start += len(chunk)
+    finally:
+        if not in_transaction:
+            connection.rollback()
+    return ColumnarTable(table_name, [builder.column(start) for builder in builders], start)
+
+
+class _ColumnBuilder:
+    def __init__(self, name, col_type, rows):
+        self.name = name
+        self.type = col_type
+        self.kind = column_kind(col_type)
+        typecode = TYPECODES[self.kind]
+        self.data = array(typecode, bytes(rows * array(typecode).itemsize))
+        self.validity = None
+        self.index = {None: -1}  # value -> dictionary code, in order of first appearance
+
+    def fill(self, start, values):
+        if self.kind == "string":
+            # Dictionary values are text, so 1 and '1' (columns without a declared type keep both)
+            # share one entry. New values are found with dict.fromkeys and the codes looked up with
+            # map, both in C.
+            if set(map(type, values)) - {str, type(None)}:
+                values = [value if value is None else _text(value) for value in values]
+            index = self.index
+            for value in dict.fromkeys(values):
+                if value not in index:
+                    index[value] = len(index) - 1
+            self.data[start:start + len(values)] = array("i", map(index.__getitem__, values))
+            return
+
+        if None in values:
+            if self.validity is None:
+                self.validity = bytearray(b"\xff" * ((len(self.data) + 7) // 8))
+            for i, value in enumerate(values):
+                if value is None:
+                    self.validity[(start + i) >> 3] &= ~(1 << ((start + i) & 7)) & 0xFF
+            values = [0 if value is None else value for value in values]
+        try:
+            chunk = array(TYPECODES[self.kind], values)
+        except (TypeError, OverflowError):
+            values = [self._convert(value) for value in values]
+            try:
+                chunk = array(TYPECODES[self.kind], values)
+            except OverflowError:
+                # Whole numbers beyond int64 (REALs stored in an INTEGER column): the column is
+                # kept as float64 instead
+                self.kind = "float"
+                self.data = array("d", self.data)
+                chunk = array("d", values)
+        self.data[start:start + len(chunk)] = chunk
+
+    def _convert(self, value):
+        # SQLite lets any column hold any type: accept values that convert without loss
+        try:
+            converted = float(value)
+            if self.kind == "int":
+                if not converted.is_integer():
+                    raise ValueError
+                converted = int(converted)
+            return converted
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f"Column {self.name} ({self.type}) holds a {type(value).__name__} "
+                             f"that is not a number: {value!r}") from None
+
+    def column(self, rows):
+        # rows is below the counted size only if the table shrank, which the transaction rules out
+        del self.data[rows:]
+        dictionary = None
+        if self.kind == "string":
+            dictionary = [value for value in self.index if value is not None]
+        return Column(self.name, self.type, self.kind, self.data, self.validity, dictionary)
+
+
+def _text(value):
+    # Dictionary values are text: blobs are kept as hex, numbers in text columns as their str()
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
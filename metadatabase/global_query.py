@@ -0,0 +1,248 @@
+import pathlib
+import sqlite3
+
+from .pool import open_source
+from .sqlutil import WHERE_END, quote_name, sql_tokens
+from .store import open_metadata
+
+
+class GlobalQuery:
+    # Runs SQL written against logical table names over every database registered in metadata.db.
+    # Each table is resolved to its database through the TABLES/DATABASES meta-relations and the
+    # databases are ATTACHed read-only onto one reused in-memory connection, where a temp view per
+    # logical name points at the attached table. When a query needs more databases than SQLite can
+    # attach at once, the tables are copied in with their projections and filters pushed down to the
+    # source, and the query runs over those copies instead.
+    # databases limits the query to some registered databases, e.g. when a table name is
+    # registered in more than one of them.
+    # With a pool, metadata.db and the sources copied from in the fallback are read through pooled
+    # connections. The in-memory connection the databases are attached to is this object's own: its
+    # ATTACHes and temp views last as long as it does and must not be handed to other pool users.
+    def __init__(self, metadata_db=None, attach_limit=None, databases=None, pool=None):
+        self.metadata_db = metadata_db
+        self.pool = pool
+        self.databases = set(databases) if databases is not None else None
+        self.connection = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+        self.cursor = self.connection.cursor()
+        if attach_limit is None:
+            attach_limit = self.connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        self.attach_limit = attach_limit
+        self.attached = {}  # database -> schema alias, in least recently used order
+        self.attach_count = 0
+        self.views = {}  # database -> logical table names with a temp view
+        self.copies = []  # temp tables of the last fallback query
+        self.load_catalog()
+
+    def load_catalog(self):
+        # Table name -> [(table, database)] and (database, table name) -> column names,
+        # read once from metadata.db
+        with open_metadata(self.pool, self.metadata_db) as metadata_connection:
+            self.tables = {}
+            for table_name, database in metadata_connection.execute("SELECT name, database FROM TABLES;"):
+                if self.databases is None or database in self.databases:
+                    self.tables.setdefault(table_name.lower(), []).append((table_name, database))
+            self.columns = {}
+            for col_name, table_name, database in metadata_connection.execute(
+                    "SELECT name, table_name, database FROM COLUMNS;"):
+                self.columns.setdefault((database, table_name.lower()), []).append(col_name)
+
+    def resolve(self, sql):
+        # Logical tables referenced by the query -> their databases
+        tables = {}
+        for kind, _, value in sql_tokens(sql):
+            if kind == "name" and value in self.tables:
+                if len(self.tables[value]) > 1:
+                    raise ValueError(f"Table {self.tables[value][0][0]} is registered in several databases: "
+                                     f"{', '.join(database for _, database in self.tables[value])}.")
+                table_name, database = self.tables[value][0]
+                tables[table_name] = database
+        if not tables:
+            raise ValueError("The query does not reference any registered table.")
+        return tables
+
+    def execute(self, sql, params=()):
+        self._drop_copies()
+        tables = self.resolve(sql)
+        databases = set(tables.values())
+        if len(databases) <= self.attach_limit:
+            for database in databases:
+                self._attach(database, [t for t, d in tables.items() if d == database], databases)
+        else:
+            self._copy_pushed_down(sql, tables)
+        return self.cursor.execute(sql, params)
+
+    def close(self):
+        self.connection.close()
+
+    def _attach(self, database, table_names, needed):
+        if database in self.attached:
+            # Mark as most recently used
+            self.attached[database] = self.attached.pop(database)
+        else:
+            while len(self.attached) >= self.attach_limit:
+                victim = next(d for d in self.attached if d not in needed)
+                self._detach(victim)
+            self.attach_count += 1
+            alias = f"db{self.attach_count}"
+            uri = f"{pathlib.Path(database).absolute().as_uri()}?mode=ro"
+            self.cursor.execute("ATTACH DATABASE ? AS " + quote_name(alias), (uri,))
+            self.attached[database] = alias
+            self.views[database] = set()
+
+        alias = self.attached[database]
+        for table_name in table_names:
+            if table_name not in self.views[database]:
+                self.cursor.execute(f"CREATE TEMP VIEW IF NOT EXISTS {quote_name(table_name)} AS "
+                                    f"SELECT * FROM {quote_name(alias)}.{quote_name(table_name)};")
+                self.views[database].add(table_name)
+
+    def _detach(self, database):
+        for table_name in self.views.pop(database):
+            self.cursor.execute(f"DROP VIEW IF EXISTS temp.{quote_name(table_name)};")
+        self.cursor.execute("DETACH DATABASE " + quote_name(self.attached.pop(database)))
+
+    def _drop_copies(self):
+        for table_name in self.copies:
+            self.cursor.execute(f"DROP TABLE IF EXISTS temp.{quote_name(table_name)};")
+        self.copies = []
+
+    def _copy_pushed_down(self, sql, tables):
+        for database in list(self.attached):
+            self._detach(database)
+
+        pushdown = self.pushdown(sql, tables)
+        for table_name, database in tables.items():
+            columns, where = pushdown[table_name]
+            select = f"SELECT {', '.join(quote_name(c) for c in columns)} FROM {quote_name(table_name)}"
+            if where:
+                select += " WHERE " + " AND ".join(f"({condition})" for condition in where)
+
+            self.cursor.execute(f"CREATE TEMP TABLE {quote_name(table_name)} "
+                                f"({', '.join(quote_name(c) for c in columns)});")
+            self.copies.append(table_name)
+            insert = (f"INSERT INTO temp.{quote_name(table_name)} "
+                      f"VALUES ({', '.join('?' for _ in columns)});")
+            with open_source(self.pool, database) as source:
+                source_cursor = source.execute(select)
+                while True:
+                    rows = source_cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    self.cursor.executemany(insert, rows)
+
+    def pushdown(self, sql, tables):
+        # For every table of the query: the columns it needs and the WHERE conditions that only
+        # reference that table and can run at the source. Anything the analysis cannot prove safe
+        # stays in the query and is evaluated after the copy.
+        tokens = sql_tokens(sql)
+        columns = {t: self.columns.get((database, t.lower()), []) for t, database in tables.items()}
+        by_lower = {t.lower(): t for t in tables}
+
+        # Aliases: FROM/JOIN <table> [AS] <alias>
+        aliases = dict(by_lower)
+        for i, (kind, _, value) in enumerate(tokens):
+            if kind == "name" and value in by_lower and i > 0 and tokens[i - 1][2] in ("from", "join", ","):
+                j = i + 1
+                if j < len(tokens) and tokens[j][2] == "as":
+                    j += 1
+                if j < len(tokens) and tokens[j][0] == "name":
+                    aliases[tokens[j][2]] = by_lower[value]
+
+        # Projection: columns named anywhere in the query, or everything for SELECT *
+        needed = {t: set() for t in tables}
+        select_all = set()
+        for i, (kind, text, value) in enumerate(tokens):
+            if text == "*" and i > 0 and tokens[i - 1][2] in ("select", ",", "distinct", "all"):
+                select_all.update(tables)
+            elif text == "*" and i > 1 and tokens[i - 1][1] == "." and tokens[i - 2][2] in aliases:
+                select_all.add(aliases[tokens[i - 2][2]])
+            elif kind == "name":
+                for t in tables:
+                    if value in (c.lower() for c in columns[t]):
+                        needed[t].add(value)
+        projections = {}
+        for t in tables:
+            projections[t] = [c for c in columns[t] if t in select_all or c.lower() in needed[t]] or columns[t][:1]
+
+        return {t: (projections[t], conditions) for t, conditions in
+                self._pushable_conditions(tokens, tables, aliases, columns).items()}
+
+    def _pushable_conditions(self, tokens, tables, aliases, columns):
+        conditions = {t: [] for t in tables}
+        # Only simple single-level SELECTs are analysed. Nothing is pushed past an outer join:
+        # a filter on its nullable side runs after the join (e.g. "child.flag IS NULL" keeps the
+        # unmatched rows), and filtering the source first would change which rows match.
+        depth = 0
+        where = None
+        for i, (kind, text, value) in enumerate(tokens):
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                depth -= 1
+            elif kind == "keyword" and value == "select" and i > 0:
+                return conditions
+            elif kind == "keyword" and value in ("left", "right", "full", "outer"):
+                return conditions
+            elif depth == 0 and kind == "keyword" and value == "where":
+                where = i + 1
+        if where is None:
+            return conditions
+
+        # Split the WHERE clause into top-level AND conjuncts (BETWEEN ... AND ... stays together)
+        conjuncts = [[]]
+        depth = 0
+        between = False
+        for kind, text, value in tokens[where:]:
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                depth -= 1
+            if depth == 0 and kind == "keyword" and value in WHERE_END or text == ";":
+                break
+            if depth == 0 and kind == "keyword" and value == "between":
+                between = True
+            if depth == 0 and kind == "keyword" and value == "and" and not between:
+                conjuncts.append([])
+                continue
+            if depth == 0 and kind == "keyword" and value == "and":
+                between = False
+            conjuncts[-1].append((kind, text, value))
+
+        owners = {}
+        for t in tables:
+            for c in columns[t]:
+                owners.setdefault(c.lower(), set()).add(t)
+
+        for conjunct in conjuncts:
+            referenced = set()
+            pushable = bool(conjunct)
+            text = []
+            skip_next_dot = False
+            for i, (kind, token_text, value) in enumerate(conjunct):
+                if skip_next_dot:
+                    skip_next_dot = False
+                    continue
+                if kind == "param":
+                    pushable = False
+                    break
+                if kind == "name" and i + 1 < len(conjunct) and conjunct[i + 1][1] == ".":
+                    # Qualified column: drop the qualifier, the source query has a single table
+                    if value not in aliases:
+                        pushable = False
+                        break
+                    referenced.add(aliases[value])
+                    skip_next_dot = True
+                    continue
+                if kind == "name" and i + 1 < len(conjunct) and conjunct[i + 1][1] == "(":
+                    text.append(token_text)  # function call
+                    continue
+                if kind == "name":
+                    if value in owners and len(owners[value]) == 1 and (i == 0 or conjunct[i - 1][1] != "."):
+                        referenced.update(owners[value])
+                    elif i == 0 or conjunct[i - 1][1] != ".":
+                        pushable = False
+                        break
+                text.append(token_text)
+            if pushable and len(referenced) == 1:
+                conditions[referenced.pop()].append(" ".join(text))
+        return conditions
@@ -0,0 +1,183 @@
+from array import array
+
+from .store import open_metadata
+
+
+class ForeignKeyGraph:
+    # Tables and column names are interned to integer ids once, and the edges are kept as compact
+    # CSR adjacency arrays: for node n, its edges are edge_ids[offsets[n]:offsets[n + 1]].
+    # "references" edges go from a child table to the table it references, "dependents" edges the
+    # other way round. Every edge carries the ids of the child and referenced columns.
+    def __init__(self, metadata_db=None, pool=None):
+        self.metadata_db = metadata_db
+        self.pool = pool
+        self.load()
+
+    def load(self):
+        self.nodes = []  # id -> (database, table)
+        self.node_ids = {}
+        self.by_name = {}  # table name -> ids
+        self.column_names = []
+        self.column_ids = {}
+        with open_metadata(self.pool, self.metadata_db) as metadata_connection:
+            for table_name, database in metadata_connection.execute(
+                    "SELECT name, database FROM TABLES ORDER BY database, name;"):
+                self._intern_node(database, table_name)
+
+            edges = []  # (child, parent, child column, parent column)
+            for col_name, ref_table, ref_col, database, table_name in metadata_connection.execute(
+                    "SELECT col, refrenced_table, refrenced_col, database, table_name FROM FOREIGN_KEY;"):
+                child = self._intern_node(database, table_name)
+                parent = self._intern_node(database, ref_table)
+                edges.append((child, parent, self._intern_column(col_name), self._intern_column(ref_col)))
+
+        self.references = self._adjacency(edges, 0, 1)
+        self.dependents = self._adjacency(edges, 1, 0)
+
+    def _intern_node(self, database, table_name):
+        key = (database, table_name)
+        if key not in self.node_ids:
+            self.node_ids[key] = len(self.nodes)
+            self.nodes.append(key)
+            self.by_name.setdefault(table_name.lower(), []).append(self.node_ids[key])
+        return self.node_ids[key]
+
+    def _intern_column(self, col_name):
+        if col_name not in self.column_ids:
+            self.column_ids[col_name] = len(self.column_names)
+            self.column_names.append(col_name)
+        return self.column_ids[col_name]
+
+    def _adjacency(self, edges, source, target):
+        # (offsets, targets, source columns, target columns) as typed arrays
+        counts = [0] * (len(self.nodes) + 1)
+        for edge in edges:
+            counts[edge[source] + 1] += 1
+        for n in range(len(self.nodes)):
+            counts[n + 1] += counts[n]
+        offsets = array("l", counts)
+        position = list(counts[:-1])
+        targets = array("l", bytes(len(edges) * array("l").itemsize))
+        source_columns = array("l", targets)
+        target_columns = array("l", targets)
+        for edge in edges:
+            i = position[edge[source]]
+            position[edge[source]] += 1
+            targets[i] = edge[target]
+            source_columns[i] = edge[source + 2]
+            target_columns[i] = edge[target + 2]
+        return offsets, targets, source_columns, target_columns
+
+    def node(self, table_name, database=None):
+        if database is not None:
+            if (database, table_name) not in self.node_ids:
+                raise ValueError(f"Table {table_name} is not registered in {database}.")
+            return self.node_ids[(database, table_name)]
+        ids = self.by_name.get(table_name.lower(), [])
+        if not ids:
+            raise ValueError(f"Table {table_name} is not registered.")
+        if len(ids) > 1:
+            raise ValueError(f"Table {table_name} is registered in several databases: "
+                             f"{', '.join(self.nodes[n][0] for n in ids)}.")
+        return ids[0]
+
+    def _neighbours(self, adjacency, n):
+        offsets, targets, _, _ = adjacency
+        return targets[offsets[n]:offsets[n + 1]]
+
+    def transitive_dependents(self, table_name, database=None):
+        # Every table that references the table directly or through other tables
+        start = self.node(table_name, database)
+        seen = {start}
+        stack = [start]
+        while stack:
+            for m in self._neighbours(self.dependents, stack.pop()):
+                if m not in seen:
+                    seen.add(m)
+                    stack.append(m)
+        seen.discard(start)
+        return sorted(self.nodes[n] for n in seen)
+
+    def strongly_connected_components(self, database=None):
+        # Tarjan's algorithm, iterative so thousands of tables do not hit the recursion limit.
+        # Components come out referenced-first: a component only references components before it.
+        members = [n for n, (db, _) in enumerate(self.nodes) if database is None or db == database]
+        offsets, targets, _, _ = self.references
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        components = []
+        for root in members:
+            if root in index:
+                continue
+            work = [(root, None)]
+            while work:
+                n, i = work.pop()
+                if i is None:
+                    index[n] = low[n] = len(index)
+                    stack.append(n)
+                    on_stack.add(n)
+                    i = offsets[n]
+                if i < offsets[n + 1]:
+                    work.append((n, i + 1))
+                    m = targets[i]
+                    if m not in index:
+                        work.append((m, None))
+                    elif m in on_stack:
+                        low[n] = min(low[n], index[m])
+                    continue
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[n])
+                if low[n] == index[n]:
+                    component = []
+                    while True:
+                        m = stack.pop()
+                        on_stack.discard(m)
+                        component.append(m)
+                        if m == n:
+                            break
+                    components.append(component)
+        return components
+
+    def load_order(self, database=None):
+        # Groups of tables in the order they can be loaded: a group only references earlier groups
+        # (or itself, for the tables of a cycle, which have to be loaded together)
+        return [sorted(self.nodes[n] for n in component)
+                for component in self.strongly_connected_components(database)]
+
+    def cycles(self, database=None):
+        # Groups of tables that reference each other, including tables that reference themselves
+        return [sorted(self.nodes[n] for n in component)
+                for component in self.strongly_connected_components(database)
+                if len(component) > 1 or component[0] in self._neighbours(self.references, component[0])]
+
+    def join_path(self, from_table, to_table, database=None):
+        # Shortest chain of foreign-key joins between two tables (edges used in either direction),
+        # as [(table, column, other table, other column)], or None when they are not connected
+        start = self.node(from_table, database)
+        goal = self.node(to_table, database)
+        previous = {start: None}
+        queue = [start]
+        for n in queue:
+            if n == goal:
+                break
+            for adjacency in (self.references, self.dependents):
+                offsets, targets, source_columns, target_columns = adjacency
+                for i in range(offsets[n], offsets[n + 1]):
+                    m = targets[i]
+                    if m not in previous:
+                        previous[m] = (n, source_columns[i], target_columns[i])
+                        queue.append(m)
+        if goal not in previous:
+            return None
+
+        path = []
+        n = goal
+        while previous[n] is not None:
+            m, source_column, target_column = previous[n]
+            path.append((self.nodes[m][1], self.column_names[source_column],
+                         self.nodes[n][1], self.column_names[target_column]))
+            n = m
+        return path[::-1]
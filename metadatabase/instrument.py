@@ -0,0 +1,326 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Literals of traced statements, replaced by ? so executions of one statement are counted together
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\bX'[0-9A-Fa-f]*'|(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+SQL_SPACE = re.compile(r"\s+")
+STATEMENT_LENGTH = 300
+_normalized = {}  # statement -> normalized statement, bounded
+
+
+def normalize_sql(sql):
+    # executemany traces every row with its values spelled out: the VALUES list of an INSERT is cut
+    # before the literals are replaced, so the rest can be looked up in the cache
+    values = sql.find(" VALUES (")
+    if values >= 0:
+        sql = sql[:values] + " VALUES (...)"
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        normalized = SQL_SPACE.sub(" ", SQL_LITERAL.sub("?", sql)).strip()[:STATEMENT_LENGTH]
+        if len(_normalized) < 10000:
+            _normalized[sql] = normalized
+    return normalized
+
+
+def sql_kind(sql):
+    # First keyword. SQLite also traces what runs inside a statement as "-- ..." lines: those of
+    # pragma table-valued functions (pragma_table_info(...)) count as PRAGMA calls, trigger and
+    # virtual table statements keep their "--" prefix
+    words = sql.lstrip("- \n\t").split(None, 1)
+    kind = words[0].upper() if words else ""
+    return f"-- {kind}" if sql.startswith("--") and kind != "PRAGMA" else kind
+
+
+class Instrumentation:
+    # Per-operation timers and row counters for DatabaseManager and the metadata store, and SQL
+    # tracing through sqlite3's trace callback. Disabled by default: an instrumented function then
+    # costs one attribute check, and no trace callback is installed on new connections.
+    #
+    # A statement's time runs from its trace event to the next statement of the same thread or the
+    # end of its operation, so it includes fetching its rows (SQLite reports no statement timings).
+    # Statements slower than slow_threshold seconds are kept in the slow log, each with probability
+    # slow_sample.
+    def __init__(self):
+        self.enabled = False
+        self.trace_sql = True
+        self.slow_threshold = 0.1
+        self.slow_sample = 1.0
+        self.lock = threading.Lock()
+        # The operations being timed, innermost last: a context variable, so asyncio tasks keep
+        # theirs apart and bind() hands them to worker threads. The statement being timed is per thread.
+        self.operations_var = contextvars.ContextVar("operations", default=())
+        self.local = threading.local()
+        self.reset()
+
+    def enable(self, trace_sql=True, slow_threshold=0.1, slow_sample=1.0, slow_log_size=200):
+        self.trace_sql = trace_sql
+        self.slow_threshold = slow_threshold
+        self.slow_sample = slow_sample
+        self.slow = deque(self.slow, maxlen=slow_log_size)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}  # name -> [calls, seconds, max seconds, rows]
+            self.statements = {}  # (operation, normalized sql) -> [executions, seconds, max seconds]
+            self.slow = deque(maxlen=200)
+            self.started_at = time.time()
+
+    # Operations ---------------------------------------------------------------------------------------------------
+
+    def start(self, name):
+        self._finish_statement(time.perf_counter())
+        self.operations_var.set(self.operations_var.get() + ([name, time.perf_counter(), 0],))
+
+    def stop(self):
+        now = time.perf_counter()
+        self._finish_statement(now)
+        stack = self.operations_var.get()
+        self.operations_var.set(stack[:-1])
+        name, started, rows = stack[-1]
+        elapsed = now - started
+        with self.lock:
+            totals = self.operations.get(name)
+            if totals is None:
+                totals = self.operations[name] = [0, 0.0, 0.0, 0]
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] = max(totals[2], elapsed)
+            totals[3] += rows
+
+    def add_rows(self, rows):
+        # Rows handled by the current operation (its throughput in the report); a worker thread
+        # adds to the operation that submitted its work
+        if self.enabled:
+            stack = self.operations_var.get()
+            if stack:
+                with self.lock:
+                    stack[-1][2] += rows
+
+    def bind(self, function, *args):
+        # function(*args), to hand to another thread (executor.submit, run_in_executor): it runs
+        # under the operations of the caller, so the statements it traces are credited to them.
+        # The worker thread's last statement ends with the call, not when the thread is next used.
+        if not self.enabled:
+            return functools.partial(function, *args)
+        return functools.partial(self._run_bound, contextvars.copy_context(), function, args)
+
+    def _run_bound(self, context, function, args):
+        try:
+            return context.run(function, *args)
+        finally:
+            self._finish_statement(time.perf_counter())
+
+    # SQL tracing --------------------------------------------------------------------------------------------------
+
+    def attach(self, connection):
+        # Trace the statements of a connection, when enabled (ConnectionPool.checkin removes it)
+        if self.enabled and self.trace_sql:
+            connection.set_trace_callback(self._trace)
+        return connection
+
+    def _trace(self, sql):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        stack = self.operations_var.get()
+        operation = stack[-1][0] if stack else "(none)"
+        if sql.startswith("--"):
+            # Issued from inside the statement being run: counted, but its time stays with it
+            self._record(operation, normalize_sql(sql), 0.0)
+            return
+        self._finish_statement(now)
+        self.local.statement = (operation, sql, now)
+
+    def _finish_statement(self, now):
+        statement = getattr(self.local, "statement", None)
+        if statement is None:
+            return
+        self.local.statement = None
+        operation, sql, started = statement
+        elapsed = now - started
+        self._record(operation, normalize_sql(sql), elapsed)
+        if elapsed >= self.slow_threshold and random.random() < self.slow_sample:
+            with self.lock:
+                self.slow.append({"operation": operation, "sql": sql[:STATEMENT_LENGTH], "seconds": elapsed,
+                                  "at": time.time()})
+
+    def _record(self, operation, sql, elapsed):
+        with self.lock:
+            totals = self.statements.get((operation, sql))
+            if totals is None:
+                totals = self.statements[(operation, sql)] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] = max(totals[2], elapsed)
+
+    # Export -------------------------------------------------------------------------------------------------------
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "written_at": time.time(),
+                "operations": {name: {"calls": calls, "seconds": seconds, "max_seconds": longest, "rows": rows}
+                               for name, (calls, seconds, longest, rows) in self.operations.items()},
+                "statements": [{"operation": operation, "sql": sql, "kind": sql_kind(sql), "executions": executions,
+                                "seconds": seconds, "max_seconds": longest}
+                               for (operation, sql), (executions, seconds, longest) in self.statements.items()],
+                "slow": list(self.slow),
+            }
+
+    def write_metrics(self, path):
+        # JSON file for `main.py report`, replaced atomically
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(prefix=".metrics-", dir=directory)
+        try:
+            with os.fdopen(descriptor, "w") as metrics_file:
+                json.dump(self.metrics(), metrics_file, indent=1)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return path
+
+    def prometheus(self):
+        # Prometheus text exposition format; statements are aggregated by kind to bound cardinality
+        metrics = self.metrics()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        operations = sorted(metrics["operations"].items())
+        family("metadatabase_operation_calls_total", "counter", "Calls of instrumented operations.",
+               [({"operation": name}, totals["calls"]) for name, totals in operations])
+        family("metadatabase_operation_seconds_total", "counter", "Time spent in instrumented operations.",
+               [({"operation": name}, repr(totals["seconds"])) for name, totals in operations])
+        family("metadatabase_operation_seconds_max", "gauge", "Longest call of each operation.",
+               [({"operation": name}, repr(totals["max_seconds"])) for name, totals in operations])
+        family("metadatabase_operation_rows_total", "counter", "Rows handled by instrumented operations.",
+               [({"operation": name}, totals["rows"]) for name, totals in operations])
+        kinds = {}
+        for statement in metrics["statements"]:
+            totals = kinds.setdefault((statement["operation"], statement["kind"]), [0, 0.0])
+            totals[0] += statement["executions"]
+            totals[1] += statement["seconds"]
+        kinds = sorted(kinds.items())
+        family("metadatabase_sql_statements_total", "counter", "Traced SQL statements by operation and kind.",
+               [({"operation": operation, "kind": kind}, totals[0]) for (operation, kind), totals in kinds])
+        family("metadatabase_sql_seconds_total", "counter", "Time attributed to traced SQL statements.",
+               [({"operation": operation, "kind": kind}, repr(totals[1])) for (operation, kind), totals in kinds])
+        lines.append("# HELP metadatabase_slow_statements Statements in the slow log.")
+        lines.append("# TYPE metadatabase_slow_statements gauge")
+        lines.append(f"metadatabase_slow_statements {len(metrics['slow'])}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# The process-wide instrumentation used by the package
+instruments = Instrumentation()
+
+
+def instrumented(name):
+    # Time every call of the decorated function as the operation `name`
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not instruments.enabled:
+                return function(*args, **kwargs)
+            instruments.start(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                instruments.stop()
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def operation(name):
+    # `with` form of instrumented, e.g. around the handling of a request
+    if not instruments.enabled:
+        yield
+        return
+    instruments.start(name)
+    try:
+        yield
+    finally:
+        instruments.stop()
+
+
+def timed_commit(connection, name="commit"):
+    # Commit, timed as its own operation so commit latency shows apart from the work before it
+    if not instruments.enabled:
+        connection.commit()
+        return
+    instruments.start(name)
+    try:
+        connection.commit()
+    finally:
+        instruments.stop()
+
+
+@contextmanager
+def transaction(connection, name="commit"):
+    # `with connection:` (commit on success, rollback on error) with the commit timed as `name`
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    timed_commit(connection, name)
+
+
+def metrics_report(metrics, top=10):
+    # Hot spots of a metrics dict (Instrumentation.metrics, or a file written by write_metrics)
+    lines = [f"Operations by total time ({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metrics['started_at']))}"
+             f" to {time.strftime('%H:%M:%S', time.localtime(metrics['written_at']))})"]
+    lines.append(f"  {'operation':<28}{'calls':>8}{'total s':>10}{'avg ms':>10}{'max ms':>10}{'rows':>12}{'rows/s':>12}")
+    operations = sorted(metrics["operations"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+    for name, totals in operations[:top]:
+        rate = f"{totals['rows'] / totals['seconds']:,.0f}" if totals["rows"] and totals["seconds"] else ""
+        lines.append(f"  {name:<28}{totals['calls']:>8,}{totals['seconds']:>10.3f}"
+                     f"{totals['seconds'] / totals['calls'] * 1000:>10.2f}{totals['max_seconds'] * 1000:>10.2f}"
+                     f"{totals['rows'] or '':>12}{rate:>12}")
+
+    statements = metrics["statements"]
+    if statements:
+        kinds = {}
+        for statement in statements:
+            kinds[(statement["operation"], statement["kind"])] = (
+                kinds.get((statement["operation"], statement["kind"]), 0) + statement["executions"])
+        lines.append("")
+        lines.append("SQL statements per operation and kind")
+        for (operation, kind), executions in sorted(kinds.items(), key=lambda item: item[1], reverse=True)[:top * 2]:
+            lines.append(f"  {operation:<28}{kind:<10}{executions:>10,}")
+        lines.append("")
+        lines.append("Statements by total time")
+        for statement in sorted(statements, key=lambda s: s["seconds"], reverse=True)[:top]:
+            lines.append(f"  {statement['seconds']:>8.3f}s {statement['executions']:>8,}x  "
+                         f"[{statement['operation']}] {statement['sql'][:100]}")
+    if metrics["slow"]:
+        lines.append("")
+        lines.append(f"Slow log ({len(metrics['slow'])} statements, slowest first)")
+        for entry in sorted(metrics["slow"], key=lambda entry: entry["seconds"], reverse=True)[:top]:
+            lines.append(f"  {entry['seconds'] * 1000:>9.1f}ms  [{entry['operation']}] {entry['sql'][:100]}")
+    return "\n".join(lines)
@@ -0,0 +1,268 @@
+import pathlib
+import re
+import sqlite3
+from collections import Counter
+from itertools import filterfalse
+
+from .sqlutil import quote_name, type_affinity
+from .store import open_metadata
+
+NUMERIC_TEXT = re.compile(r"\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*\Z")
+INTEGER_TEXT = re.compile(r"\s*[+-]?\d+\s*\Z")
+NUMERIC_AFFINITIES = {"INTEGER", "REAL", "NUMERIC"}
+
+
+def _as_number(value):
+    # NUMERIC affinity: text that reads as a number is compared as that number
+    if isinstance(value, str) and NUMERIC_TEXT.match(value):
+        return int(value) if INTEGER_TEXT.match(value) else float(value)
+    return value
+
+
+def _as_text(value):
+    # TEXT affinity: numbers are compared as their text
+    return str(value) if isinstance(value, (int, float)) else value
+
+
+def comparison(child_type, parent_type):
+    # The conversion SQLite applies before comparing a child column with a parent column of these
+    # declared types, or None when the stored values compare as they are: NUMERIC affinity when
+    # either column has a numeric one, TEXT affinity when one is TEXT and the other has none
+    affinities = {type_affinity(child_type), type_affinity(parent_type)}
+    if affinities & NUMERIC_AFFINITIES and not affinities <= NUMERIC_AFFINITIES:
+        return _as_number
+    if affinities == {"TEXT", "BLOB"}:
+        return _as_text
+    return None
+
+
+class ForeignKeyValidator:
+    # Referential integrity checks of a database's foreign keys, read from the database itself
+    # (pragma_foreign_key_list), so validating never has to write metadata.db first. A referenced
+    # table missing from the database is looked up in the TABLES and COLUMNS meta-relations among
+    # the other registered databases. Every check is set based: a table (or a loaded batch) is
+    # checked with one anti-join per foreign key when the referenced table lives in the same
+    # database, and against an in-memory set of the referenced keys, loaded once and streamed
+    # through in chunks, when it is in another database. No row is looked up on its own, so tens of
+    # millions of child rows cost one scan per key.
+    #
+    # A composite key is checked as a whole: its columns are compared as one tuple, and a row with
+    # a NULL in any of them is not checked (MATCH SIMPLE, as SQLite does).
+    # Reports are lists of dicts, one per foreign key:
+    #   table, column, referenced_database, referenced_table, referenced_column, method
+    #   ("anti-join" or "hash set"), violations (rows whose key is missing), missing_keys (the
+    #   number of distinct missing values), sample ([value, rows] of the most frequent ones) and
+    #   error (why the key could not be checked, else None). For a composite key, column and
+    #   referenced_column list the columns separated by ", " (columns and referenced_columns hold
+    #   them as lists) and the sampled values are lists.
+    def __init__(self, connection, db_name, metadata_db=None, pool=None, sample=10, chunk_size=100000):
+        self.connection = connection
+        self.db_name = db_name
+        self.sample = sample
+        self.chunk_size = chunk_size
+        self.parent_keys = {}  # (database, table, columns, conversions) -> {(value, ...)}
+        self.load(metadata_db, pool)
+
+    def load(self, metadata_db=None, pool=None):
+        cursor = self.connection.cursor()
+        local_tables = {name.lower(): name for (name,) in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table';").fetchall()}
+        # (table, column) -> declared type, and (database, table) -> primary key columns in key order
+        self.types = {}
+        primary_keys = {}
+        for table_name, name, col_type, pk in cursor.execute("""
+                SELECT m.name, p.name, p.type, p.pk FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+                WHERE m.type='table' ORDER BY m.name, p.pk;
+                """).fetchall():
+            self.types[(table_name, name)] = col_type
+            if pk:
+                primary_keys.setdefault((self.db_name, table_name), []).append(name)
+        # One entry per foreign key, its columns in seq order
+        foreign_keys = {}
+        for table_name, fk_id, ref_table, col, ref_col in cursor.execute("""
+                SELECT m.name, fk.id, fk."table", fk."from", fk."to"
+                FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS fk
+                WHERE m.type='table' ORDER BY m.name, fk.id, fk.seq;
+                """).fetchall():
+            foreign_key = foreign_keys.setdefault((table_name, fk_id), (ref_table, [], []))
+            foreign_key[1].append(col)
+            foreign_key[2].append(ref_col)
+
+        self.tables = {lower: [(self.db_name, name)] for lower, name in local_tables.items()}
+        self.remote_types = {}  # (database, table, column) -> declared type, of referenced tables elsewhere
+        remote = {ref_table.lower() for ref_table, _, _ in foreign_keys.values()} - set(local_tables)
+        if remote:
+            with open_metadata(pool, metadata_db) as metadata_connection:
+                metadata_cursor = metadata_connection.cursor()
+                for name, database in metadata_cursor.execute("SELECT name, database FROM TABLES;"):
+                    if name.lower() in remote and database != self.db_name:
+                        self.tables.setdefault(name.lower(), []).append((database, name))
+                for database, table_name, name, col_type, pk in metadata_cursor.execute(
+                        "SELECT database, table_name, name, type, pk FROM COLUMNS ORDER BY pk;"):
+                    if table_name.lower() in remote and database != self.db_name:
+                        self.remote_types[(database, table_name, name)] = col_type
+                        if pk:
+                            primary_keys.setdefault((database, table_name), []).append(name)
+
+        self.foreign_keys = {}
+        for (table_name, _), (ref_table, columns, ref_columns) in foreign_keys.items():
+            self.foreign_keys.setdefault(table_name, []).append(
+                self._resolve(table_name, columns, ref_table, ref_columns, primary_keys))
+
+    def _resolve(self, table_name, columns, ref_table, ref_columns, primary_keys):
+        foreign_key = {"table": table_name, "column": ", ".join(columns), "columns": columns,
+                       "referenced_database": None, "referenced_table": ref_table,
+                       "referenced_column": None, "referenced_columns": ref_columns, "error": None}
+        candidates = self.tables.get(ref_table.lower(), [])
+        if not candidates:
+            foreign_key["error"] = f"Referenced table {ref_table} is not registered."
+            return foreign_key
+        if len(candidates) > 1:
+            foreign_key["error"] = (f"Referenced table {ref_table} is registered in several databases: "
+                                    f"{', '.join(database for database, _ in candidates)}.")
+            return foreign_key
+        foreign_key["referenced_database"], foreign_key["referenced_table"] = candidates[0]
+        if None in ref_columns:
+            # REFERENCES table without columns: its primary key
+            ref_columns = primary_keys.get(candidates[0], ["rowid"])
+            if len(ref_columns) != len(columns):
+                foreign_key["error"] = f"The primary key of {ref_table} has {len(ref_columns)} columns."
+        foreign_key["referenced_columns"] = ref_columns
+        foreign_key["referenced_column"] = ", ".join(ref_columns)
+        return foreign_key
+
+    def validate(self, tables=None):
+        # Check every row of the given tables (all tables with foreign keys by default)
+        report = []
+        for table_name in (self.foreign_keys if tables is None else tables):
+            for foreign_key in self.foreign_keys.get(table_name, []):
+                columns = foreign_key["columns"]
+                source = (f"SELECT {', '.join(f'{quote_name(col)} AS value{i}' for i, col in enumerate(columns))} "
+                          f"FROM {quote_name(table_name)} "
+                          f"WHERE {' AND '.join(f'{quote_name(col)} IS NOT NULL' for col in columns)}")
+                report.append(self._check(foreign_key, source))
+        return report
+
+    def validate_batch(self, table_name, columns, batch):
+        # Check the foreign keys of a batch of row tuples (in the order of columns). The values of
+        # each key go through a temporary table declared with the columns' types, so they are
+        # compared as SQLite stores them (e.g. '42' from a CSV file as the integer 42).
+        # Run it after inserting the batch and before committing, so rows referencing rows of the
+        # same batch are accepted.
+        report = []
+        positions = {col: i for i, col in enumerate(columns)}
+        for foreign_key in self.foreign_keys.get(table_name, []):
+            if any(col not in positions for col in foreign_key["columns"]):
+                continue
+            key = [positions[col] for col in foreign_key["columns"]]
+            declared = ", ".join(f"value{i} {self.types.get((table_name, col)) or ''}"
+                                 for i, col in enumerate(foreign_key["columns"]))
+            self.connection.execute("DROP TABLE IF EXISTS temp.fk_batch_keys;")
+            self.connection.execute(f"CREATE TEMP TABLE fk_batch_keys ({declared});")
+            self.connection.executemany(f"INSERT INTO temp.fk_batch_keys VALUES ({', '.join('?' for _ in key)});",
+                                        [values for values in (tuple(row[i] for i in key) for row in batch)
+                                         if None not in values])
+            values = ", ".join(f"value{i}" for i in range(len(key)))
+            report.append(self._check(foreign_key, f"SELECT {values} FROM temp.fk_batch_keys"))
+        self.connection.execute("DROP TABLE IF EXISTS temp.fk_batch_keys;")
+        return report
+
+    def _check(self, foreign_key, source):
+        # source: a query of the child rows' keys without NULLs, as columns named value0, value1, ...
+        result = dict(foreign_key, method=None, violations=0, missing_keys=0, sample=[])
+        if foreign_key["error"] is not None:
+            return result
+        values = ", ".join(f"value{i}" for i in range(len(foreign_key["columns"])))
+        if foreign_key["referenced_database"] == self.db_name:
+            result["method"] = "anti-join"
+            # NOT IN (subquery) is answered from the referenced columns' index, or from an index
+            # SQLite builds once for the subquery, instead of one lookup per row
+            ref_columns = [quote_name(col) for col in foreign_key["referenced_columns"]]
+            missing = self.connection.execute(f"""
+                SELECT {values}, count(*) FROM ({source})
+                WHERE ({values}) NOT IN (SELECT {', '.join(ref_columns)}
+                                         FROM {quote_name(foreign_key['referenced_table'])}
+                                         WHERE {' AND '.join(f'{col} IS NOT NULL' for col in ref_columns)})
+                GROUP BY {values};
+            """).fetchall()
+            missing = [(row[:-1], row[-1]) for row in missing]
+        else:
+            result["method"] = "hash set"
+            # The values are compared the way the anti-join would compare them, e.g. the text '5'
+            # of a TEXT column equals the 5 of an INTEGER one
+            conversions = tuple(comparison(self.types.get((foreign_key["table"], col)),
+                                           self.remote_types.get((foreign_key["referenced_database"],
+                                                                  foreign_key["referenced_table"], ref_col)))
+                                for col, ref_col in zip(foreign_key["columns"], foreign_key["referenced_columns"]))
+            convert = _converter(conversions)
+            keys = self._parent_keys(foreign_key, conversions, convert)
+            # Rows are tuples like the keys, so the probe runs in C (set.__contains__, Counter)
+            missing = Counter()
+            cursor = self.connection.execute(f"{source};")
+            while True:
+                chunk = cursor.fetchmany(self.chunk_size)
+                if not chunk:
+                    break
+                if convert is None:
+                    missing.update(filterfalse(keys.__contains__, chunk))
+                else:
+                    # Counted by the stored values, which the sample shows
+                    missing.update(row for row, converted in zip(chunk, map(convert, chunk)) if converted not in keys)
+            missing = list(missing.items())
+        result["violations"] = sum(n for _, n in missing)
+        result["missing_keys"] = len(missing)
+        result["sample"] = [[value[0] if len(value) == 1 else list(value), n]
+                            for value, n in sorted(missing, key=lambda item: item[1], reverse=True)[:self.sample]]
+        return result
+
+    def _parent_keys(self, foreign_key, conversions=(), convert=None):
+        # Referenced keys of a table of another database, read once per validator (and conversion)
+        # in chunks
+        key = (foreign_key["referenced_database"], foreign_key["referenced_table"],
+               tuple(foreign_key["referenced_columns"]), conversions)
+        if key not in self.parent_keys:
+            database, table_name, columns, _ = key
+            columns = [quote_name(col) for col in columns]
+            connection = sqlite3.connect(f"{pathlib.Path(database).absolute().as_uri()}?mode=ro", uri=True)
+            try:
+                cursor = connection.execute(f"SELECT {', '.join(columns)} FROM {quote_name(table_name)} "
+                                            f"WHERE {' AND '.join(f'{col} IS NOT NULL' for col in columns)};")
+                keys = set()
+                while True:
+                    chunk = cursor.fetchmany(self.chunk_size)
+                    if not chunk:
+                        break
+                    keys.update(chunk if convert is None else map(convert, chunk))
+            finally:
+                connection.close()
+            self.parent_keys[key] = keys
+        return self.parent_keys[key]
+
+
+def _converter(conversions):
+    # A function converting key tuples column by column, or None when no column needs it
+    if not any(conversions):
+        return None
+    return lambda row: tuple(value if conversion is None else conversion(value)
+                             for conversion, value in zip(conversions, row))
+
+
+def format_report(report):
+    # One line per foreign key, and the most frequent missing values under those with violations
+    lines = []
+    for result in report:
+        target = f"{result['referenced_table']}.{result['referenced_column'] or '?'}"
+        if result["method"] == "hash set":
+            target += f" ({result['referenced_database']})"
+        line = f"{result['table']}.{result['column']} -> {target}: "
+        if result["error"] is not None:
+            lines.append(line + f"not checked, {result['error']}")
+            continue
+        if not result["violations"]:
+            lines.append(line + f"OK ({result['method']})")
+            continue
+        lines.append(line + f"{result['violations']} rows reference {result['missing_keys']} missing keys "
+                            f"({result['method']})")
+        for value, n in result["sample"]:
+            lines.append(f"    {value!r}: {n} rows")
+    return "\n".join(lines)
@@ -0,0 +1,257 @@
+import functools
+import heapq
+import json
+import pathlib
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .instrument import instrumented, transaction
+from .sqlutil import quote_name
+from .store import open_metadata
+
+
+def _add(total, value):
+    # sum and count; SQL sum() of no rows is NULL
+    if total is None:
+        return value
+    return total if value is None else total + value
+
+
+def _min(current, value):
+    if current is None:
+        return value
+    return current if value is None else min(current, value)
+
+
+def _max(current, value):
+    if current is None:
+        return value
+    return current if value is None else max(current, value)
+
+
+def _top(k, current, value):
+    # Partial values are lists of candidates, or JSON arrays of them (e.g. from json_group_array);
+    # the k largest are kept
+    if isinstance(value, str):
+        value = json.loads(value)
+    candidates = (current or []) + [item for item in value or [] if item is not None]
+    return heapq.nlargest(k, candidates)
+
+
+COMBINERS = {"sum": _add, "count": _add, "min": _min, "max": _max}
+
+
+def combiner(name):
+    # A combiner by name: sum, count, min, max, or top:K for the K largest values
+    if name in COMBINERS:
+        return COMBINERS[name]
+    kind, _, k = name.partition(":")
+    if kind == "top" and k.isdigit() and int(k) > 0:
+        return functools.partial(_top, int(k))
+    raise ValueError(f"Unknown combiner {name}, expected one of {', '.join(COMBINERS)} or top:K.")
+
+
+def partition_source(table_name, start_rowid=None, end_rowid=None):
+    # What {table} stands for in a partition: the table, or the rows of one rowid range of it
+    if start_rowid is None:
+        return quote_name(table_name)
+    return (f"(SELECT * FROM {quote_name(table_name)} "
+            f"WHERE rowid >= {int(start_rowid)} AND rowid < {int(end_rowid)})")
+
+
+def run_partition(database, source, sql, map_function):
+    # Worker side of Job.run: one partition, through a read-only connection. Returns the partial
+    # result as a list of rows (lists) and the seconds it took.
+    start = time.perf_counter()
+    connection = sqlite3.connect(f"{pathlib.Path(database).absolute().as_uri()}?mode=ro", uri=True)
+    try:
+        if map_function is not None:
+            rows = map_function(connection, source)
+        else:
+            rows = connection.execute(sql.replace("{table}", source)).fetchall()
+        return [list(row) for row in rows], time.perf_counter() - start
+    finally:
+        connection.close()
+
+
+class Job:
+    # A partition-parallel map/aggregate job over the registered databases. The TABLES and
+    # DATABASES meta-relations are the partition catalog: every registered table (optionally only
+    # some table names, or some databases) is a partition, and with split_rows a table is further
+    # split into rowid ranges of split_rows rowids each, so one large table also spreads over the
+    # workers. Partitions run in a process pool, each against its database through a read-only
+    # connection, and this process merges the partial results and is the only metadata writer.
+    #
+    # The map step is either sql, a query with {table} where the partition's table goes, e.g.
+    #   SELECT count(*), sum(amount), max(amount) FROM {table}
+    # or map_function(connection, source), a module-level (picklable) function returning rows,
+    # where source is the same SQL table expression. The first group_by columns of each row are
+    # its key and the others are merged per key with combine, one combiner per column: sum, count,
+    # min, max or top:K (the K largest of a list, or of a JSON array such as json_group_array()).
+    #
+    # Jobs are checkpointed in metadata.db (JOBS, JOB_PARTITIONS): the partition plan is stored
+    # when a job is first run, and each partition's partial result as soon as it is merged, so
+    # running an interrupted (or failed) job again under the same name only runs what is left.
+    # Partial results are stored as JSON, so map results must not contain blobs: a partition that
+    # returns one (or fails in any other way) is marked failed, and runs again with the job.
+    def __init__(self, name, sql=None, map_function=None, combine=("sum",), group_by=0, tables=None,
+                 databases=None, split_rows=None, workers=None, metadata_db=None, pool=None):
+        if (sql is None) == (map_function is None):
+            raise ValueError("A job needs either sql or map_function.")
+        if sql is not None and "{table}" not in sql:
+            raise ValueError("The job's SQL must contain {table}.")
+        self.name = name
+        self.sql = sql
+        self.map_function = map_function
+        self.combine = list(combine)
+        self.combiners = [combiner(combine_name) for combine_name in self.combine]
+        self.group_by = group_by
+        self.tables = sorted({table_name.lower() for table_name in tables}) if tables else None
+        self.databases = sorted(set(databases)) if databases else None
+        self.split_rows = split_rows
+        self.workers = workers
+        self.metadata_db = metadata_db
+        self.pool = pool
+
+    def spec(self):
+        # The job's definition, stored with its checkpoints to tell a resumed run from a new job
+        map_name = None
+        if self.map_function is not None:
+            map_name = f"{self.map_function.__module__}.{self.map_function.__qualname__}"
+        return {"sql": self.sql, "map_function": map_name, "combine": self.combine, "group_by": self.group_by,
+                "tables": self.tables, "databases": self.databases, "split_rows": self.split_rows}
+
+    def partitions(self, metadata_connection):
+        # [(database, table, start_rowid, end_rowid)]; the rowids are None for a whole table
+        plan = []
+        for database, table_name in metadata_connection.execute(
+                "SELECT database, name FROM TABLES ORDER BY database, name;").fetchall():
+            if self.databases is not None and database not in self.databases:
+                continue
+            if self.tables is not None and table_name.lower() not in self.tables:
+                continue
+            plan.extend((database, table_name, start, end) for start, end in self._rowid_ranges(database, table_name))
+        return plan
+
+    def _rowid_ranges(self, database, table_name):
+        if not self.split_rows:
+            return [(None, None)]
+        connection = sqlite3.connect(f"{pathlib.Path(database).absolute().as_uri()}?mode=ro", uri=True)
+        try:
+            # Each bound is read from one end of the table's b-tree; SQLite only does that for a
+            # query with a single min() or max(), so they are two subqueries
+            low, high = connection.execute(f"SELECT (SELECT min(rowid) FROM {quote_name(table_name)}), "
+                                           f"(SELECT max(rowid) FROM {quote_name(table_name)});").fetchone()
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID table (or a file that cannot be read now: the worker reports it)
+            return [(None, None)]
+        finally:
+            connection.close()
+        if low is None or high - low < self.split_rows:
+            return [(None, None)]
+        return [(start, min(start + self.split_rows, high + 1)) for start in range(low, high + 1, self.split_rows)]
+
+    def _checkpoint(self, metadata_connection, restart):
+        # The job's partitions as (part, database, table, start, end, status, result), planned
+        # and stored on the first run
+        spec = json.dumps(self.spec(), sort_keys=True)
+        row = metadata_connection.execute("SELECT spec FROM JOBS WHERE name=?;", (self.name,)).fetchone()
+        if row is not None and row[0] != spec and not restart:
+            raise ValueError(f"Job {self.name} was run with another definition; restart it to run this one.")
+        if row is not None and restart:
+            with transaction(metadata_connection, "job_checkpoint"):
+                metadata_connection.execute("DELETE FROM JOB_PARTITIONS WHERE job=?;", (self.name,))
+                metadata_connection.execute("DELETE FROM JOBS WHERE name=?;", (self.name,))
+            row = None
+        if row is None:
+            plan = self.partitions(metadata_connection)
+            with transaction(metadata_connection, "job_checkpoint"):
+                metadata_connection.execute("INSERT INTO JOBS(name, spec, status, created_at) VALUES (?, ?, ?, ?);",
+                                            (self.name, spec, "running", time.time()))
+                metadata_connection.executemany("""
+                    INSERT INTO JOB_PARTITIONS(job, part, database, table_name, start_rowid, end_rowid, status)
+                    VALUES (?, ?, ?, ?, ?, ?, 'pending');
+                """, [(self.name, part, *partition) for part, partition in enumerate(plan)])
+        return metadata_connection.execute("""
+            SELECT part, database, table_name, start_rowid, end_rowid, status, result FROM JOB_PARTITIONS
+            WHERE job=? ORDER BY part;
+        """, (self.name,)).fetchall()
+
+    def _merge(self, accumulator, rows):
+        for row in rows:
+            key = tuple(row[:self.group_by])
+            values = row[self.group_by:]
+            if len(values) != len(self.combiners):
+                raise ValueError(f"Job {self.name}: rows have {len(values)} values to combine, "
+                                 f"and there are {len(self.combiners)} combiners.")
+            current = accumulator.get(key)
+            if current is None:
+                current = accumulator[key] = [None] * len(self.combiners)
+            for i, (combine, value) in enumerate(zip(self.combiners, values)):
+                current[i] = combine(current[i], value)
+
+    @instrumented("run_job")
+    def run(self, restart=False):
+        # Run the partitions not done yet and return a summary; its rows are the merged result,
+        # key columns first, sorted by key
+        start = time.perf_counter()
+        with open_metadata(self.pool, self.metadata_db) as metadata_connection:
+            partitions = self._checkpoint(metadata_connection, restart)
+            accumulator = {}
+            summary = {"job": self.name, "partitions": len(partitions), "resumed": 0, "ran": 0, "failed": {}}
+            pending = []
+            for part, database, table_name, start_rowid, end_rowid, status, result in partitions:
+                if status == "done":
+                    self._merge(accumulator, json.loads(result))
+                    summary["resumed"] += 1
+                else:
+                    pending.append((part, database, table_name, start_rowid, end_rowid))
+
+            if pending:
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+                try:
+                    futures = {}
+                    for part, database, table_name, start_rowid, end_rowid in pending:
+                        source = partition_source(table_name, start_rowid, end_rowid)
+                        future = executor.submit(run_partition, database, source, self.sql, self.map_function)
+                        futures[future] = (part, database, table_name, start_rowid)
+                    for future in as_completed(futures):
+                        part, database, table_name, start_rowid = futures[future]
+                        try:
+                            rows, seconds = future.result()
+                            # Serialized and combined on their own first, so a partition whose rows
+                            # cannot be stored (blobs) or combined fails alone instead of the job
+                            result = json.dumps(rows)
+                            partial = {}
+                            self._merge(partial, rows)
+                        except Exception as e:
+                            label = f"{database}:{table_name}" + (f"@{start_rowid}" if start_rowid is not None else "")
+                            summary["failed"][label] = f"{type(e).__name__}: {e}"
+                            with transaction(metadata_connection, "job_checkpoint"):
+                                metadata_connection.execute(
+                                    "UPDATE JOB_PARTITIONS SET status='failed', result=? WHERE job=? AND part=?;",
+                                    (summary["failed"][label], self.name, part))
+                            continue
+                        self._merge(accumulator, [list(key) + values for key, values in partial.items()])
+                        with transaction(metadata_connection, "job_checkpoint"):
+                            metadata_connection.execute(
+                                "UPDATE JOB_PARTITIONS SET status='done', result=?, seconds=? WHERE job=? AND part=?;",
+                                (result, seconds, self.name, part))
+                        summary["ran"] += 1
+                finally:
+                    # On an interrupt, drop the partitions not started; the finished ones are saved
+                    executor.shutdown(wait=True, cancel_futures=True)
+
+            rows = [list(key) + values for key, values in accumulator.items()]
+            try:
+                rows.sort(key=lambda row: row[:self.group_by])
+            except TypeError:
+                pass  # keys of mixed types keep the order they were merged in
+            summary["rows"] = rows
+            status = "failed" if summary["failed"] else "done"
+            with transaction(metadata_connection, "job_checkpoint"):
+                metadata_connection.execute("UPDATE JOBS SET status=?, finished_at=?, result=? WHERE name=?;",
+                                            (status, time.time(), json.dumps(rows), self.name))
+        summary["seconds"] = time.perf_counter() - start
+        return summary
@@ -0,0 +1,697 @@
+import csv
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from . import store
+from .columnar import export_table
+from .instrument import instrumented, instruments, timed_commit, transaction
+from .integrity import ForeignKeyValidator, format_report
+from .profiler import profile_table
+from .snapshot import write_snapshot
+from .sqlutil import declared_width, quote_name
+from .store import connect_metadata, open_metadata, stored_fingerprints, write_catalog, write_statistics
+
+
+class MetadataCache:
+    # In-memory copy of one connection's catalog, so existence, column, primary-key and unique
+    # lookups are answered from dicts and sets instead of sqlite_master / PRAGMA queries.
+    # Tables are loaded lazily, one at a time, the first time they are looked up, so a manager
+    # that only touches one table pays for one table. The entries are dropped when create_table
+    # runs, when this connection prepares a DDL statement (seen through the authorizer), or when
+    # PRAGMA schema_version moves; the latter is checked at most once every check_interval seconds.
+    DDL_ACTIONS = {
+        sqlite3.SQLITE_CREATE_TABLE, sqlite3.SQLITE_DROP_TABLE, sqlite3.SQLITE_ALTER_TABLE,
+        sqlite3.SQLITE_CREATE_INDEX, sqlite3.SQLITE_DROP_INDEX,
+        sqlite3.SQLITE_CREATE_VIEW, sqlite3.SQLITE_DROP_VIEW,
+    }
+
+    def __init__(self, db_manager, check_interval=1.0):
+        self.db_manager = db_manager
+        self.check_interval = check_interval
+        self.tables = {}  # table name -> entry, or None for a table that does not exist
+        self.names = None  # every table name, once table_names has run
+        self.schema_version = None
+        self.checked_at = 0.0
+        self.counters = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0, "schema_checks": 0}
+        db_manager.connection.set_authorizer(self._authorizer)
+
+    def _authorizer(self, action, arg1, arg2, db_name, trigger):
+        if action in self.DDL_ACTIONS and (self.tables or self.names is not None):
+            self.invalidate()
+        return sqlite3.SQLITE_OK
+
+    def invalidate(self):
+        self.tables = {}
+        self.names = None
+        self.schema_version = None
+        self.counters["invalidations"] += 1
+
+    def _check_schema(self):
+        now = time.monotonic()
+        if self.schema_version is None:
+            self.schema_version = self.db_manager.schema_version()
+            self.checked_at = now
+        elif now - self.checked_at >= self.check_interval:
+            # DDL from other connections only shows up as a new schema_version
+            self.checked_at = now
+            self.counters["schema_checks"] += 1
+            schema_version = self.db_manager.schema_version()
+            if schema_version != self.schema_version:
+                self.invalidate()
+                self.schema_version = schema_version
+
+    @instrumented("metadata_cache.load")
+    def load(self, table_name):
+        # Columns, foreign keys and unique column sets of one table, or None when it does not exist
+        cursor = self.db_manager.connection.cursor()
+        cursor.execute("""
+            SELECT p.name, p.type, p.pk, p."notnull", p.dflt_value
+            FROM sqlite_master AS m
+            JOIN pragma_table_info(m.name) AS p
+            WHERE m.type='table' AND m.name=?
+            ORDER BY p.cid;
+        """, (table_name,))
+        columns = cursor.fetchall()
+        self.counters["loads"] += 1
+        if not columns:
+            return None
+
+        cursor.execute('SELECT "from", "table", "to" FROM pragma_foreign_key_list(?);', (table_name,))
+        foreign_keys = cursor.fetchall()
+
+        # Column sets of the unique indexes (UNIQUE and PRIMARY KEY constraints included)
+        cursor.execute("""
+            SELECT il.name, ii.name
+            FROM pragma_index_list(?) AS il
+            JOIN pragma_index_info(il.name) AS ii
+            WHERE il."unique"=1
+            ORDER BY il.name, ii.seqno;
+        """, (table_name,))
+        unique = {}
+        for index_name, col_name in cursor.fetchall():
+            unique.setdefault(index_name, []).append(col_name)
+
+        return {
+            "columns": columns,
+            "names": {col[0] for col in columns},
+            "pk": [col[0] for col in sorted(columns, key=lambda col: col[2]) if col[2]],
+            "unique": [tuple(cols) for cols in unique.values()],
+            "foreign_keys": foreign_keys,
+        }
+
+    def _table(self, table_name):
+        self._check_schema()
+        if table_name in self.tables:
+            self.counters["hits"] += 1
+        else:
+            self.counters["misses"] += 1
+            self.tables[table_name] = self.load(table_name)
+        return self.tables[table_name]
+
+    def table_names(self):
+        self._check_schema()
+        if self.names is None:
+            self.names = [name for (name,) in self.db_manager.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type='table';")]
+        return list(self.names)
+
+    def table_exists(self, table_name):
+        return self._table(table_name) is not None
+
+    def column_exists(self, table_name, column_name):
+        table = self._table(table_name)
+        return table is not None and column_name in table["names"]
+
+    def columns(self, table_name):
+        # (name, declared type, pk position, not null, default value) in table order
+        table = self._table(table_name)
+        return list(table["columns"]) if table is not None else []
+
+    def column_names(self, table_name):
+        return [col[0] for col in self.columns(table_name)]
+
+    def primary_key(self, table_name):
+        table = self._table(table_name)
+        return list(table["pk"]) if table is not None else []
+
+    def unique(self, table_name):
+        table = self._table(table_name)
+        return list(table["unique"]) if table is not None else []
+
+    def foreign_keys(self, table_name):
+        table = self._table(table_name)
+        return list(table["foreign_keys"]) if table is not None else []
+
+    def stats(self):
+        return dict(self.counters)
+
+
+class DatabaseManager:
+    def __init__(self, db_name, read_only=False, pool=None):
+        # With a ConnectionPool the connection is checked out of it, and close_connection
+        # returns it to the pool instead of closing it
+        self.db_name = db_name
+        self.pool = pool
+        if pool is not None:
+            self.connection = pool.checkout(db_name, read_only)
+        elif read_only:
+            self.connection = sqlite3.connect(f"{pathlib.Path(db_name).absolute().as_uri()}?mode=ro", uri=True)
+        else:
+            self.connection = sqlite3.connect(db_name)
+        instruments.attach(self.connection)
+        self.cursor = self.connection.cursor()
+        self.metadata = MetadataCache(self)
+
+    def schema_version(self):
+        # fetchall() so the statement is reset and no read lock is held afterwards
+        return self.connection.execute("PRAGMA schema_version;").fetchall()[0][0]
+
+    @instrumented("schema_fingerprints")
+    def schema_fingerprints(self):
+        # Cheap change detection: PRAGMA schema_version moves on every DDL statement, and each
+        # table is fingerprinted by hashing its CREATE statement together with its indexes
+        schema_version = self.schema_version()
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT tbl_name, type, name, sql FROM sqlite_master
+            WHERE tbl_name IN (SELECT name FROM sqlite_master WHERE type='table')
+            AND type IN ('table', 'index')
+            ORDER BY tbl_name, type DESC, name;
+        """)
+        hashes = {}
+        for table_name, obj_type, name, sql in cursor.fetchall():
+            if table_name not in hashes:
+                hashes[table_name] = hashlib.sha1()
+            hashes[table_name].update(f"{obj_type}:{name}:{sql}\n".encode())
+        fingerprints = {table_name: digest.hexdigest() for table_name, digest in hashes.items()}
+        return schema_version, fingerprints
+
+    @instrumented("harvest_catalog")
+    def harvest_catalog(self, tables=None, fingerprints=None):
+        # Read the whole catalog of the source database up front, using the
+        # table-valued pragma functions so every table is covered by one query
+        # per kind of metadata instead of one PRAGMA call per table.
+        # When tables is given only those tables are harvested. fingerprints is the
+        # (schema_version, fingerprints) pair of schema_fingerprints when the caller has it.
+        cursor = self.connection.cursor()
+        schema_version, fingerprints = fingerprints or self.schema_fingerprints()
+        if tables is None:
+            tables = list(fingerprints)
+        tables = [table_name for table_name in tables if table_name in fingerprints]
+        tables_json = json.dumps(tables)
+
+        # Get unique columns (every column that takes part in an index)
+        cursor.execute("""
+            SELECT DISTINCT m.name, ii.name
+            FROM sqlite_master AS m
+            JOIN pragma_index_list(m.name) AS il
+            JOIN pragma_index_info(il.name) AS ii
+            WHERE m.type='table' AND m.name IN (SELECT value FROM json_each(?));
+        """, (tables_json,))
+        unique_columns = set(cursor.fetchall())
+
+        cursor.execute("""
+            SELECT m.name, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master AS m
+            JOIN pragma_table_info(m.name) AS p
+            WHERE m.type='table' AND m.name IN (SELECT value FROM json_each(?))
+            ORDER BY m.name, p.cid;
+        """, (tables_json,))
+        columns = []
+        for table_name, col_name, col_type, not_null, dflt_value, pk in cursor.fetchall():
+            unique_indicator = 1 if (table_name, col_name) in unique_columns else 0
+            columns.append((col_name, table_name, col_type, pk, not_null, unique_indicator, dflt_value))
+
+        # Foreign keys: (table, column, referenced table, referenced column)
+        cursor.execute("""
+            SELECT m.name, fk."from", fk."table", fk."to"
+            FROM sqlite_master AS m
+            JOIN pragma_foreign_key_list(m.name) AS fk
+            WHERE m.type='table' AND m.name IN (SELECT value FROM json_each(?));
+        """, (tables_json,))
+        foreign_keys = cursor.fetchall()
+
+        return {
+            "database": self.db_name,
+            "schema_version": schema_version,
+            "fingerprints": fingerprints,
+            "tables": [(table_name, self.db_name) for table_name in tables],
+            "columns": columns,
+            "foreign_keys": foreign_keys,
+        }
+
+    def changed_catalog(self, stored_version=None, stored=None, force=False):
+        # Harvest only the tables whose fingerprint differs from the stored one.
+        # Returns None when the schema_version shows nothing changed since the last save.
+        if not force and stored_version is not None and stored_version == self.schema_version():
+            return None
+
+        schema_version, fingerprints = self.schema_fingerprints()
+        changed = [table_name for table_name, fingerprint in fingerprints.items()
+                   if force or (stored or {}).get(table_name) != fingerprint]
+        return self.harvest_catalog(changed, (schema_version, fingerprints))
+
+    @instrumented("save_metadata")
+    def save_metadata(self, catalog=None, force=False, snapshot=None):
+        # snapshot: path of a catalog snapshot (see snapshot.py) to rewrite afterwards, if any
+        with open_metadata(self.pool) as metadata_connection:
+            metadata_cursor = metadata_connection.cursor()
+
+            if catalog is None:
+                metadata_cursor.execute("SELECT schema_version FROM DATABASE_FINGERPRINT WHERE database=?;",
+                                        (self.db_name,))
+                stored_version = metadata_cursor.fetchone()
+                catalog = self.changed_catalog(stored_version[0] if stored_version else None,
+                                               stored_fingerprints(metadata_cursor, self.db_name), force)
+
+            written = 0
+            if catalog is not None:
+                # Write the whole diff in a single transaction (one fsync instead of one per row)
+                with transaction(metadata_connection, "save_metadata.commit"):
+                    written = write_catalog(metadata_cursor, catalog)
+            if snapshot is not None and (written or not os.path.exists(snapshot)):
+                write_snapshot(metadata_connection, snapshot)
+            return written
+
+    @instrumented("profile")
+    def profile(self, tables=None, sample_size=None, top_k=10):
+        # Column statistics of the given tables (all of them by default), one scan per table;
+        # tables with more than sample_size rows are sampled
+        tables = self.metadata.table_names() if tables is None else tables
+        return [profile_table(self.connection, table_name, sample_size, top_k) for table_name in tables]
+
+    def save_statistics(self, tables=None, sample_size=None, top_k=10):
+        # Optional profiling pass after save_metadata: stores TABLE_STATS and COLUMN_STATS
+        profiles = self.profile(tables, sample_size, top_k)
+        with open_metadata(self.pool) as metadata_connection:
+            with transaction(metadata_connection, "save_statistics.commit"):
+                return write_statistics(metadata_connection.cursor(), self.db_name, profiles)
+
+    def table_exists(self, table_name):
+        return self.metadata.table_exists(table_name)
+
+    def column_exists(self, table_name, column_name):
+        return self.metadata.column_exists(table_name, column_name)
+
+    @instrumented("create_table")
+    def create_table(self, table_name, columns, foreign_keys=None):
+        # Check if the table already exists
+        if self.table_exists(table_name):
+            print(f"Table {table_name} already exists.")
+            return
+
+        # Check if referenced table and column exist for each foreign key
+        for fk in (foreign_keys or []):
+            referenced_table, referenced_column = fk['table'], fk['referenced_column']
+            if not self.table_exists(referenced_table):
+                print(f"Referenced table {referenced_table} does not exist.")
+                return
+            if not self.column_exists(referenced_table, referenced_column):
+                print(f"Referenced column {referenced_column} in table {referenced_table} does not exist.")
+                return
+
+        # Build columns string
+        columns_str = ', '.join(columns)
+
+        # Build foreign keys string
+        foreign_keys_str = ', '.join(
+            [f"FOREIGN KEY ({fk['column']}) REFERENCES {fk['table']}({fk['referenced_column']})" for fk in
+             (foreign_keys or [])])
+
+        # Combine columns and foreign keys in the CREATE TABLE query
+        if foreign_keys_str == '':
+            query = f"CREATE TABLE {table_name} ({columns_str})"
+        else:
+            query = f"CREATE TABLE {table_name} ({columns_str}, {foreign_keys_str})"
+
+        # Execute the query
+        self.cursor.execute(query)
+        self.connection.commit()
+        self.metadata.invalidate()
+        print(f"Table {table_name} created successfully.")
+
+    @instrumented("insert_data")
+    def insert_data(self, table_name, values):
+        # Check if the table exists
+        if not self.table_exists(table_name):
+            print(f"Table {table_name} does not exist.")
+            return
+
+        # Build the INSERT query
+        columns_str = ', '.join(values.keys())
+        values_str = ', '.join(['?' for _ in values.values()])
+        query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});"
+
+        # Execute the query
+        self.cursor.execute(query, tuple(values.values()))
+        self.connection.commit()
+        print("Data inserted successfully.")
+
+    @instrumented("bulk_insert")
+    def bulk_insert(self, table_name, rows, batch_size=10000, columns=None, progress=True, validate=False):
+        # Insert rows (dicts, or sequences in the order of columns / of the table) with executemany,
+        # committing once per batch. The table and columns are validated once, up front.
+        # With validate, each batch's foreign keys are checked before it is committed (see
+        # integrity.ForeignKeyValidator); a batch with violations is rolled back and
+        # sqlite3.IntegrityError raised with the report, the batches before it stay committed.
+        if not self.table_exists(table_name):
+            print(f"Table {table_name} does not exist.")
+            return 0
+
+        table_columns = [col[0] for col in self.column_metadata(table_name)]
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        if columns is None:
+            columns = list(first.keys()) if isinstance(first, dict) else table_columns[:len(first)]
+        unknown = [col for col in columns if col not in table_columns]
+        if unknown:
+            print(f"Columns {', '.join(unknown)} do not exist in table {table_name}.")
+            return 0
+
+        if isinstance(first, dict):
+            to_tuple = lambda row: tuple(row.get(col) for col in columns)
+        else:
+            to_tuple = tuple
+        query = (f"INSERT INTO {quote_name(table_name)} ({', '.join(quote_name(col) for col in columns)}) "
+                 f"VALUES ({', '.join('?' for _ in columns)});")
+        check = None
+        if validate:
+            validator = ForeignKeyValidator(self.connection, self.db_name, pool=self.pool)
+            check = lambda batch: validator.validate_batch(table_name, columns, batch)
+
+        start = time.perf_counter()
+        inserted = 0
+        batch = [to_tuple(first)]
+        for row in rows:
+            batch.append(to_tuple(row))
+            if len(batch) >= batch_size:
+                inserted += self._insert_batch(query, batch, check)
+                batch = []
+                if progress:
+                    elapsed = time.perf_counter() - start
+                    print(f"{inserted} rows inserted ({inserted / elapsed:,.0f} rows/s)")
+        if batch:
+            inserted += self._insert_batch(query, batch, check)
+
+        elapsed = time.perf_counter() - start
+        if progress:
+            print(f"Data inserted successfully: {inserted} rows in {elapsed:.2f}s "
+                  f"({inserted / max(elapsed, 1e-9):,.0f} rows/s)")
+        return inserted
+
+    def _insert_batch(self, query, batch, check=None):
+        # One transaction per batch; a failing batch is rolled back as a whole
+        try:
+            self.cursor.executemany(query, batch)
+            if check is not None:
+                violations = [result for result in check(batch) if result["violations"]]
+                if violations:
+                    raise sqlite3.IntegrityError(f"Batch rejected:\n{format_report(violations)}")
+            timed_commit(self.connection, "bulk_insert.commit")
+        except sqlite3.Error:
+            self.connection.rollback()
+            raise
+        instruments.add_rows(len(batch))
+        return len(batch)
+
+    @instrumented("validate_foreign_keys")
+    def validate_foreign_keys(self, tables=None, sample=10):
+        # Referential integrity of the rows already stored, from the database's own foreign keys
+        # (metadata.db is only read); returns the report of integrity.ForeignKeyValidator
+        validator = ForeignKeyValidator(self.connection, self.db_name, pool=self.pool, sample=sample)
+        return validator.validate(tables)
+
+    def load_csv(self, table_name, path, **kwargs):
+        # The header line names the columns
+        with open(path, newline="") as csv_file:
+            return self.bulk_insert(table_name, csv.DictReader(csv_file), **kwargs)
+
+    def load_jsonl(self, table_name, path, **kwargs):
+        # One JSON object per line
+        with open(path) as jsonl_file:
+            return self.bulk_insert(table_name, (json.loads(line) for line in jsonl_file if line.strip()), **kwargs)
+
+    @instrumented("export_columns")
+    def export_columns(self, table_name, chunk_size=65536):
+        # The table as typed column buffers (see columnar.export_table). Types come from the COLUMNS
+        # meta-relation, or from the live catalog when the table is not registered yet.
+        with open_metadata(self.pool) as metadata_connection:
+            types = dict(metadata_connection.execute(
+                "SELECT name, type FROM COLUMNS WHERE database=? AND table_name=?;",
+                (self.db_name, table_name)).fetchall())
+        if not types:
+            if not self.table_exists(table_name):
+                raise ValueError(f"Table {table_name} does not exist.")
+            types = {col[0]: col[1] for col in self.metadata.columns(table_name)}
+        table = export_table(self.connection, table_name, types, chunk_size)
+        instruments.add_rows(table.rows)
+        return table
+
+    def close_connection(self):
+        if self.pool is not None:
+            self.pool.checkin(self.connection)
+        else:
+            self.connection.close()
+
+    @instrumented("database_metadata")
+    def database_metadata(self):
+        # The information show_database_metadata prints, as plain data
+        tables = {}
+        for table_name in self.metadata.table_names():
+            unique_columns = {col for cols in self.metadata.unique(table_name) for col in cols}
+            tables[table_name] = {
+                "columns": [{"name": name, "type": col_type, "not_null": bool(not_null), "dflt_value": dflt_value,
+                             "pk": pk, "unique": name in unique_columns}
+                            for name, col_type, pk, not_null, dflt_value in self.metadata.columns(table_name)],
+                "foreign_keys": [{"column": col_name, "table": ref_table, "referenced_column": ref_col}
+                                 for col_name, ref_table, ref_col in self.metadata.foreign_keys(table_name)],
+            }
+        return tables
+
+    @instrumented("show_database_metadata")
+    def show_database_metadata(self):
+        # Fetch and print tables, columns, and constraints information
+        tables_query = "SELECT name FROM sqlite_master WHERE type='table';"
+        self.cursor.execute(tables_query)
+        tables = self.cursor.fetchall()
+
+        for table in tables:
+            table_name = table[0]
+            print(f"\n\nTable: {table_name}")
+
+            # Columns
+            columns_query = f"PRAGMA table_info({table_name});"
+            self.cursor.execute(columns_query)
+            columns = self.cursor.fetchall()
+
+            # Get primary key columns
+            pk_columns_query = f"PRAGMA table_info({table_name});"
+            self.cursor.execute(pk_columns_query)
+            pk_columns = [col[1] for col in self.cursor.fetchall() if col[5] == 1]  # col[5] is the "pk" column
+
+            # Get unique columns
+            unique_columns_query = f"PRAGMA index_list({table_name});"
+            self.cursor.execute(unique_columns_query)
+            index_list = self.cursor.fetchall()
+
+            unique_columns = []
+            for index_info in index_list:
+                index_name = index_info[1]
+                index_info_query = f"PRAGMA index_info({index_name});"
+                self.cursor.execute(index_info_query)
+                index_columns = [col[2] for col in self.cursor.fetchall()]
+                unique_columns.extend(index_columns)
+
+            unique_columns = list(set(unique_columns))  # Remove duplicates
+
+            # Print header for columns
+            print("{:<15} {:<15} {:<8} {:<15} {:<3} {:<6}".format("name", "type", "notnull", "  dflt_value", "pk",
+                                                                  "unique"))
+            print("-" * 70)
+
+
+            for col in columns:
+                cid, name, data_type, not_null, default_value, pk = col
+
+                # Handle cases where values are None
+                not_null = "   1" if not_null else "   0"
+                default_value = f"      {default_value}" if default_value is not None else "    none"
+                pk_indicator = "1" if name in pk_columns else "0"
+                unique_indicator = "   1" if name in unique_columns else "   0"
+
+                print("{:<15} {:<15} {:<8} {:<15} {:<3} {:<6}".format(name, data_type, not_null, default_value,
+                                                                      pk_indicator, unique_indicator))
+
+            # Foreign Keys
+            foreign_keys_query = f"PRAGMA foreign_key_list({table_name});"
+            self.cursor.execute(foreign_keys_query)
+            foreign_keys = self.cursor.fetchall()
+
+            if foreign_keys:
+                print("\nForeign Keys:")
+                for fk in foreign_keys:
+                    print(f"{fk[3]} references {fk[2]}({fk[4]})\n")
+
+    def column_metadata(self, table_name):
+        # (name, declared type, pk position) of every column, in table order
+        return [(col[0], col[1], col[2]) for col in self.metadata.columns(table_name)]
+
+    def table_rows_query(self, table_name, page_size=None, after=None):
+        # SELECT of every column followed by the primary key (rowid when the table has none), with
+        # keyset pagination on that key: rows after the key `after`, at most page_size of them
+        columns = self.column_metadata(table_name)
+        pk_columns = [col[0] for col in sorted(columns, key=lambda col: col[2]) if col[2]] or ["rowid"]
+        key = ", ".join(quote_name(col) for col in pk_columns)
+        query = f"SELECT {', '.join(quote_name(col[0]) for col in columns)}, {key} FROM {quote_name(table_name)}"
+        params = []
+        if after is not None:
+            after = list(after) if isinstance(after, (list, tuple)) else [after]
+            query += f" WHERE ({key}) > ({', '.join('?' for _ in after)})"
+            params = after
+        if page_size is not None or after is not None:
+            query += f" ORDER BY {key}"
+        if page_size is not None:
+            query += " LIMIT ?"
+            params.append(page_size)
+        return query + ";", params
+
+    @instrumented("show_table_data")
+    def show_table_data(self, table_name, page_size=None, after=None, chunk_size=1000, sample_size=1000):
+        # Check if the table exists
+        if not self.table_exists(table_name):
+            print(f"\nTable {table_name} does not exist.")
+            return
+
+        columns = self.column_metadata(table_name)
+        column_names = [col[0] for col in columns]
+        query, params = self.table_rows_query(table_name, page_size, after)
+
+        # Fetch and print data from the table, one chunk at a time
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchmany(chunk_size)
+
+        if not rows:
+            print(f"No data found in table {table_name}.")
+            return
+
+        # Column widths come from the declared type (VARCHAR(15), DECIMAL(5), DATE, ...) and,
+        # for columns without a declared length, from a bounded sample of the first chunk
+        sample = rows[:sample_size]
+        col_widths = []
+        for i, (header, col_type, _) in enumerate(columns):
+            width = declared_width(col_type)
+            if width is None:
+                width = max(len(str(row[i])) for row in sample)
+            col_widths.append(max(len(str(header)), width))
+
+        # Print table header
+        header = " | ".join(f"{header:<{width}}" for header, width in zip(column_names, col_widths))
+        print(header)
+        print("-" * sum(col_widths + [len(column_names) - 1] * 3))  # separator line
+
+        # Print data rows
+        n_columns = len(column_names)
+        last_key = None
+        while rows:
+            for row in rows:
+                row_str = " | ".join(f"{str(value):<{width}}" for value, width in zip(row, col_widths))
+                print(row_str)
+            instruments.add_rows(len(rows))
+            last_key = rows[-1][n_columns:]
+            rows = cursor.fetchmany(chunk_size)
+
+        # The key to pass as after= for the next page
+        if page_size is not None:
+            print(f"-- next page: --after {','.join(map(str, last_key))}")
+        return last_key[0] if len(last_key) == 1 else tuple(last_key)
+
+
+def show_existing_databases():
+    print("\nExisting Databases:")
+    for filename in os.listdir():
+        if filename.endswith(".db"):
+            print(filename)
+
+
+def _harvest_changed(db_name, stored_version, stored):
+    # Worker side of register_all: harvest one source database through a read-only connection
+    db_manager = DatabaseManager(db_name, read_only=True)
+    try:
+        return db_manager.changed_catalog(stored_version, stored)
+    finally:
+        db_manager.close_connection()
+
+
+@instrumented("register_all")
+def register_all(directory=".", workers=None, processes=False, batch_size=64, snapshot=None):
+    # Register every .db file of a directory in metadata.db. Catalogs are harvested in parallel by
+    # a thread (or process) pool, and this thread is the only writer: finished catalogs are written
+    # in batches, one transaction per batch, so the workers never contend for the metadata file lock.
+    # Databases are registered under their absolute path, so GlobalQuery, jobs and the watcher find
+    # them from any working directory; a file already registered under another name that leads to
+    # it from here keeps that name. A database that cannot be harvested is reported in "failed".
+    # snapshot: path of a catalog snapshot to rewrite at the end, if any
+    start = time.perf_counter()
+    metadata_path = os.path.abspath(store.metadata_db_name)
+    paths = sorted(os.path.abspath(os.path.join(directory, filename)) for filename in os.listdir(directory)
+                   if filename.endswith(".db"))
+
+    metadata_connection = connect_metadata()
+    try:
+        metadata_cursor = metadata_connection.cursor()
+        registered = {os.path.abspath(db_name): db_name
+                      for (db_name,) in metadata_cursor.execute("SELECT name FROM DATABASES;").fetchall()}
+        db_names = [registered.get(path, path) for path in paths if path != metadata_path]
+        metadata_cursor.execute("SELECT database, schema_version FROM DATABASE_FINGERPRINT;")
+        stored_versions = dict(metadata_cursor.fetchall())
+        stored = {}
+        metadata_cursor.execute("SELECT database, table_name, fingerprint FROM TABLE_FINGERPRINT;")
+        for db_name, table_name, fingerprint in metadata_cursor.fetchall():
+            stored.setdefault(db_name, {})[table_name] = fingerprint
+
+        summary = {"databases": len(db_names), "changed": 0, "failed": {}, "rows": 0}
+        pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        batch = []
+        with pool_class(max_workers=workers) as pool:
+            futures = {}
+            for db_name in db_names:
+                harvest = (_harvest_changed, db_name, stored_versions.get(db_name), stored.get(db_name))
+                # Threads harvest under register_all; worker processes are not instrumented
+                futures[pool.submit(*harvest) if processes else pool.submit(instruments.bind(*harvest))] = db_name
+            for future in as_completed(futures):
+                try:
+                    catalog = future.result()
+                except Exception as e:
+                    # Not a database, unreadable, or a worker process that died: the others go on
+                    summary["failed"][futures[future]] = str(e) or type(e).__name__
+                    continue
+                if catalog is not None:
+                    batch.append(catalog)
+                if len(batch) >= batch_size:
+                    summary["rows"] += _write_batch(metadata_connection, batch)
+                    summary["changed"] += len(batch)
+                    batch = []
+        if batch:
+            summary["rows"] += _write_batch(metadata_connection, batch)
+            summary["changed"] += len(batch)
+        if snapshot is not None and (summary["changed"] or not os.path.exists(snapshot)):
+            write_snapshot(metadata_connection, snapshot)
+    finally:
+        metadata_connection.close()
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def _write_batch(metadata_connection, catalogs):
+    metadata_cursor = metadata_connection.cursor()
+    with transaction(metadata_connection, "register_all.commit"):
+        return sum(write_catalog(metadata_cursor, catalog) for catalog in catalogs)
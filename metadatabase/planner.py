@@ -0,0 +1,391 @@
+import math
+import pathlib
+import sqlite3
+from itertools import combinations
+
+from .global_query import GlobalQuery
+from .sqlutil import quote_name, sql_tokens
+from .store import open_metadata, stored_statistics
+
+# Relative cost of handling one row: SQLite reads and joins rows in C, a Python hash join pays
+# for fetching every row into Python and hashing or probing it
+SQLITE_ROW_COST = 1.0
+PYTHON_ROW_COST = 12.0
+# Selectivity of a filter the estimator cannot analyse
+DEFAULT_SELECTIVITY = 0.25
+# Join orders are searched exhaustively (dynamic programming over subsets) up to this many tables,
+# greedily beyond
+EXHAUSTIVE_LIMIT = 10
+
+
+class JoinPlan:
+    # A left-deep join order. Each step adds one table, either inside SQLite (the tables so far and
+    # the new one are joined on the attached databases, the new one looked up through an index or
+    # an automatic index) or as a Python hash join. Once a step runs in Python the rest does too.
+    def __init__(self, steps, joins, filters):
+        self.steps = steps
+        self.joins = joins
+        self.filters = filters
+
+    @property
+    def cost(self):
+        return self.steps[-1]["cost"]
+
+    @property
+    def rows(self):
+        return self.steps[-1]["rows"]
+
+    @property
+    def tables(self):
+        return [step["table"] for step in self.steps]
+
+    def explain(self):
+        lines = [f"JOIN PLAN: estimated cost {self.cost:,.0f}, {self.rows:,.0f} rows"]
+        for i, step in enumerate(self.steps, 1):
+            target = f"{step['table']} ({step['database']})"
+            if step["on"]:
+                target += " ON " + " AND ".join(f"{a}.{ac} = {b}.{bc}" for a, ac, b, bc in step["on"])
+            if step["table"] in self.filters:
+                target += f" WHERE {self.filters[step['table']][0]}"
+            lines.append(f"{i:>3}. {step['method'].upper():<18} {target}")
+            lines.append(f"{'':>5}{'rows':>6} {step['rows']:>14,.0f}   cost {step['cost']:>16,.0f}")
+        return "\n".join(lines)
+
+
+class JoinPlanner:
+    # Cost-based join ordering for queries over tables of several registered databases, using the
+    # TABLES, COLUMNS and FOREIGN_KEY meta-relations and the row counts and distinct counts of
+    # TABLE_STATS/COLUMN_STATS. Tables that were never profiled get a row-count estimate from their
+    # source (sqlite_stat1, else max(rowid)). Plans run through a GlobalQuery.
+    def __init__(self, metadata_db=None, pool=None, databases=None, attach_limit=None):
+        self.query = GlobalQuery(metadata_db, attach_limit, databases, pool)
+        self.row_counts = {}
+        self.load(metadata_db, pool)
+
+    def load(self, metadata_db=None, pool=None):
+        with open_metadata(pool, metadata_db) as metadata_connection:
+            cursor = metadata_connection.cursor()
+            # (database, table) -> {lower column: (pk, indexed)}
+            self.column_info = {}
+            for name, table_name, pk, unique_col, database in cursor.execute(
+                    "SELECT name, table_name, pk, unique_col, database FROM COLUMNS;"):
+                self.column_info.setdefault((database, table_name), {})[name.lower()] = (pk, unique_col)
+            self.foreign_keys = cursor.execute(
+                "SELECT database, table_name, col, refrenced_table, refrenced_col FROM FOREIGN_KEY;").fetchall()
+            self.stored_rows, stored_columns = stored_statistics(cursor)
+            self.stored_columns = {(database, table_name, column_name.lower()): stats
+                                   for (database, table_name, column_name), stats in stored_columns.items()}
+
+    def close(self):
+        self.query.close()
+
+    # Estimates ------------------------------------------------------------------------------------------------------
+
+    def table(self, table_name):
+        # Logical table name -> (table, database), as GlobalQuery resolves it
+        matches = self.query.tables.get(table_name.lower(), [])
+        if not matches:
+            raise ValueError(f"Table {table_name} is not registered.")
+        if len(matches) > 1:
+            raise ValueError(f"Table {table_name} is registered in several databases: "
+                             f"{', '.join(database for _, database in matches)}.")
+        return matches[0]
+
+    def row_count(self, table_name):
+        table_name, database = self.table(table_name)
+        if (database, table_name) in self.stored_rows:
+            return self.stored_rows[(database, table_name)]
+        if (database, table_name) not in self.row_counts:
+            self.row_counts[(database, table_name)] = self._source_row_count(database, table_name)
+        return self.row_counts[(database, table_name)]
+
+    def _source_row_count(self, database, table_name):
+        # Cheap estimates: the row count ANALYZE left in sqlite_stat1, or the largest rowid (one
+        # b-tree descent). WITHOUT ROWID tables are counted.
+        source = sqlite3.connect(f"{pathlib.Path(database).absolute().as_uri()}?mode=ro", uri=True)
+        try:
+            try:
+                stat = source.execute("SELECT stat FROM sqlite_stat1 WHERE tbl=?;", (table_name,)).fetchall()
+                if stat:
+                    return int(stat[0][0].split()[0])
+            except sqlite3.OperationalError:
+                pass  # never analysed
+            try:
+                return source.execute(f"SELECT max(rowid) FROM {quote_name(table_name)};").fetchall()[0][0] or 0
+            except sqlite3.OperationalError:
+                return source.execute(f"SELECT count(*) FROM {quote_name(table_name)};").fetchall()[0][0]
+        finally:
+            source.close()
+
+    def distinct_count(self, table_name, column_name):
+        table_name, database = self.table(table_name)
+        rows = self.row_count(table_name)
+        stats = self.stored_columns.get((database, table_name, column_name.lower()))
+        if stats is not None and stats[1] is not None:
+            return max(1, stats[1])
+        # A single-column primary key or a unique_col column (e.g. DEPARTMENT.Dname) has a value per row
+        info = self.column_info.get((database, table_name), {})
+        pk_columns = [name for name, (pk, _) in info.items() if pk]
+        if pk_columns == [column_name.lower()] or info.get(column_name.lower(), (0, 0))[1]:
+            return max(1, rows)
+        # The usual assumption of SQLite's own planner: ten rows per value of an indexed column
+        return max(1, rows // 10)
+
+    def indexed(self, table_name, column_name):
+        table_name, database = self.table(table_name)
+        pk, indexed = self.column_info.get((database, table_name), {}).get(column_name.lower(), (0, 0))
+        return bool(pk or indexed)
+
+    def selectivity(self, table_name, condition):
+        # col = literal (or literal = col) uses the column's distinct count, col IN (a, b, ...) that
+        # many times it; anything else gets DEFAULT_SELECTIVITY
+        tokens = [token for token in sql_tokens(condition) if token[1] != ";"]
+        texts = [text for _, text, _ in tokens]
+        if len(tokens) == 3 and texts[1] in ("=", "=="):
+            column = tokens[0] if tokens[0][0] == "name" else tokens[2]
+            if column[0] == "name":
+                return 1 / self.distinct_count(table_name, column[2])
+        if len(tokens) > 4 and tokens[0][0] == "name" and tokens[1][2] == "in" and texts[2] == "(":
+            values = texts[3:-1:2]
+            return min(1.0, len(values) / self.distinct_count(table_name, tokens[0][2]))
+        return DEFAULT_SELECTIVITY
+
+    def foreign_key_joins(self, tables):
+        # Join predicates implied by the foreign keys between the given (distinct) tables. They are
+        # only a safe default while they form a forest: when the foreign keys close a cycle (two of
+        # them between the same pair of tables, e.g. EMPLOYEE.Dno and DEPARTMENT.Mgr_ssn, or a
+        # loop through several tables) ANDing them all changes the meaning of the query, and which
+        # one is meant cannot be guessed, so the joins have to be given.
+        resolved = {self.table(t): t for t in tables}
+        parents = {t: t for t in tables}
+
+        def root(table_name):
+            while parents[table_name] != table_name:
+                table_name = parents[table_name] = parents[parents[table_name]]
+            return table_name
+
+        joins = []
+        for database, table_name, col, ref_table, ref_col in self.foreign_keys:
+            if table_name != ref_table and (table_name, database) in resolved and (ref_table, database) in resolved:
+                join = (resolved[(table_name, database)], col, resolved[(ref_table, database)], ref_col)
+                a, b = root(join[0]), root(join[2])
+                if a == b:
+                    raise ValueError(f"The foreign keys between {', '.join(tables)} form a cycle "
+                                     f"({' AND '.join(f'{t}.{c} = {r}.{rc}' for t, c, r, rc in joins + [join])}); "
+                                     f"give the joins explicitly.")
+                parents[a] = b
+                joins.append(join)
+        return joins
+
+    # Planning -------------------------------------------------------------------------------------------------------
+
+    def plan(self, tables, joins=None, filters=None):
+        # tables: logical table names. joins: (table, column, table, column) equalities, by default
+        # the foreign keys between the tables. filters: {table: condition} or
+        # {table: (condition, selectivity)}, evaluated at the table's source.
+        joins, filters = self._normalize(tables, joins, filters)
+        in_sqlite = self._attachable(tables)
+        if len(tables) <= EXHAUSTIVE_LIMIT:
+            best = self._dynamic_programming(tables, joins, filters, in_sqlite)
+        else:
+            best = self._greedy(tables, joins, filters, in_sqlite)
+        return JoinPlan(best, joins, filters)
+
+    def naive_plan(self, tables, joins=None, filters=None):
+        # The tables joined left to right as written, in SQLite when the databases can be attached
+        joins, filters = self._normalize(tables, joins, filters)
+        location = "sqlite" if self._attachable(tables) else "python"
+        steps = [self._first_step(tables[0], filters, location)]
+        for table_name in tables[1:]:
+            steps.append(self._join_step(steps, table_name, joins, filters, location))
+        return JoinPlan(steps, joins, filters)
+
+    def _normalize(self, tables, joins, filters):
+        if not tables:
+            raise ValueError("A join needs at least one table.")
+        for table_name in tables:
+            self.table(table_name)
+        joins = self.foreign_key_joins(tables) if joins is None else list(joins)
+        normalized = {}
+        for table_name, condition in (filters or {}).items():
+            if isinstance(condition, str):
+                condition = (condition, self.selectivity(table_name, condition))
+            normalized[table_name] = condition
+        return joins, normalized
+
+    def _attachable(self, tables):
+        return len({self.table(t)[1] for t in tables}) <= self.query.attach_limit
+
+    def _filtered_rows(self, table_name, filters):
+        rows = self.row_count(table_name)
+        if table_name in filters:
+            rows *= filters[table_name][1]
+        return max(1.0, rows)
+
+    def _first_step(self, table_name, filters, location):
+        rows = self._filtered_rows(table_name, filters)
+        cost = SQLITE_ROW_COST * self.row_count(table_name)
+        if location == "python":
+            cost += PYTHON_ROW_COST * rows
+        return {"table": table_name, "database": self.table(table_name)[1], "method": "scan" if location == "sqlite"
+                else "fetch", "on": [], "rows": rows, "cost": cost, "location": location}
+
+    def _join_step(self, steps, table_name, joins, filters, location):
+        # Add table_name to the tables of steps; location is where this join runs
+        done = {step["table"] for step in steps}
+        on = [(a, ac, b, bc) for a, ac, b, bc in joins if a in done and b == table_name]
+        on += [(b, bc, a, ac) for a, ac, b, bc in joins if b in done and a == table_name]
+        outer = steps[-1]["rows"]
+        inner_total = self.row_count(table_name)
+        inner = self._filtered_rows(table_name, filters)
+        selectivity = 1.0
+        for a, ac, b, bc in on:
+            selectivity /= max(self.distinct_count(a, ac), self.distinct_count(b, bc))
+        rows = max(1.0, outer * inner * selectivity)
+
+        log_inner = math.log2(inner_total + 1) + 1
+        if location == "sqlite":
+            if on and any(self.indexed(table_name, bc) for _, _, _, bc in on):
+                method = "sqlite index join"
+                cost = SQLITE_ROW_COST * (outer * log_inner + rows)
+            elif on:
+                # SQLite builds a transient index on the join column first
+                method = "sqlite auto-index"
+                cost = SQLITE_ROW_COST * (inner_total * log_inner + outer * log_inner + rows)
+            else:
+                method = "sqlite cross join"
+                cost = SQLITE_ROW_COST * (outer * inner_total + rows)
+        else:
+            method = "hash join"
+            # Fetch and hash the new table, stream the rows so far through the probe
+            cost = SQLITE_ROW_COST * inner_total + PYTHON_ROW_COST * (inner + rows)
+            if steps[-1]["location"] == "sqlite":
+                cost += PYTHON_ROW_COST * outer
+            else:
+                cost += PYTHON_ROW_COST * outer * 0.5  # probing rows already in Python
+        return {"table": table_name, "database": self.table(table_name)[1], "method": method, "on": on,
+                "rows": rows, "cost": steps[-1]["cost"] + cost, "location": location}
+
+    def _extensions(self, steps, table_name, joins, filters, in_sqlite):
+        locations = ["python"] if not in_sqlite or steps[-1]["location"] == "python" else ["sqlite", "python"]
+        return [steps + [self._join_step(steps, table_name, joins, filters, location)] for location in locations]
+
+    def _connected(self, done, table_name, joins):
+        return any(a in done and b == table_name or b in done and a == table_name for a, _, b, _ in joins)
+
+    def _dynamic_programming(self, tables, joins, filters, in_sqlite):
+        # best[(subset, location)] is the cheapest left-deep plan joining exactly that subset and
+        # ending in that location. Cross products are only considered when nothing connects.
+        best = {}
+        for table_name in tables:
+            for location in (["sqlite", "python"] if in_sqlite else ["python"]):
+                best[(frozenset([table_name]), location)] = [self._first_step(table_name, filters, location)]
+        for size in range(2, len(tables) + 1):
+            for subset in combinations(tables, size):
+                subset = frozenset(subset)
+                for table_name in subset:
+                    rest = subset - {table_name}
+                    if not self._connected(rest, table_name, joins) and any(
+                            self._connected(subset - {other}, other, joins) for other in subset):
+                        continue
+                    for location in ("sqlite", "python"):
+                        steps = best.get((rest, location))
+                        if steps is None:
+                            continue
+                        for candidate in self._extensions(steps, table_name, joins, filters, in_sqlite):
+                            key = (subset, candidate[-1]["location"])
+                            if key not in best or candidate[-1]["cost"] < best[key][-1]["cost"]:
+                                best[key] = candidate
+        full = frozenset(tables)
+        return min((best[(full, location)] for location in ("sqlite", "python") if (full, location) in best),
+                   key=lambda steps: steps[-1]["cost"])
+
+    def _greedy(self, tables, joins, filters, in_sqlite):
+        # Start from the smallest filtered table, then repeatedly add the cheapest connected table
+        location = "sqlite" if in_sqlite else "python"
+        first = min(tables, key=lambda t: self._filtered_rows(t, filters))
+        steps = [self._first_step(first, filters, location)]
+        remaining = [t for t in tables if t != first]
+        while remaining:
+            done = {step["table"] for step in steps}
+            candidates = [t for t in remaining if self._connected(done, t, joins)] or remaining
+            steps = min((candidate for t in candidates
+                         for candidate in self._extensions(steps, t, joins, filters, in_sqlite)),
+                        key=lambda candidate: candidate[-1]["cost"])
+            remaining.remove(steps[-1]["table"])
+        return steps
+
+    # Execution ------------------------------------------------------------------------------------------------------
+
+    def execute(self, plan, chunk_size=10000):
+        # Iterator over the rows of the join, each the columns of every table in plan order. The
+        # SQLite steps run as one statement whose CROSS JOINs pin the planned order; the Python
+        # steps hash join the rest on top of its result, chunk_size rows at a time, so only the hash
+        # tables are held in memory. They are built first, so only one statement is open on the
+        # GlobalQuery connection at a time: consume the rows before running another query on it.
+        columns = {}
+        for table_name in plan.tables:
+            # In declared order, as SELECT * returns them
+            cursor = self.query.execute(f"SELECT * FROM {quote_name(table_name)} LIMIT 0;")
+            columns[table_name] = [description[0].lower() for description in cursor.description]
+        offsets = {}
+        width = 0
+        for table_name in plan.tables:
+            offsets[table_name] = width
+            width += len(columns[table_name])
+
+        prefix = [step for step in plan.steps if step["location"] == "sqlite"] or plan.steps[:1]
+        probes = []
+        for step in plan.steps[len(prefix):]:
+            table = {}
+            build_keys = [columns[step["table"]].index(bc.lower()) for _, _, _, bc in step["on"]]
+            for row in self._fetch(self._table_sql(step["table"], plan.filters), chunk_size):
+                key = tuple(row[i] for i in build_keys)
+                if None not in key:  # NULL never equals anything
+                    table.setdefault(key, []).append(row)
+            probe_keys = [offsets[a] + columns[a].index(ac.lower()) for a, ac, _, _ in step["on"]]
+            probes.append((probe_keys, table))
+
+        if prefix[0]["location"] == "sqlite":
+            sql = self._prefix_sql(prefix, plan.filters)
+        else:
+            sql = self._table_sql(prefix[0]["table"], plan.filters)
+        for rows in self._fetch_chunks(sql, chunk_size):
+            for probe_keys, table in probes:
+                rows = [row + match for row in rows for match in table.get(tuple(row[i] for i in probe_keys), ())]
+            yield from rows
+
+    def _fetch_chunks(self, sql, chunk_size):
+        cursor = self.query.execute(sql)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+    def _fetch(self, sql, chunk_size):
+        for rows in self._fetch_chunks(sql, chunk_size):
+            yield from rows
+
+    def _table_sql(self, table_name, filters):
+        sql = f"SELECT * FROM {quote_name(table_name)}"
+        if table_name in filters:
+            sql += f" WHERE {filters[table_name][0]}"
+        return sql + ";"
+
+    def _prefix_sql(self, steps, filters):
+        # Filtered tables become subqueries, so their conditions can name columns without a
+        # qualifier; SQLite flattens them back into the join
+        def source(table_name):
+            if table_name in filters:
+                return f"(SELECT * FROM {quote_name(table_name)} WHERE {filters[table_name][0]}) AS {quote_name(table_name)}"
+            return quote_name(table_name)
+
+        select = ", ".join(f"{quote_name(step['table'])}.*" for step in steps)
+        sql = f"SELECT {select} FROM {source(steps[0]['table'])}"
+        for step in steps[1:]:
+            sql += f" CROSS JOIN {source(step['table'])}"
+            if step["on"]:
+                sql += " ON " + " AND ".join(f"{quote_name(a)}.{quote_name(ac)} = {quote_name(b)}.{quote_name(bc)}"
+                                             for a, ac, b, bc in step["on"])
+        return sql + ";"
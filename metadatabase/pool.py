@@ -0,0 +1,173 @@
+import os
+import pathlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from . import store
+from .instrument import instruments
+
+# Applied to every pooled connection of a source database. journal_mode is left alone here since
+# it is persistent and changes the files of the source databases.
+DEFAULT_PRAGMAS = {
+    "cache_size": -16000,  # KiB, i.e. 16 MB of page cache per connection
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+
+
+class ConnectionPool:
+    # Thread-safe pool of sqlite3 connections keyed by database path (and read-only mode).
+    # Connections stay open between checkouts, so the PRAGMA setup is paid once and the statement
+    # cache of each connection (cached_statements) keeps its prepared statements across requests.
+    # The metadata store is pooled the same way; its connections are opened through
+    # connect_metadata and so also get the METADATA_PRAGMAS and the schema bootstrap.
+    def __init__(self, max_size=8, pragmas=None, metadata_pragmas=None, cached_statements=256, timeout=None):
+        self.max_size = max_size
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.metadata_pragmas = dict(self.pragmas if metadata_pragmas is None else metadata_pragmas)
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.idle = {}  # key -> idle connections
+        self.open = {}  # key -> number of open connections
+        self.keys = {}  # id(connection) -> key
+        self.counters = {"created": 0, "reused": 0, "waits": 0}
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def _key(self, db_name, read_only):
+        # (absolute path, mode) with mode one of "rw", "ro" and "metadata"
+        return os.path.abspath(db_name), "ro" if read_only else "rw"
+
+    def _connect(self, key):
+        path, mode = key
+        if mode == "metadata":
+            connection = store.connect_metadata(path, check_same_thread=False,
+                                                cached_statements=self.cached_statements)
+            pragmas = self.metadata_pragmas
+        else:
+            if mode == "ro":
+                connection = sqlite3.connect(f"{pathlib.Path(path).as_uri()}?mode=ro", uri=True,
+                                             check_same_thread=False, cached_statements=self.cached_statements)
+            else:
+                connection = sqlite3.connect(path, check_same_thread=False,
+                                             cached_statements=self.cached_statements)
+            pragmas = self.pragmas
+        for pragma, value in pragmas.items():
+            connection.execute(f"PRAGMA {pragma}={value};").fetchall()
+        return connection
+
+    def checkout(self, db_name, read_only=False):
+        return self._checkout(self._key(db_name, read_only))
+
+    def _checkout(self, key):
+        with self.condition:
+            if self.closed:
+                raise sqlite3.ProgrammingError("The connection pool is closed.")
+            while not self.idle.get(key) and self.open.get(key, 0) >= self.max_size:
+                self.counters["waits"] += 1
+                if not self.condition.wait(self.timeout):
+                    raise TimeoutError(f"No free connection to '{key[0]}' after {self.timeout}s.")
+            if self.idle.get(key):
+                connection = self.idle[key].pop()
+                self.counters["reused"] += 1
+                return connection
+            self.open[key] = self.open.get(key, 0) + 1
+
+        try:
+            connection = self._connect(key)
+        except Exception:
+            with self.condition:
+                self.open[key] -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.keys[id(connection)] = key
+            self.counters["created"] += 1
+        return connection
+
+    def checkin(self, connection):
+        # Leave the connection the way a new one would be: no open transaction, no hooks
+        if connection.in_transaction:
+            connection.rollback()
+        connection.set_authorizer(None)
+        connection.set_trace_callback(None)
+        with self.condition:
+            key = self.keys[id(connection)]
+            if self.closed:
+                del self.keys[id(connection)]
+                self.open[key] -= 1
+                connection.close()
+                return
+            self.idle.setdefault(key, []).append(connection)
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, db_name, read_only=False):
+        connection = self.checkout(db_name, read_only)
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    @contextmanager
+    def metadata(self, db_name=None):
+        # A connection to the metadata store (metadata.db unless db_name is given)
+        connection = self._checkout((os.path.abspath(db_name or store.metadata_db_name), "metadata"))
+        try:
+            yield connection
+        finally:
+            self.checkin(connection)
+
+    async def run(self, db_name, function, *args, read_only=False, executor=None):
+        # For asyncio front ends: run function(connection, *args) on a pooled connection in an
+        # executor thread, so the event loop never blocks on SQLite. Its statements are credited to
+        # the caller's operation.
+        import asyncio  # already loaded by the caller's event loop; not at module level, to keep imports cheap
+
+        def call():
+            with self.connection(db_name, read_only) as connection:
+                return function(connection, *args)
+        return await asyncio.get_running_loop().run_in_executor(executor, instruments.bind(call))
+
+    async def run_metadata(self, function, *args, executor=None):
+        import asyncio
+
+        def call():
+            with self.metadata() as connection:
+                return function(connection, *args)
+        return await asyncio.get_running_loop().run_in_executor(executor, instruments.bind(call))
+
+    def stats(self):
+        with self.condition:
+            counters = dict(self.counters)
+            counters["open"] = sum(self.open.values())
+            counters["idle"] = sum(len(idle) for idle in self.idle.values())
+        return counters
+
+    def close(self):
+        # Close the idle connections now; checked-out ones are closed when they come back
+        with self.condition:
+            self.closed = True
+            for key, idle in self.idle.items():
+                for connection in idle:
+                    del self.keys[id(connection)]
+                    self.open[key] -= 1
+                    connection.close()
+            self.idle = {}
+            self.condition.notify_all()
+
+
+@contextmanager
+def open_source(pool, db_name):
+    # A read-only connection to a source database for one operation: checked out of the pool when
+    # there is one, otherwise opened here and closed afterwards (see store.open_metadata)
+    if pool is not None:
+        with pool.connection(db_name, read_only=True) as connection:
+            yield connection
+    else:
+        connection = sqlite3.connect(f"{pathlib.Path(db_name).absolute().as_uri()}?mode=ro", uri=True)
+        try:
+            yield connection
+        finally:
+            connection.close()
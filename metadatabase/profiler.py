@@ -0,0 +1,157 @@
+import hashlib
+import math
+import time
+
+from .sqlutil import quote_name
+
+
+class HyperLogLog:
+    # Distinct-count sketch: 2**precision one-byte registers (4 KiB at the default precision 12),
+    # standard error about 1.04 / sqrt(2**precision), i.e. 1.6%. Values are hashed through their
+    # repr, so 1 and '1' count as different values, as they are in SQLite.
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), "big")
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Small range correction (linear counting)
+            estimate = self.m * math.log(self.m / zeros)
+        return round(estimate)
+
+
+class FrequentItems:
+    # Top-K sketch (Misra-Gries): keeps at most `capacity` counters, and when a new value does not
+    # fit every counter is decremented. Counts are lower bounds, off by at most n / capacity.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self.n = 0
+
+    def add(self, value):
+        self.n += 1
+        counters = self.counters
+        if value in counters:
+            counters[value] += 1
+        elif len(counters) < self.capacity:
+            counters[value] = 1
+        else:
+            for key in list(counters):
+                if counters[key] == 1:
+                    del counters[key]
+                else:
+                    counters[key] -= 1
+
+    def top(self, k):
+        # Only values known to make up more than 1 / capacity of the rows; a near-unique column
+        # has no top values
+        threshold = self.n / self.capacity
+        frequent = [item for item in self.counters.items() if item[1] > threshold]
+        return sorted(frequent, key=lambda item: item[1], reverse=True)[:k]
+
+
+def sqlite_order(value):
+    # Sort key that orders mixed values the way SQLite does: numbers, then text, then blobs
+    if isinstance(value, (int, float)):
+        return 0, value
+    if isinstance(value, str):
+        return 1, value
+    return 2, value
+
+
+class ColumnProfile:
+    def __init__(self, name, top_k=10, precision=12):
+        self.name = name
+        self.top_k = top_k
+        self.nulls = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.distinct = HyperLogLog(precision)
+        self.frequent = FrequentItems(top_k * 10)
+
+    def add(self, value):
+        self.count += 1
+        if value is None:
+            self.nulls += 1
+            return
+        self.distinct.add(value)
+        self.frequent.add(value)
+        key = sqlite_order(value)
+        if self.min is None or key < sqlite_order(self.min):
+            self.min = value
+        if self.max is None or key > sqlite_order(self.max):
+            self.max = value
+
+    def result(self, row_count):
+        # Scale the sample up to the table: distinct counts only when the sample looks unique
+        # (a column that repeats in the sample is assumed to have seen most of its values)
+        scale = row_count / self.count if self.count else 1.0
+        non_null = self.count - self.nulls
+        distinct = self.distinct.count()
+        if scale > 1 and non_null and distinct >= 0.9 * non_null:
+            distinct = round(distinct * scale)
+        return {
+            "column": self.name,
+            "null_frac": self.nulls / self.count if self.count else 0.0,
+            "distinct_count": min(distinct, round(non_null * scale)),
+            "min": self.min,
+            "max": self.max,
+            "top_values": [(value.hex() if isinstance(value, bytes) else value, round(count * scale))
+                           for value, count in self.frequent.top(self.top_k)],
+        }
+
+
+def profile_table(connection, table_name, sample_size=None, top_k=10, precision=12):
+    # One scan of the table (or of a Bernoulli sample of about sample_size rows when the table is
+    # bigger) feeds every column's profile at once. The row count is exact: counted by the scan,
+    # or with a sample_size by count(*) first, which is needed to size the sample.
+    cursor = connection.execute(f"SELECT * FROM {quote_name(table_name)} LIMIT 0;")
+    profiles = [ColumnProfile(description[0], top_k, precision) for description in cursor.description]
+
+    query = f"SELECT * FROM {quote_name(table_name)}"
+    params = ()
+    row_count = None
+    if sample_size is not None:
+        row_count = connection.execute(f"SELECT count(*) FROM {quote_name(table_name)};").fetchall()[0][0]
+    sampled = row_count is not None and row_count > sample_size
+    if sampled:
+        # random() is uniform over 64-bit integers: keep a row with probability sample_size / row_count
+        query += " WHERE abs(random() % ?) < ?"
+        params = (row_count, sample_size)
+    cursor = connection.execute(query + ";", params)
+
+    scanned = 0
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        scanned += len(rows)
+        for row in rows:
+            for profile, value in zip(profiles, row):
+                profile.add(value)
+    if not sampled:
+        row_count = scanned
+
+    return {
+        "table": table_name,
+        "row_count": row_count,
+        "sampled_rows": scanned if sampled else None,
+        "profiled_at": time.time(),
+        "columns": [profile.result(row_count) for profile in profiles],
+    }
@@ -0,0 +1,160 @@
+import json
+import re
+from difflib import SequenceMatcher
+
+from .store import open_metadata, search_indexes
+
+# bm25 weights of the CATALOG_SEARCH columns: name, table_name, database, type
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0, 1.0)
+# How many distinct names a fuzzy query re-ranks, and the similarity it needs
+FUZZY_CANDIDATES = 200
+FUZZY_THRESHOLD = 0.6
+
+WORD = re.compile(r"\w+")
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like_escape(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class CatalogSearch:
+    # Ranked search over the names in metadata.db (the CATALOG_SEARCH and CATALOG_TRIGRAM indexes,
+    # refreshed by write_catalog, see store.migrate_metadata_schema_v4):
+    #   "emp ssn"   every word as a prefix of a word of the name, table, database or type, ranked by
+    #               bm25 with the name weighted highest ("_" separates words)
+    #   "*ssn*"     substring of the name (3 characters or more), through the trigram index
+    #   otherwise, when the prefix query finds too little, names sharing trigrams with the query
+    #   are re-ranked by similarity, so "salery" still finds Salary
+    # On SQLite builds without FTS5 (or its trigram tokenizer) the same queries run as LIKE and
+    # instr() scans of CATALOG_ENTRIES and CATALOG_NAMES, ranked by name length instead of bm25.
+    def __init__(self, metadata_db=None, pool=None):
+        self.metadata_db = metadata_db
+        self.pool = pool
+
+    def search(self, query, kind=None, database=None, limit=20, fuzzy=True):
+        # Returns [{"kind", "database", "table", "name", "type", "score"}], best first; kind is one
+        # of "database", "table" and "column"
+        with open_metadata(self.pool, self.metadata_db) as metadata_connection:
+            self.indexes = search_indexes(metadata_connection.cursor())
+            if query.startswith("*") or query.endswith("*"):
+                results = self._substring(metadata_connection, query.strip("*"), kind, database, limit)
+            else:
+                results = self._prefix(metadata_connection, query, kind, database, limit)
+            if fuzzy and len(results) < limit:
+                seen = {(r["kind"], r["database"], r["table"], r["name"]) for r in results}
+                for result in self._fuzzy(metadata_connection, query.strip("*"), kind, database, limit):
+                    if (result["kind"], result["database"], result["table"], result["name"]) not in seen:
+                        results.append(result)
+                results = results[:limit]
+        return results
+
+    def _filters(self, kind, database):
+        conditions, params = [], []
+        if kind is not None:
+            conditions.append("e.kind = ?")
+            params.append(kind)
+        if database is not None:
+            conditions.append("e.database = ?")
+            params.append(database)
+        return "".join(f" AND {condition}" for condition in conditions), params
+
+    def _rows(self, cursor):
+        return [{"kind": kind, "database": database, "table": table_name or None, "name": name, "type": col_type,
+                 "score": score} for kind, database, table_name, name, col_type, score in cursor]
+
+    def _prefix(self, metadata_connection, query, kind, database, limit):
+        words = WORD.findall(query)
+        if not words:
+            return []
+        if "CATALOG_SEARCH" not in self.indexes:
+            return self._prefix_scan(metadata_connection, words, kind, database, limit)
+        match = " AND ".join(_quote(word) + "*" for word in words)
+        where, params = self._filters(kind, database)
+        return self._rows(metadata_connection.execute(f"""
+            SELECT e.kind, e.database, e.table_name, e.name, e.type, -bm25(CATALOG_SEARCH, ?, ?, ?, ?) AS score
+            FROM CATALOG_SEARCH JOIN CATALOG_ENTRIES AS e ON e.id = CATALOG_SEARCH.rowid
+            WHERE CATALOG_SEARCH MATCH ?{where}
+            ORDER BY score DESC LIMIT ?;
+        """, (*SEARCH_WEIGHTS, match, *params, limit)))
+
+    def _prefix_scan(self, metadata_connection, words, kind, database, limit):
+        # Without FTS5: every word is a prefix of the name, of a "_"-separated word of it, or of the
+        # table, database or type
+        conditions, params = [], []
+        for word in words:
+            prefix = _like_escape(word) + "%"
+            conditions.append("(" + " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in (
+                "e.name", "e.name", "e.table_name", "e.database", "e.type")) + ")")
+            params += [prefix, "%\\_" + prefix, prefix, prefix, prefix]
+        where, filter_params = self._filters(kind, database)
+        return self._rows(metadata_connection.execute(f"""
+            SELECT e.kind, e.database, e.table_name, e.name, e.type, 1.0 / length(e.name) AS score
+            FROM CATALOG_ENTRIES AS e WHERE {" AND ".join(conditions)}{where}
+            ORDER BY length(e.name), e.name LIMIT ?;
+        """, (*params, *filter_params, limit)))
+
+    def _substring(self, metadata_connection, text, kind, database, limit):
+        where, params = self._filters(kind, database)
+        if len(text) < 3 or "CATALOG_TRIGRAM" not in self.indexes:
+            # Too short for trigrams (or no trigram index): scan the distinct names
+            names = "SELECT name FROM CATALOG_NAMES WHERE instr(lower(name), lower(?)) > 0"
+            match = (text,)
+        else:
+            # The index keeps no positions (detail=none), so it finds the names holding every
+            # trigram of the text and instr() keeps those where they are consecutive
+            names = """
+                SELECT n.name FROM CATALOG_TRIGRAM JOIN CATALOG_NAMES AS n ON n.id = CATALOG_TRIGRAM.rowid
+                WHERE CATALOG_TRIGRAM MATCH ? AND instr(lower(n.name), lower(?)) > 0
+            """
+            trigrams = sorted({text.lower()[i:i + 3] for i in range(len(text) - 2)})
+            match = (" AND ".join(_quote(trigram) for trigram in trigrams), text)
+        # Shorter names are closer matches
+        return self._rows(metadata_connection.execute(f"""
+            SELECT e.kind, e.database, e.table_name, e.name, e.type, 1.0 / length(e.name) AS score
+            FROM CATALOG_ENTRIES AS e WHERE e.name IN ({names}){where}
+            ORDER BY length(e.name), e.name LIMIT ?;
+        """, (*match, *params, limit)))
+
+    def _fuzzy(self, metadata_connection, text, kind, database, limit):
+        text = text.lower()
+        trigrams = sorted({text[i:i + 3] for i in range(len(text) - 2)})
+        if not trigrams:
+            return []
+        # Candidate names share the most trigrams with the query (the rank of an OR query is bm25,
+        # which grows with the number of terms matched), then are re-ranked by similarity
+        if "CATALOG_TRIGRAM" in self.indexes:
+            candidates = metadata_connection.execute("""
+                SELECT n.name FROM CATALOG_TRIGRAM JOIN CATALOG_NAMES AS n ON n.id = CATALOG_TRIGRAM.rowid
+                WHERE CATALOG_TRIGRAM MATCH ? ORDER BY CATALOG_TRIGRAM.rank LIMIT ?;
+            """, (" OR ".join(_quote(trigram) for trigram in trigrams), FUZZY_CANDIDATES)).fetchall()
+        else:
+            shared = " + ".join("(instr(lower(name), ?) > 0)" for _ in trigrams)
+            candidates = metadata_connection.execute(f"""
+                SELECT name FROM (SELECT name, {shared} AS shared FROM CATALOG_NAMES)
+                WHERE shared > 0 ORDER BY shared DESC LIMIT ?;
+            """, (*trigrams, FUZZY_CANDIDATES)).fetchall()
+        scores = {}
+        matcher = SequenceMatcher()
+        matcher.set_seq2(text)  # the matcher caches what it learns about seq2
+        for (name,) in candidates:
+            matcher.set_seq1(name.lower())
+            if matcher.real_quick_ratio() >= FUZZY_THRESHOLD and matcher.quick_ratio() >= FUZZY_THRESHOLD:
+                score = matcher.ratio()
+                if score >= FUZZY_THRESHOLD:
+                    scores[name] = score
+        if not scores:
+            return []
+        where, params = self._filters(kind, database)
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        results = self._rows(metadata_connection.execute(f"""
+            SELECT e.kind, e.database, e.table_name, e.name, e.type, 0.0 FROM CATALOG_ENTRIES AS e
+            WHERE e.name IN (SELECT value FROM json_each(?)){where};
+        """, (json.dumps(best), *params)))
+        for result in results:
+            result["score"] = scores[result["name"]]
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results[:limit]
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .instrument import instruments, operation
+from .manager import DatabaseManager
+from .pool import ConnectionPool
+from .search import CatalogSearch
+from .watch import read_changes
+
+# Endpoints (database and table names are URL-encoded path segments). Only databases registered in
+# DATABASES are served; POST /databases/{db}/metadata also registers .db files inside base_dir.
+#   GET  /databases                               registered databases
+#   GET  /metrics                                 instrumentation in Prometheus text format (see instrument.py)
+#   GET  /search?q=QUERY                          databases, tables and columns by name; &kind=&limit=
+#   GET  /changes?since=ID                        CHANGE_LOG events after an id (see watch.py); &database=&limit=
+#   GET  /databases/{db}/metadata                 tables, columns and foreign keys (show_database_metadata)
+#   POST /databases/{db}/metadata                 harvest the database into metadata.db (save_metadata)
+#   GET  /databases/{db}/tables/{table}/rows      rows, streamed; ?page_size=N&after=PK (show_table_data)
+#   POST /databases/{db}/tables/{table}/rows      insert a JSON object or a list of them (insert_data)
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MetadataService:
+    # asyncio HTTP/JSON front end over the metadatabase. Request parsing and responses run on the
+    # event loop; every SQLite call runs on a bounded thread pool against pooled connections, so at
+    # most `workers` blocking calls are in flight and slow queries never stall the loop.
+    # At most `workers` requests are handled at once (the others wait on the semaphore): a streamed
+    # response keeps its connection between chunks, so without the limit every executor thread
+    # could end up blocked in the pool waiting for a connection held by a stream.
+    def __init__(self, workers=8, pool=None, chunk_size=500, base_dir="."):
+        self.base_dir = os.path.realpath(base_dir)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metadata-service")
+        self.pool = pool or ConnectionPool(max_size=workers)
+        self.slots = asyncio.Semaphore(min(workers, self.pool.max_size))
+        self.chunk_size = chunk_size
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host="127.0.0.1", port=8765):
+        host, port = await self.start(host, port)
+        print(f"Metadata service listening on http://{host}:{port}")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+    def blocking(self, function, *args):
+        # On the executor, under the request's operation (see instrument.Instrumentation.bind)
+        return asyncio.get_running_loop().run_in_executor(self.executor, instruments.bind(function, *args))
+
+    # HTTP/1.1 with keep-alive -----------------------------------------------------------------------------------------
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    # Where the next request starts is unknown: answer and drop the connection
+                    await self.respond(writer, 400, {"error": "Malformed request."})
+                    break
+                body = await reader.readexactly(length)
+
+                try:
+                    async with self.slots:
+                        with operation(endpoint(method, target)):
+                            await self.dispatch(method, target, body, writer)
+                except HTTPError as e:
+                    await self.respond(writer, e.status, {"error": str(e)})
+                except (sqlite3.Error, ValueError) as e:
+                    await self.respond(writer, 400 if isinstance(e, ValueError) else 500, {"error": str(e)})
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, content_type="application/json"):
+        # payload: JSON data, or text sent as is
+        body = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def write_chunk(self, writer, data):
+        data = data.encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        await writer.drain()
+
+    async def dispatch(self, method, target, body, writer):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if parts == ["databases"] and method == "GET":
+            return await self.respond(writer, 200, await self.blocking(self.list_databases))
+        if parts == ["metrics"] and method == "GET":
+            return await self.respond(writer, 200, instruments.prometheus(), "text/plain; version=0.0.4")
+        if parts == ["search"] and method == "GET":
+            if not query.get("q"):
+                raise HTTPError(400, "Missing the q parameter.")
+            return await self.respond(writer, 200, await self.blocking(self.search, query))
+        if parts == ["changes"] and method == "GET":
+            return await self.respond(writer, 200, await self.blocking(self.changes, query))
+        if len(parts) == 3 and parts[0] == "databases" and parts[2] == "metadata":
+            await self.blocking(self.check_database, parts[1], method == "POST")
+            if method == "GET":
+                return await self.respond(writer, 200, await self.blocking(self.database_metadata, parts[1]))
+            if method == "POST":
+                return await self.respond(writer, 200, await self.blocking(self.save_metadata, parts[1]))
+            raise HTTPError(405, f"{method} is not supported on {url.path}.")
+        if len(parts) == 5 and parts[0] == "databases" and parts[2] == "tables" and parts[4] == "rows":
+            await self.blocking(self.check_database, parts[1])
+            if method == "GET":
+                return await self.stream_rows(writer, parts[1], parts[3], query)
+            if method == "POST":
+                rows = json.loads(body or b"null")
+                if isinstance(rows, dict):
+                    rows = [rows]
+                if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                    raise HTTPError(400, "Expected a JSON object or a list of objects.")
+                return await self.respond(writer, 200, await self.blocking(self.insert_rows, parts[1], parts[3], rows))
+            raise HTTPError(405, f"{method} is not supported on {url.path}.")
+        raise HTTPError(404, f"No endpoint {method} {url.path}.")
+
+    # Operations, run on the executor -----------------------------------------------------------------------------------
+
+    def check_database(self, db_name, register=False):
+        # Only registered databases are served, never arbitrary paths. With register, a .db file
+        # that resolves (symlinks and .. included) to a path inside base_dir is accepted too.
+        with self.pool.metadata() as metadata_connection:
+            registered = metadata_connection.execute("SELECT 1 FROM DATABASES WHERE name=?;", (db_name,)).fetchall()
+        if registered and os.path.isfile(db_name):
+            return
+        path = os.path.realpath(db_name)
+        if (register and db_name.endswith(".db") and os.path.isfile(path)
+                and os.path.commonpath([self.base_dir, path]) == self.base_dir):
+            return
+        raise HTTPError(404, f"Database '{db_name}' not found.")
+
+    def list_databases(self):
+        with self.pool.metadata() as metadata_connection:
+            return {"databases": [row[0] for row in metadata_connection.execute("SELECT name FROM DATABASES;")]}
+
+    def search(self, query):
+        try:
+            limit = int(query.get("limit", 20))
+        except ValueError:
+            raise HTTPError(400, "limit must be an integer.") from None
+        results = CatalogSearch(pool=self.pool).search(query["q"], query.get("kind"), query.get("database"), limit)
+        return {"query": query["q"], "results": results}
+
+    def changes(self, query):
+        try:
+            since = int(query.get("since", 0))
+            limit = int(query.get("limit", 1000))
+        except ValueError:
+            raise HTTPError(400, "since and limit must be integers.") from None
+        with self.pool.metadata() as metadata_connection:
+            changes = read_changes(metadata_connection.cursor(), since, query.get("database"), limit)
+        return {"changes": changes, "last_id": changes[-1]["id"] if changes else since}
+
+    def database_metadata(self, db_name):
+        db_manager = DatabaseManager(db_name, read_only=True, pool=self.pool)
+        try:
+            return {"database": db_name, "tables": db_manager.database_metadata()}
+        finally:
+            db_manager.close_connection()
+
+    def save_metadata(self, db_name):
+        db_manager = DatabaseManager(db_name, read_only=True, pool=self.pool)
+        try:
+            return {"database": db_name, "rows_written": db_manager.save_metadata()}
+        finally:
+            db_manager.close_connection()
+
+    def insert_rows(self, db_name, table_name, rows):
+        db_manager = DatabaseManager(db_name, pool=self.pool)
+        try:
+            if not db_manager.table_exists(table_name):
+                raise HTTPError(404, f"Table {table_name} does not exist.")
+            inserted = db_manager.bulk_insert(table_name, rows, progress=False) if rows else 0
+            return {"database": db_name, "table": table_name, "inserted": inserted}
+        finally:
+            db_manager.close_connection()
+
+    def open_rows(self, db_manager, table_name, page_size, after):
+        # Column names and the cursor over the rows of a table
+        if not db_manager.table_exists(table_name):
+            raise HTTPError(404, f"Table {table_name} does not exist.")
+        columns = db_manager.metadata.column_names(table_name)
+        sql, params = db_manager.table_rows_query(table_name, page_size, after)
+        return columns, db_manager.connection.execute(sql, params)
+
+    async def stream_rows(self, writer, db_name, table_name, query):
+        # The response is sent with chunked transfer encoding, one chunk per fetchmany, so memory
+        # stays flat whatever the size of the table
+        page_size = int(query["page_size"]) if "page_size" in query else None
+        after = query["after"].split(",") if "after" in query else None
+        db_manager = await self.blocking(DatabaseManager, db_name, True, self.pool)
+        try:
+            columns, cursor = await self.blocking(self.open_rows, db_manager, table_name, page_size, after)
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n")
+            try:
+                await self.write_chunk(writer, '{"columns": ' + json.dumps(columns) + ', "rows": [')
+                n_columns = len(columns)
+                first = True
+                last_key = None
+                while True:
+                    rows = await self.blocking(cursor.fetchmany, self.chunk_size)
+                    if not rows:
+                        break
+                    data = ", ".join(json.dumps(list(row[:n_columns])) for row in rows)
+                    await self.write_chunk(writer, data if first else ", " + data)
+                    first = False
+                    last_key = list(rows[-1][n_columns:])
+                await self.write_chunk(writer, '], "next_after": ' + json.dumps(last_key if page_size else None) + "}")
+            except (sqlite3.Error, ValueError, TypeError) as e:
+                # The status line is gone: an error response would land inside the chunked body,
+                # so the response is cut short (no last chunk) and the connection closed
+                raise ConnectionAbortedError(f"Streaming {table_name} failed: {e}") from e
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            await self.blocking(db_manager.close_connection)
+
+
+def endpoint(method, target):
+    # The endpoint of a request as listed above, without the database and table names: the name of
+    # its instrumentation operation, whose statements on the executor are credited to it
+    parts = urlsplit(target).path.strip("/").split("/")
+    if method not in ("GET", "POST"):
+        return "service"
+    if len(parts) == 1 and parts[0] in ("databases", "metrics", "search", "changes"):
+        return f"service {method} /{parts[0]}"
+    if len(parts) == 3 and parts[0] == "databases" and parts[2] == "metadata":
+        return f"service {method} /databases/{{db}}/metadata"
+    if len(parts) == 5 and parts[0] == "databases" and parts[2] == "tables" and parts[4] == "rows":
+        return f"service {method} /databases/{{db}}/tables/{{table}}/rows"
+    return "service"
+
+
+def serve(host="127.0.0.1", port=8765, workers=8, base_dir="."):
+    service = MetadataService(workers=workers, base_dir=base_dir)
+    try:
+        asyncio.run(service.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,259 @@
+import mmap
+import os
+import struct
+import tempfile
+
+# Default snapshot file, next to metadata.db
+snapshot_name = "metadata.snapshot"
+
+# Layout (little endian): a header, then a string table and one array of fixed-width records per
+# kind of entry. Every name is an index into the string table; NO_STRING stands for NULL.
+#   header       magic, counts of strings / databases / tables / columns / foreign keys, and the
+#                offset of each section
+#   strings      uint32 offsets (n + 1), then the UTF-8 data back to back
+#   databases    name
+#   tables       name, lower-cased name, database index, first column, column count, first foreign
+#                key, foreign key count, row count (-1 when never profiled); sorted by lower-cased
+#                name then database, so a name is found by binary search
+#   columns      name, type, default, pk position, not null, indexed; each table's run is contiguous
+#   foreign keys column, referenced table, referenced column, referenced table index (-1 if not
+#                registered)
+MAGIC = b"MDSNAP1\0"
+HEADER = struct.Struct("<8s5I6Q")
+DATABASE = struct.Struct("<I")
+TABLE = struct.Struct("<7Iq")
+COLUMN = struct.Struct("<3IHBB")
+FOREIGN_KEY = struct.Struct("<3Ii")
+NO_STRING = 0xFFFFFFFF
+STRING_BOUNDS = struct.Struct("<II")
+INDEX = struct.Struct("<I")
+
+
+def write_snapshot(metadata_connection, path=None):
+    # Write an immutable snapshot of the whole catalog in metadata.db. The file is written next to
+    # its destination and renamed over it, so readers that have the old one mapped keep a
+    # consistent copy and new readers see the new one. Returns the path.
+    path = path or snapshot_name
+    strings = {}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    # One read transaction, so every section comes from the same version of the catalog
+    metadata_connection.execute("BEGIN;")
+    try:
+        databases = [row[0] for row in metadata_connection.execute("SELECT name FROM DATABASES ORDER BY name;")]
+        tables = metadata_connection.execute("SELECT name, database FROM TABLES;").fetchall()
+        columns = {}
+        for row in metadata_connection.execute("""
+                SELECT database, table_name, name, type, dflt_val, pk, not_null, unique_col
+                FROM COLUMNS ORDER BY rowid;
+                """):
+            columns.setdefault(row[:2], []).append(row[2:])
+        foreign_keys = {}
+        for database, table_name, col, ref_table, ref_col in metadata_connection.execute(
+                "SELECT database, table_name, col, refrenced_table, refrenced_col FROM FOREIGN_KEY;"):
+            foreign_keys.setdefault((database, table_name), []).append((col, ref_table, ref_col))
+        row_counts = {(database, table_name): row_count for database, table_name, row_count in
+                      metadata_connection.execute("SELECT database, table_name, row_count FROM TABLE_STATS;")}
+    finally:
+        metadata_connection.rollback()
+
+    database_index = {name: i for i, name in enumerate(databases)}
+    tables = sorted(((name.lower(), database, name) for name, database in tables if database in database_index))
+    table_index = {(database, lower): i for i, (lower, database, _) in enumerate(tables)}
+
+    database_records = b"".join(DATABASE.pack(intern(name)) for name in databases)
+    table_records = []
+    column_records = []
+    foreign_key_records = []
+    for lower, database, name in tables:
+        table_columns = columns.get((database, name), [])
+        table_foreign_keys = foreign_keys.get((database, name), [])
+        table_records.append(TABLE.pack(intern(name), intern(lower), database_index[database],
+                                        len(column_records), len(table_columns),
+                                        len(foreign_key_records), len(table_foreign_keys),
+                                        row_counts.get((database, name), -1)))
+        for col_name, col_type, dflt_val, pk, not_null, unique_col in table_columns:
+            column_records.append(COLUMN.pack(intern(col_name), intern(col_type), intern(dflt_val),
+                                              pk or 0, not_null or 0, unique_col or 0))
+        for col, ref_table, ref_col in table_foreign_keys:
+            foreign_key_records.append(FOREIGN_KEY.pack(intern(col), intern(ref_table), intern(ref_col),
+                                                        table_index.get((database, ref_table.lower()), -1)))
+
+    encoded = [value.encode() for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    sections = [struct.pack(f"<{len(offsets)}I", *offsets), b"".join(encoded), database_records,
+                b"".join(table_records), b"".join(column_records), b"".join(foreign_key_records)]
+
+    section_offsets = []
+    position = HEADER.size
+    for section in sections:
+        section_offsets.append(position)
+        position += len(section)
+    header = HEADER.pack(MAGIC, len(strings), len(databases), len(tables), len(column_records),
+                         len(foreign_key_records), *section_offsets)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as snapshot_file:
+            snapshot_file.write(header)
+            for section in sections:
+                snapshot_file.write(section)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return path
+
+
+class CatalogSnapshot:
+    # Read-only view of a snapshot file through mmap: nothing is parsed up front, every lookup
+    # unpacks the few records it needs. Processes mapping the same file share its page cache.
+    # The binary search compares raw UTF-8 bytes, and what a lookup decodes (the tables found for
+    # a name, strings, a table's columns) is kept, so repeated lookups are dict hits; the file
+    # never changes while it is mapped, so nothing has to be invalidated.
+    def __init__(self, path=None):
+        with open(path or snapshot_name, "rb") as snapshot_file:
+            self.mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_strings, self.n_databases, self.n_tables, self.n_columns, self.n_foreign_keys,
+         self.string_offsets, self.string_data, self.database_offset, self.table_offset,
+         self.column_offset, self.foreign_key_offset) = HEADER.unpack_from(self.mapped, 0)
+        if magic != MAGIC:
+            self.mapped.close()
+            raise ValueError(f"'{path}' is not a catalog snapshot.")
+        self._found = {}  # lower-cased table name -> table indexes
+        self._strings = {}  # string index -> str
+        self._columns = {}  # table index -> decoded columns
+
+    def close(self):
+        self.mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def string(self, i):
+        try:
+            return self._strings[i]
+        except KeyError:
+            pass
+        if i == NO_STRING:
+            return None
+        start, end = STRING_BOUNDS.unpack_from(self.mapped, self.string_offsets + 4 * i)
+        value = self._strings[i] = str(self.mapped[self.string_data + start:self.string_data + end], "utf-8")
+        return value
+
+    def _string_bytes(self, i):
+        start, end = STRING_BOUNDS.unpack_from(self.mapped, self.string_offsets + 4 * i)
+        return self.mapped[self.string_data + start:self.string_data + end]
+
+    def databases(self):
+        return [self.string(DATABASE.unpack_from(self.mapped, self.database_offset + DATABASE.size * i)[0])
+                for i in range(self.n_databases)]
+
+    def _table_record(self, i):
+        return TABLE.unpack_from(self.mapped, self.table_offset + TABLE.size * i)
+
+    def _lower_name(self, i):
+        # Raw bytes of the lower-cased name of table i, without unpacking the whole record
+        return self._string_bytes(INDEX.unpack_from(self.mapped, self.table_offset + TABLE.size * i + 4)[0])
+
+    def _find(self, table_name):
+        # Indexes of the tables named table_name (in any database), by binary search on the
+        # lower-cased names
+        lower = table_name.lower()
+        found = self._found.get(lower)
+        if found is not None:
+            return found
+        key = lower.encode()
+        low, high = 0, self.n_tables
+        while low < high:
+            middle = (low + high) // 2
+            if self._lower_name(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.n_tables and self._lower_name(low) == key:
+            found.append(low)
+            low += 1
+        found = self._found[lower] = tuple(found)
+        return found
+
+    def _resolve(self, table_name, database=None):
+        candidates = self._find(table_name)
+        if database is not None:
+            candidates = [i for i in candidates if self._database_name(self._table_record(i)[2]) == database]
+        if not candidates:
+            raise ValueError(f"Table {table_name} is not registered.")
+        if len(candidates) > 1:
+            raise ValueError(f"Table {table_name} is registered in several databases: "
+                             f"{', '.join(self._database_name(self._table_record(i)[2]) for i in candidates)}.")
+        return candidates[0]
+
+    def _database_name(self, i):
+        return self.string(DATABASE.unpack_from(self.mapped, self.database_offset + DATABASE.size * i)[0])
+
+    def tables(self, database=None):
+        # [(table, database)]
+        result = []
+        for i in range(self.n_tables):
+            record = self._table_record(i)
+            db_name = self._database_name(record[2])
+            if database is None or db_name == database:
+                result.append((self.string(record[0]), db_name))
+        return result
+
+    def table(self, table_name, database=None):
+        record = self._table_record(self._resolve(table_name, database))
+        return {"name": self.string(record[0]), "database": self._database_name(record[2]),
+                "columns": record[4], "foreign_keys": record[6],
+                "row_count": record[7] if record[7] >= 0 else None}
+
+    def table_exists(self, table_name, database=None):
+        if database is None:
+            return bool(self._find(table_name))
+        return any(self._database_name(self._table_record(i)[2]) == database for i in self._find(table_name))
+
+    def columns(self, table_name, database=None):
+        # (name, type, pk position, not null, indexed, default value), as stored in COLUMNS
+        return list(self._table_columns(self._resolve(table_name, database)))
+
+    def _table_columns(self, i):
+        columns = self._columns.get(i)
+        if columns is None:
+            record = self._table_record(i)
+            start = self.column_offset + COLUMN.size * record[3]
+            string = self.string
+            columns = self._columns[i] = tuple(
+                (string(name), string(col_type), pk, not_null, indexed, string(dflt_val))
+                for name, col_type, dflt_val, pk, not_null, indexed
+                in COLUMN.iter_unpack(self.mapped[start:start + COLUMN.size * record[4]]))
+        return columns
+
+    def column(self, table_name, column_name, database=None):
+        lower = column_name.lower()
+        for column in self._table_columns(self._resolve(table_name, database)):
+            if column[0].lower() == lower:
+                return column
+        return None
+
+    def foreign_keys(self, table_name, database=None):
+        # (column, referenced table, referenced column)
+        record = self._table_record(self._resolve(table_name, database))
+        result = []
+        for i in range(record[5], record[5] + record[6]):
+            col, ref_table, ref_col, _ = FOREIGN_KEY.unpack_from(
+                self.mapped, self.foreign_key_offset + FOREIGN_KEY.size * i)
+            result.append((self.string(col), self.string(ref_table), self.string(ref_col)))
+        return result
@@ -0,0 +1,81 @@
+import re
+
+SQL_TOKEN = re.compile(r"""
+    (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|\[[^\]]*\]|`(?:[^`]|``)*`)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)
+  | (?P<param>\?\d*|[:@$][A-Za-z_]\w*)
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<op>\|\||<<|>>|<=|>=|==|!=|<>|[-+*/%<>=~&|(),.;])
+  | (?P<space>\s+|--[^\n]*|/\*.*?\*/)
+""", re.VERBOSE | re.DOTALL)
+
+SQL_KEYWORDS = {
+    "all", "and", "as", "asc", "between", "by", "case", "cross", "desc", "distinct", "else", "end", "escape",
+    "except", "exists", "from", "full", "glob", "group", "having", "in", "inner", "intersect", "is", "isnull",
+    "join", "left", "like", "limit", "natural", "not", "notnull", "null", "offset", "on", "or", "order", "outer",
+    "regexp", "right", "select", "then", "union", "using", "values", "when", "where", "window", "with",
+}
+
+# Clauses that end the WHERE clause of a simple SELECT
+WHERE_END = {"group", "order", "limit", "having", "window", "union", "except", "intersect"}
+
+
+def sql_tokens(sql):
+    # Split SQL into (kind, text, value) tokens; value is the unquoted, lower-cased name of identifiers
+    tokens = []
+    position = 0
+    while position < len(sql):
+        match = SQL_TOKEN.match(sql, position)
+        if match is None:
+            raise ValueError(f"Cannot tokenize SQL near: {sql[position:position + 20]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "space":
+            continue
+        if kind == "quoted":
+            value = text[1:-1].replace(text[0] * 2, text[0]).lower()
+            kind = "name"
+        elif kind == "word":
+            value = text.lower()
+            kind = "keyword" if value in SQL_KEYWORDS else "name"
+        else:
+            value = text
+        tokens.append((kind, text, value))
+    return tokens
+
+
+def quote_name(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def type_affinity(col_type):
+    # SQLite's affinity of a declared column type: INTEGER, TEXT, BLOB (also for no type), REAL
+    # or NUMERIC, by the first of its rules that matches
+    col_type = (col_type or "").upper()
+    if "INT" in col_type:
+        return "INTEGER"
+    if any(word in col_type for word in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if "BLOB" in col_type or not col_type:
+        return "BLOB"
+    if any(word in col_type for word in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def declared_width(col_type):
+    # Display width implied by a declared column type, or None when the type has no length
+    match = re.match(r"\s*(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?", col_type or "")
+    if match is None:
+        return None
+    base, length, scale = match.group(1).upper(), match.group(2), match.group(3)
+    if base in ("DECIMAL", "NUMERIC") and length:
+        # digits, sign and decimal point
+        return int(length) + 1 + (1 if scale and int(scale) else 0)
+    if length and "CHAR" in base:
+        return int(length)
+    if base == "CHAR":
+        return 1
+    return {"DATE": 10, "DATETIME": 19, "TIMESTAMP": 19, "BOOLEAN": 1}.get(base)
@@ -0,0 +1,550 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .instrument import instrumented, instruments
+
+# ----------------------------------------------------------------------------------------------------------------------
+# metadata.db and its meta-relations
+metadata_db_name = "metadata.db"
+
+# Journal settings for the metadata store: WAL lets readers keep going while a harvest is written,
+# and synchronous=NORMAL only fsyncs at checkpoints instead of on every commit
+METADATA_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+}
+
+
+# Metadata files whose schema is known to be current in this process
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+
+def connect_metadata(db_name=None, **kwargs):
+    # The metadata schema is created (or migrated) lazily, the first time a file is opened.
+    # kwargs are passed on to sqlite3.connect.
+    db_name = db_name or metadata_db_name
+    connection = sqlite3.connect(db_name, **kwargs)
+    for pragma, value in METADATA_PRAGMAS.items():
+        connection.execute(f"PRAGMA {pragma}={value};")
+    path = os.path.abspath(db_name)
+    if path not in _bootstrapped:
+        with _bootstrap_lock:
+            if path not in _bootstrapped:
+                ensure_metadata_schema(connection)
+                _bootstrapped.add(path)
+    return instruments.attach(connection)
+
+
+@contextmanager
+def open_metadata(pool=None, db_name=None):
+    # A metadata.db connection for one operation: checked out of the pool when there is one,
+    # otherwise opened here and closed afterwards
+    if pool is not None:
+        with pool.metadata(db_name) as connection:
+            yield instruments.attach(connection)
+    else:
+        connection = connect_metadata(db_name)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+def stored_fingerprints(metadata_cursor, db_name):
+    metadata_cursor.execute("SELECT table_name, fingerprint FROM TABLE_FINGERPRINT WHERE database=?;", (db_name,))
+    return dict(metadata_cursor.fetchall())
+
+
+@instrumented("write_catalog")
+def write_catalog(metadata_cursor, catalog):
+    # Apply a harvested catalog to metadata.db as a diff: rows of harvested tables are inserted,
+    # updated or deleted to match the source, and tables that no longer exist are removed.
+    # Returns the number of metadata rows written.
+    db_name = catalog["database"]
+    harvested = [table_name for table_name, _ in catalog["tables"]]
+    stored = stored_fingerprints(metadata_cursor, db_name)
+    dropped = [table_name for table_name in stored if table_name not in catalog["fingerprints"]]
+    affected_json = json.dumps(harvested + dropped)
+    written = 0
+
+    metadata_cursor.execute("INSERT OR IGNORE INTO DATABASES VALUES (?);", (db_name,))
+    written += metadata_cursor.rowcount
+
+    # Tables
+    metadata_cursor.executemany("INSERT OR IGNORE INTO TABLES VALUES (?, ?);", catalog["tables"])
+    written += metadata_cursor.rowcount
+    metadata_cursor.executemany("DELETE FROM TABLES WHERE name=? AND database=?;",
+                                [(table_name, db_name) for table_name in dropped])
+    written += metadata_cursor.rowcount
+
+    # Columns
+    metadata_cursor.execute("""
+        SELECT name, table_name, type, pk, not_null, unique_col, dflt_val FROM COLUMNS
+        WHERE database=? AND table_name IN (SELECT value FROM json_each(?));
+    """, (db_name, affected_json))
+    old_columns = {(row[0], row[1]): row for row in metadata_cursor.fetchall()}
+    new_columns = {(row[0], row[1]): row for row in catalog["columns"]}
+
+    inserts = [row + (db_name,) for key, row in new_columns.items() if key not in old_columns]
+    updates = [row[2:] + (db_name,) + row[:2] for key, row in new_columns.items()
+               if key in old_columns and old_columns[key] != row]
+    deletes = [(db_name,) + key for key in old_columns if key not in new_columns]
+    metadata_cursor.executemany("INSERT INTO COLUMNS VALUES (?, ?, ?, ?, ?, ?, ?, ?);", inserts)
+    metadata_cursor.executemany("""
+        UPDATE COLUMNS SET type=?, pk=?, not_null=?, unique_col=?, dflt_val=?
+        WHERE database=? AND name=? AND table_name=?;
+    """, updates)
+    metadata_cursor.executemany("DELETE FROM COLUMNS WHERE database=? AND name=? AND table_name=?;", deletes)
+    written += len(inserts) + len(updates) + len(deletes)
+    # Tables whose names or columns changed, for the search index
+    reindexed = set(dropped) | {row[1] for row in inserts} | {row[-1] for row in updates} | {row[2] for row in deletes}
+
+    # Foreign keys: (column, referenced table, referenced column, database, table)
+    metadata_cursor.execute("""
+        SELECT col, refrenced_table, refrenced_col, database, table_name FROM FOREIGN_KEY
+        WHERE database=? AND table_name IN (SELECT value FROM json_each(?));
+    """, (db_name, affected_json))
+    old_foreign_keys = set(metadata_cursor.fetchall())
+    new_foreign_keys = {(col_name, ref_table, ref_col, db_name, table_name)
+                        for table_name, col_name, ref_table, ref_col in catalog["foreign_keys"]}
+
+    inserts = sorted(new_foreign_keys - old_foreign_keys)
+    deletes = [row[3:] + row[:3] for row in sorted(old_foreign_keys - new_foreign_keys)]
+    metadata_cursor.executemany("INSERT INTO FOREIGN_KEY VALUES (?, ?, ?, ?, ?);", inserts)
+    metadata_cursor.executemany("""
+        DELETE FROM FOREIGN_KEY
+        WHERE database=? AND table_name=? AND col=? AND refrenced_table=? AND refrenced_col=?;
+    """, deletes)
+    written += len(inserts) + len(deletes)
+
+    # Fingerprints
+    metadata_cursor.executemany("INSERT OR REPLACE INTO TABLE_FINGERPRINT VALUES (?, ?, ?);",
+                                [(db_name, table_name, catalog["fingerprints"][table_name])
+                                 for table_name in harvested])
+    metadata_cursor.executemany("DELETE FROM TABLE_FINGERPRINT WHERE database=? AND table_name=?;",
+                                [(db_name, table_name) for table_name in dropped])
+    metadata_cursor.execute("INSERT OR REPLACE INTO DATABASE_FINGERPRINT VALUES (?, ?);",
+                            (db_name, catalog["schema_version"]))
+
+    # Statistics of dropped tables are stale
+    for stats_table in ("TABLE_STATS", "COLUMN_STATS"):
+        metadata_cursor.executemany(f"DELETE FROM {stats_table} WHERE database=? AND table_name=?;",
+                                    [(db_name, table_name) for table_name in dropped])
+
+    # Search entries of the changed tables
+    index_catalog(metadata_cursor, db_name, json.dumps(sorted(reindexed)))
+
+    return written
+
+
+@instrumented("write_statistics")
+def write_statistics(metadata_cursor, db_name, profiles):
+    # Replace the stored statistics of the profiled tables (see profiler.profile_table).
+    # Returns the number of rows written.
+    metadata_cursor.executemany("INSERT OR REPLACE INTO TABLE_STATS VALUES (?, ?, ?, ?, ?);",
+                                [(db_name, profile["table"], profile["row_count"], profile["sampled_rows"],
+                                  profile["profiled_at"]) for profile in profiles])
+    metadata_cursor.executemany("DELETE FROM COLUMN_STATS WHERE database=? AND table_name=?;",
+                                [(db_name, profile["table"]) for profile in profiles])
+    rows = [(db_name, profile["table"], column["column"], column["null_frac"], column["distinct_count"],
+             column["min"], column["max"], json.dumps(column["top_values"]))
+            for profile in profiles for column in profile["columns"]]
+    metadata_cursor.executemany("INSERT INTO COLUMN_STATS VALUES (?, ?, ?, ?, ?, ?, ?, ?);", rows)
+    return len(profiles) + len(rows)
+
+
+def stored_statistics(metadata_cursor, db_name=None):
+    # {(database, table): row_count} and {(database, table, column): (null_frac, distinct_count)}
+    # of the profiled tables, for planners that need cardinalities without scanning the sources
+    where, params = ("WHERE database=?", (db_name,)) if db_name is not None else ("", ())
+    metadata_cursor.execute(f"SELECT database, table_name, row_count FROM TABLE_STATS {where};", params)
+    row_counts = {(database, table_name): row_count for database, table_name, row_count in metadata_cursor}
+    metadata_cursor.execute(f"""
+        SELECT database, table_name, column_name, null_frac, distinct_count FROM COLUMN_STATS {where};
+    """, params)
+    columns = {row[:3]: row[3:] for row in metadata_cursor}
+    return row_counts, columns
+
+
+# Version of the metadata schema, stored in PRAGMA user_version of metadata.db.
+# Each step upgrades a file from the previous version, in place and in one transaction.
+METADATA_SCHEMA_VERSION = 6
+
+
+def create_metadata_schema_v1(metadata_cursor):
+    # Create DATABASES table
+    metadata_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS DATABASES (
+            name TEXT PRIMARY KEY
+        );
+    """)
+
+    # Create TABLES table
+    metadata_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS TABLES (
+            name TEXT PRIMARY KEY,
+            database TEXT,
+            FOREIGN KEY (database) REFERENCES DATABASES(name)
+        );
+    """)
+
+    # Create COLUMNS table
+    metadata_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS COLUMNS (
+            name TEXT,
+            table_name TEXT,
+            type TEXT,
+            pk INTEGER,
+            not_null INTEGER,
+            unique_col INTEGER,
+            dflt_val TEXT,
+            PRIMARY KEY (name, table_name),
+            FOREIGN KEY (table_name) REFERENCES TABLES(name)
+        );
+    """)
+
+    # Create FOREIGN_KEY table
+    metadata_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS FOREIGN_KEY (
+            col TEXT,
+            refrenced_table TEXT,
+            refrenced_col TEXT,
+            PRIMARY KEY (col),
+            FOREIGN KEY (col) REFERENCES COLUMNS(name),
+            FOREIGN KEY (refrenced_table) REFERENCES TABLES(name)
+            FOREIGN KEY (refrenced_col) REFERENCES COLUMNS(name)
+        );
+    """)
+
+    # Create the fingerprint tables used to refresh the metadata incrementally
+    metadata_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS DATABASE_FINGERPRINT (
+            database TEXT PRIMARY KEY,
+            schema_version INTEGER,
+            FOREIGN KEY (database) REFERENCES DATABASES(name)
+        );
+    """)
+
+    metadata_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS TABLE_FINGERPRINT (
+            database TEXT,
+            table_name TEXT,
+            fingerprint TEXT,
+            PRIMARY KEY (database, table_name),
+            FOREIGN KEY (database) REFERENCES DATABASES(name)
+        );
+    """)
+
+
+def migrate_metadata_schema_v2(metadata_cursor):
+    # Composite keys that include the database (so equal table and column names in different
+    # databases no longer overwrite each other), foreign keys keyed by their owning table, and
+    # secondary indexes for reverse lookups
+    metadata_cursor.execute("""
+        CREATE TABLE TABLES_v2 (
+            name TEXT,
+            database TEXT,
+            PRIMARY KEY (database, name),
+            FOREIGN KEY (database) REFERENCES DATABASES(name)
+        );
+    """)
+    metadata_cursor.execute("""
+        CREATE TABLE COLUMNS_v2 (
+            name TEXT,
+            table_name TEXT,
+            type TEXT,
+            pk INTEGER,
+            not_null INTEGER,
+            unique_col INTEGER,
+            dflt_val TEXT,
+            database TEXT,
+            PRIMARY KEY (database, table_name, name),
+            FOREIGN KEY (database, table_name) REFERENCES TABLES(database, name)
+        );
+    """)
+    metadata_cursor.execute("""
+        CREATE TABLE FOREIGN_KEY_v2 (
+            col TEXT,
+            refrenced_table TEXT,
+            refrenced_col TEXT,
+            database TEXT,
+            table_name TEXT,
+            PRIMARY KEY (database, table_name, col, refrenced_table, refrenced_col),
+            FOREIGN KEY (database, table_name, col) REFERENCES COLUMNS(database, table_name, name),
+            FOREIGN KEY (database, refrenced_table) REFERENCES TABLES(database, name)
+        );
+    """)
+
+    metadata_cursor.execute("INSERT OR IGNORE INTO TABLES_v2 SELECT name, database FROM TABLES;")
+    metadata_cursor.execute("""
+        INSERT OR IGNORE INTO COLUMNS_v2
+        SELECT c.name, c.table_name, c.type, c.pk, c.not_null, c.unique_col, c.dflt_val, t.database
+        FROM COLUMNS AS c JOIN TABLES AS t ON t.name = c.table_name;
+    """)
+    # The old FOREIGN_KEY rows do not say which table they belong to: keep the ones whose column
+    # name identifies a single table. The fingerprints are cleared below, so the next refresh
+    # re-harvests every database and restores the rest.
+    metadata_cursor.execute("""
+        INSERT OR IGNORE INTO FOREIGN_KEY_v2
+        SELECT f.col, f.refrenced_table, f.refrenced_col, t.database, c.table_name
+        FROM FOREIGN_KEY AS f
+        JOIN COLUMNS AS c ON c.name = f.col
+        JOIN TABLES AS t ON t.name = c.table_name
+        WHERE (SELECT count(*) FROM COLUMNS WHERE name = f.col) = 1;
+    """)
+    metadata_cursor.execute("DELETE FROM TABLE_FINGERPRINT;")
+    metadata_cursor.execute("DELETE FROM DATABASE_FINGERPRINT;")
+
+    for table in ("TABLES", "COLUMNS", "FOREIGN_KEY"):
+        metadata_cursor.execute(f"DROP TABLE {table};")
+        metadata_cursor.execute(f"ALTER TABLE {table}_v2 RENAME TO {table};")
+
+    metadata_cursor.execute("CREATE INDEX TABLES_name ON TABLES(name);")
+    metadata_cursor.execute("CREATE INDEX COLUMNS_table_name ON COLUMNS(table_name);")
+    metadata_cursor.execute("CREATE INDEX COLUMNS_type ON COLUMNS(type);")
+    metadata_cursor.execute("CREATE INDEX FOREIGN_KEY_referenced ON FOREIGN_KEY(refrenced_table, refrenced_col);")
+
+
+def migrate_metadata_schema_v3(metadata_cursor):
+    # Data-derived statistics written by the profiler (save_statistics); min_val and max_val have
+    # no declared type so they keep the type of the source values
+    metadata_cursor.execute("""
+        CREATE TABLE TABLE_STATS (
+            database TEXT,
+            table_name TEXT,
+            row_count INTEGER,
+            sampled_rows INTEGER,
+            profiled_at REAL,
+            PRIMARY KEY (database, table_name),
+            FOREIGN KEY (database, table_name) REFERENCES TABLES(database, name)
+        );
+    """)
+    metadata_cursor.execute("""
+        CREATE TABLE COLUMN_STATS (
+            database TEXT,
+            table_name TEXT,
+            column_name TEXT,
+            null_frac REAL,
+            distinct_count INTEGER,
+            min_val,
+            max_val,
+            top_values TEXT,
+            PRIMARY KEY (database, table_name, column_name),
+            FOREIGN KEY (database, table_name, column_name) REFERENCES COLUMNS(database, table_name, name)
+        );
+    """)
+
+
+def search_support(metadata_cursor):
+    # Which search indexes this SQLite build can create: "fts5" for CATALOG_SEARCH and "trigram"
+    # for CATALOG_TRIGRAM (FTS5's trigram tokenizer needs SQLite 3.34 or later)
+    supported = set()
+    for kind, options in (("fts5", ""), ("trigram", ", tokenize='trigram'")):
+        try:
+            metadata_cursor.execute(f"CREATE VIRTUAL TABLE temp.search_probe USING fts5(name{options});")
+        except sqlite3.OperationalError:
+            break
+        metadata_cursor.execute("DROP TABLE temp.search_probe;")
+        supported.add(kind)
+    return supported
+
+
+def search_indexes(metadata_cursor):
+    # The search indexes metadata.db has, out of CATALOG_SEARCH and CATALOG_TRIGRAM
+    metadata_cursor.execute("""
+        SELECT name FROM sqlite_master WHERE type='table' AND name IN ('CATALOG_SEARCH', 'CATALOG_TRIGRAM');
+    """)
+    return {name for (name,) in metadata_cursor.fetchall()}
+
+
+def index_catalog(metadata_cursor, db_name, tables_json):
+    # Refresh the search entries of a database and some of its tables (a JSON list) from DATABASES,
+    # TABLES and COLUMNS, and the FTS5 indexes over them, with a few set-based statements: the old
+    # entries of those tables are dropped from the index and replaced, and only the names that
+    # appear or disappear touch CATALOG_TRIGRAM
+    indexes = search_indexes(metadata_cursor)
+    scope = "database=? AND table_name IN (SELECT value FROM json_each(?) UNION ALL SELECT '')"
+    metadata_cursor.execute(f"SELECT json_group_array(DISTINCT name) FROM CATALOG_ENTRIES WHERE {scope};",
+                            (db_name, tables_json))
+    old_names = metadata_cursor.fetchall()[0][0]
+    if "CATALOG_SEARCH" in indexes:
+        metadata_cursor.execute(f"""
+            INSERT INTO CATALOG_SEARCH(CATALOG_SEARCH, rowid, name, table_name, database, type)
+            SELECT 'delete', id, name, table_name, database, type FROM CATALOG_ENTRIES WHERE {scope};
+        """, (db_name, tables_json))
+    metadata_cursor.execute(f"DELETE FROM CATALOG_ENTRIES WHERE {scope};", (db_name, tables_json))
+
+    # Rowids of new rows are above the current maximum
+    metadata_cursor.execute("SELECT (SELECT coalesce(max(id), 0) FROM CATALOG_ENTRIES), "
+                            "(SELECT coalesce(max(id), 0) FROM CATALOG_NAMES);")
+    last_entry, last_name = metadata_cursor.fetchall()[0]
+    metadata_cursor.execute("""
+        INSERT INTO CATALOG_ENTRIES(kind, database, table_name, name, type)
+        SELECT 'database', name, '', name, NULL FROM DATABASES WHERE name=?
+        UNION ALL SELECT 'table', database, name, name, NULL FROM TABLES
+        WHERE database=? AND name IN (SELECT value FROM json_each(?))
+        UNION ALL SELECT 'column', database, table_name, name, type FROM COLUMNS
+        WHERE database=? AND table_name IN (SELECT value FROM json_each(?));
+    """, (db_name, db_name, tables_json, db_name, tables_json))
+    if "CATALOG_SEARCH" in indexes:
+        metadata_cursor.execute("""
+            INSERT INTO CATALOG_SEARCH(rowid, name, table_name, database, type)
+            SELECT id, name, table_name, database, type FROM CATALOG_ENTRIES WHERE id > ?;
+        """, (last_entry,))
+
+    # Distinct names
+    metadata_cursor.execute("INSERT OR IGNORE INTO CATALOG_NAMES(name) SELECT name FROM CATALOG_ENTRIES WHERE id > ?;",
+                            (last_entry,))
+    unused = """
+        FROM CATALOG_NAMES WHERE name IN (SELECT value FROM json_each(?))
+        AND name NOT IN (SELECT name FROM CATALOG_ENTRIES)
+    """
+    if "CATALOG_TRIGRAM" in indexes:
+        metadata_cursor.execute("""
+            INSERT INTO CATALOG_TRIGRAM(rowid, name) SELECT id, name FROM CATALOG_NAMES WHERE id > ?;
+        """, (last_name,))
+        metadata_cursor.execute(f"""
+            INSERT INTO CATALOG_TRIGRAM(CATALOG_TRIGRAM, rowid, name) SELECT 'delete', id, name {unused};
+        """, (old_names,))
+    metadata_cursor.execute(f"DELETE {unused};", (old_names,))
+
+
+def migrate_metadata_schema_v4(metadata_cursor):
+    # Search index over database, table and column names (see search.py). CATALOG_ENTRIES holds
+    # one row per name and is the external content of CATALOG_SEARCH (FTS5 over words, for ranked
+    # prefix queries). The same names recur across tables and databases (id, name, ...), so
+    # substring and fuzzy queries go through CATALOG_TRIGRAM, a trigram index over the distinct
+    # names in CATALOG_NAMES. The FTS5 tables are only created when this SQLite build supports them;
+    # search.py falls back to LIKE and instr() scans of the plain tables otherwise.
+    # There are no triggers: write_catalog refreshes the entries of the tables it wrote in bulk
+    # (index_catalog), which costs a few statements per catalog instead of several per row.
+    metadata_cursor.execute("""
+        CREATE TABLE CATALOG_ENTRIES (
+            id INTEGER PRIMARY KEY,
+            kind TEXT,
+            database TEXT,
+            table_name TEXT,
+            name TEXT,
+            type TEXT,
+            UNIQUE (database, table_name, name, kind)
+        );
+    """)
+    metadata_cursor.execute("CREATE INDEX CATALOG_ENTRIES_name ON CATALOG_ENTRIES (name);")
+    metadata_cursor.execute("""
+        CREATE TABLE CATALOG_NAMES (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE
+        );
+    """)
+    supported = search_support(metadata_cursor)
+    if "fts5" in supported:
+        metadata_cursor.execute("""
+            CREATE VIRTUAL TABLE CATALOG_SEARCH USING fts5(
+                name, table_name, database, type,
+                content='CATALOG_ENTRIES', content_rowid='id'
+            );
+        """)
+    if "trigram" in supported:
+        metadata_cursor.execute("""
+            CREATE VIRTUAL TABLE CATALOG_TRIGRAM USING fts5(
+                name,
+                content='CATALOG_NAMES', content_rowid='id', tokenize='trigram', detail='none'
+            );
+        """)
+
+    # Index what is already registered
+    metadata_cursor.execute("""
+        INSERT OR IGNORE INTO CATALOG_ENTRIES(kind, database, table_name, name, type)
+        SELECT 'database', name, '', name, NULL FROM DATABASES
+        UNION ALL SELECT 'table', database, name, name, NULL FROM TABLES
+        UNION ALL SELECT 'column', database, table_name, name, type FROM COLUMNS;
+    """)
+    metadata_cursor.execute("INSERT OR IGNORE INTO CATALOG_NAMES(name) SELECT name FROM CATALOG_ENTRIES;")
+    for index in search_indexes(metadata_cursor):
+        metadata_cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild');")
+
+
+def migrate_metadata_schema_v5(metadata_cursor):
+    # Checkpoints of partitioned jobs (jobs.Job): the definition and final result of each job, and
+    # its partitions, planned once from TABLES, each with its partial result once it has run, so an
+    # interrupted job resumes with the partitions that are not done yet
+    metadata_cursor.execute("""
+        CREATE TABLE JOBS (
+            name TEXT PRIMARY KEY,
+            spec TEXT,
+            status TEXT,
+            created_at REAL,
+            finished_at REAL,
+            result TEXT
+        );
+    """)
+    metadata_cursor.execute("""
+        CREATE TABLE JOB_PARTITIONS (
+            job TEXT,
+            part INTEGER,
+            database TEXT,
+            table_name TEXT,
+            start_rowid INTEGER,
+            end_rowid INTEGER,
+            status TEXT,
+            result TEXT,
+            seconds REAL,
+            PRIMARY KEY (job, part),
+            FOREIGN KEY (job) REFERENCES JOBS(name)
+        );
+    """)
+
+
+def migrate_metadata_schema_v6(metadata_cursor):
+    # Change-data capture log written by watch.CatalogWatcher: one row per created, altered or
+    # dropped table (kind 'schema'), per database whose data changed between two polls ('data'),
+    # and per registered database whose file went missing ('missing'); id orders the events
+    metadata_cursor.execute("""
+        CREATE TABLE CHANGE_LOG (
+            id INTEGER PRIMARY KEY,
+            at REAL,
+            database TEXT,
+            kind TEXT,
+            action TEXT,
+            table_name TEXT,
+            schema_version INTEGER
+        );
+    """)
+    metadata_cursor.execute("CREATE INDEX CHANGE_LOG_database ON CHANGE_LOG(database, id);")
+
+
+METADATA_MIGRATIONS = {
+    1: create_metadata_schema_v1,
+    2: migrate_metadata_schema_v2,
+    3: migrate_metadata_schema_v3,
+    4: migrate_metadata_schema_v4,
+    5: migrate_metadata_schema_v5,
+    6: migrate_metadata_schema_v6,
+}
+
+
+def ensure_metadata_schema(metadata_connection):
+    # Bring metadata.db up to METADATA_SCHEMA_VERSION; returns the version the file had before.
+    # Each step takes the write lock first (BEGIN IMMEDIATE) and re-reads user_version under it, so
+    # when several connections open an old file at once one of them migrates and the others find
+    # the step done instead of running it again on the migrated tables.
+    version = metadata_connection.execute("PRAGMA user_version;").fetchall()[0][0]
+    current = version
+    while current < METADATA_SCHEMA_VERSION:
+        metadata_cursor = metadata_connection.cursor()
+        metadata_cursor.execute("BEGIN IMMEDIATE;")
+        try:
+            current = metadata_cursor.execute("PRAGMA user_version;").fetchall()[0][0]
+            if current < METADATA_SCHEMA_VERSION:
+                current += 1
+                METADATA_MIGRATIONS[current](metadata_cursor)
+                metadata_cursor.execute(f"PRAGMA user_version={current};")
+            metadata_connection.commit()
+        except sqlite3.Error:
+            metadata_connection.rollback()
+            raise
+    return version
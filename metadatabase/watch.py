@@ -0,0 +1,201 @@
+import os
+import pathlib
+import sqlite3
+import time
+from collections import OrderedDict
+
+from .instrument import instrumented, transaction
+from .manager import DatabaseManager
+from .snapshot import write_snapshot
+from .store import connect_metadata, stored_fingerprints, write_catalog
+
+MISSING = "missing"  # stat key of a registered database whose file is gone
+
+
+def read_changes(metadata_cursor, since=0, database=None, limit=1000):
+    # CHANGE_LOG events with an id above `since`, oldest first; a reader keeps the last id it saw
+    # and asks for what came after it. limit=-1 returns them all.
+    where, params = ("AND database=?", (since, database, limit)) if database is not None else ("", (since, limit))
+    metadata_cursor.execute(f"""
+        SELECT id, at, database, kind, action, table_name, schema_version FROM CHANGE_LOG
+        WHERE id > ? {where} ORDER BY id LIMIT ?;
+    """, params)
+    return [{"id": event_id, "at": at, "database": db_name, "kind": kind, "action": action, "table": table_name,
+             "schema_version": schema_version}
+            for event_id, at, db_name, kind, action, table_name, schema_version in metadata_cursor.fetchall()]
+
+
+class CatalogWatcher:
+    # Change-data capture for the registered databases. Each poll stats every registered file and
+    # its -wal file, and only looks inside the files whose size or mtime moved. There, PRAGMA
+    # schema_version tells DDL from data changes, and PRAGMA data_version, read through a
+    # read-only connection kept open for the max_open most recently changed databases, tells a
+    # commit from an automatic WAL checkpoint or a touch. data_version moves when another
+    # connection commits (or resets the WAL with a RESTART or TRUNCATE checkpoint) and means
+    # nothing on a connection opened just now, so a changed file without a kept connection counts
+    # as a data change. An idle database costs two stat calls per poll, so one process can watch
+    # thousands.
+    #
+    # A schema change re-harvests only the tables whose fingerprint changed (changed_catalog) and
+    # logs one 'schema' event per created, altered or dropped table in CHANGE_LOG, in the same
+    # transaction as the catalog diff, so the log never disagrees with the catalog. Data changes
+    # log one 'data' event per database and poll (unless data_events is False), and a registered
+    # file that disappears logs a 'missing' event. Databases changed while no watcher ran are
+    # caught on the first poll, from the schema versions stored in DATABASE_FINGERPRINT.
+    #
+    # The watcher keeps its own metadata connection: its data_version moves when another process
+    # writes metadata.db (e.g. registers a database), which is when the list of databases is read
+    # again.
+    def __init__(self, metadata_db=None, interval=1.0, max_open=256, data_events=True, snapshot=None):
+        self.metadata_connection = connect_metadata(metadata_db)
+        self.interval = interval
+        self.max_open = max(max_open, 1)
+        self.data_events = data_events
+        self.snapshot = snapshot
+        self.files = {}  # database -> [stat key, schema_version, data_version]
+        self.connections = OrderedDict()  # database -> read-only connection, least recently changed first
+        self.metadata_version = None
+
+    def refresh(self):
+        # Follow the registered databases when metadata.db was written by another connection
+        data_version = self.metadata_connection.execute("PRAGMA data_version;").fetchall()[0][0]
+        if data_version == self.metadata_version:
+            return
+        self.metadata_version = data_version
+        stored = dict(self.metadata_connection.execute("""
+            SELECT DATABASES.name, DATABASE_FINGERPRINT.schema_version FROM DATABASES
+            LEFT JOIN DATABASE_FINGERPRINT ON DATABASE_FINGERPRINT.database = DATABASES.name;
+        """).fetchall())
+        for db_name in [db_name for db_name in self.files if db_name not in stored]:
+            del self.files[db_name]
+            self._close(db_name)
+        for db_name, schema_version in stored.items():
+            if db_name not in self.files:
+                self.files[db_name] = [None, schema_version, None]
+
+    @instrumented("watch_poll")
+    def poll(self):
+        # One pass over the registered databases; returns the events it logged
+        self.refresh()
+        now = time.time()
+        events = []  # (at, database, kind, action, table, schema_version)
+        changed = []  # databases whose schema_version moved
+        for db_name, state in self.files.items():
+            key = self._stat(db_name)
+            if key == state[0]:
+                continue
+            if key == MISSING:
+                self._close(db_name)
+                events.append((now, db_name, "missing", None, None, state[1]))
+                state[0] = MISSING
+                continue
+            seen = state[0] not in (None, MISSING)
+            state[0] = key
+            try:
+                connection, kept = self._connection(db_name)
+                data_version = connection.execute("PRAGMA data_version;").fetchall()[0][0]
+                schema_version = connection.execute("PRAGMA schema_version;").fetchall()[0][0]
+            except sqlite3.Error:
+                # Locked, or not a database (yet): looked at again on the next poll
+                self._close(db_name)
+                state[0] = None
+                continue
+            if schema_version != state[1]:
+                changed.append(db_name)
+            elif self.data_events and seen and (not kept or data_version != state[2]):
+                events.append((now, db_name, "data", None, None, schema_version))
+            state[2] = data_version
+
+        catalogs = []
+        metadata_cursor = self.metadata_connection.cursor()
+        for db_name in changed:
+            catalog = self._harvest(metadata_cursor, db_name, now, events)
+            if catalog is not None:
+                catalogs.append(catalog)
+        if not events and not catalogs:
+            return []
+
+        # The catalog diffs and their events are written together, by this connection only
+        last_id = metadata_cursor.execute("SELECT coalesce(max(id), 0) FROM CHANGE_LOG;").fetchall()[0][0]
+        with transaction(self.metadata_connection, "watch.commit"):
+            for catalog in catalogs:
+                write_catalog(metadata_cursor, catalog)
+            metadata_cursor.executemany("""
+                INSERT INTO CHANGE_LOG(at, database, kind, action, table_name, schema_version)
+                VALUES (?, ?, ?, ?, ?, ?);
+            """, events)
+        for catalog in catalogs:
+            self.files[catalog["database"]][1] = catalog["schema_version"]
+        if self.snapshot is not None and catalogs:
+            write_snapshot(self.metadata_connection, self.snapshot)
+        return read_changes(metadata_cursor, last_id, limit=-1)
+
+    def _harvest(self, metadata_cursor, db_name, now, events):
+        # The catalog of the tables of db_name that changed, with an event for each
+        stored = stored_fingerprints(metadata_cursor, db_name)
+        try:
+            db_manager = DatabaseManager(db_name, read_only=True)
+            try:
+                catalog = db_manager.changed_catalog(None, stored)
+            finally:
+                db_manager.close_connection()
+        except sqlite3.Error:
+            self.files[db_name][0] = None
+            return None
+        version = catalog["schema_version"]
+        for table_name, _ in catalog["tables"]:
+            events.append((now, db_name, "schema", "altered" if table_name in stored else "created", table_name,
+                           version))
+        for table_name in stored:
+            if table_name not in catalog["fingerprints"]:
+                events.append((now, db_name, "schema", "dropped", table_name, version))
+        return catalog
+
+    def watch(self, iterations=None, callback=None):
+        # Poll every interval seconds, forever or `iterations` times; callback(events) is called
+        # after each poll that logged events
+        polls = 0
+        while iterations is None or polls < iterations:
+            start = time.monotonic()
+            events = self.poll()
+            if events and callback is not None:
+                callback(events)
+            polls += 1
+            if iterations is None or polls < iterations:
+                time.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections.clear()
+        self.metadata_connection.close()
+
+    def _stat(self, db_name):
+        # mtime and size of the file and of its -wal file (WAL commits only touch the latter until a
+        # checkpoint), or MISSING when the file is gone
+        try:
+            stat = os.stat(db_name)
+        except OSError:
+            return MISSING
+        try:
+            wal = os.stat(db_name + "-wal")
+            wal_key = (wal.st_mtime_ns, wal.st_size)
+        except OSError:
+            wal_key = None
+        return stat.st_mtime_ns, stat.st_size, wal_key
+
+    def _connection(self, db_name):
+        # The kept connection of db_name (and True), or a new one (and False), as most recently used
+        connection = self.connections.pop(db_name, None)
+        kept = connection is not None
+        if connection is None:
+            while len(self.connections) >= self.max_open:
+                self.connections.popitem(last=False)[1].close()
+            connection = sqlite3.connect(f"{pathlib.Path(db_name).absolute().as_uri()}?mode=ro", uri=True)
+        self.connections[db_name] = connection
+        return connection, kept
+
+    def _close(self, db_name):
+        connection = self.connections.pop(db_name, None)
+        if connection is not None:
+            connection.close()
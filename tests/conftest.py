@@ -0,0 +1,28 @@
+import sqlite3
+
+import pytest
+
+from metadatabase import DatabaseManager, store
+
+
+@pytest.fixture
+def metadata_db(tmp_path, monkeypatch):
+    # A fresh metadata.db for each test, used by everything that opens the default one
+    path = str(tmp_path / "metadata.db")
+    monkeypatch.setattr(store, "metadata_db_name", path)
+    return path
+
+
+@pytest.fixture
+def make_database(tmp_path, metadata_db):
+    # make_database(name, script) creates tmp_path/name from an SQL script and registers it
+    def make(name, script):
+        path = str(tmp_path / name)
+        connection = sqlite3.connect(path)
+        connection.executescript(script)
+        connection.close()
+        db_manager = DatabaseManager(path)
+        db_manager.save_metadata()
+        db_manager.close_connection()
+        return path
+    return make
@@ -0,0 +1,45 @@
+import sqlite3
+
+from metadatabase.columnar import export_table, read_columnar
+
+ROWS = [
+    (1, 1.5, "red", 1),
+    (None, None, None, "1"),
+    (3, 2.0, "red", "x"),
+    (4, None, "blue", None),
+    (5, -0.5, None, b"\x00\xff"),
+]
+
+
+def test_round_trip(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "source.db"))
+    connection.execute("CREATE TABLE t (n INTEGER, x REAL, colour TEXT, tag);")
+    connection.executemany("INSERT INTO t VALUES (?, ?, ?, ?);", ROWS)
+    types = {"n": "INTEGER", "x": "REAL", "colour": "TEXT", "tag": ""}
+    # A chunk size below the row count fills the buffers over several chunks
+    table = export_table(connection, "t", types, chunk_size=2)
+    table.write(str(tmp_path / "t.cols"))
+
+    with read_columnar(str(tmp_path / "t.cols")) as read:
+        assert read.rows == len(ROWS)
+        assert [column.kind for column in read.columns] == ["int", "float", "string", "string"]
+        assert read["n"].values() == [1, None, 3, 4, 5]
+        assert read["n"].null_count() == 1
+        assert read["x"].values() == [1.5, None, 2.0, None, -0.5]
+        assert read["colour"].values() == ["red", None, "red", "blue", None]
+        assert read["colour"].dictionary == ["red", "blue"]
+        # Without a declared type the column keeps 1 and '1' apart, the dictionary holds one "1"
+        assert read["tag"].dictionary == ["1", "x", "00ff"]
+        assert read["tag"].values() == ["1", "1", "x", None, "00ff"]
+    connection.close()
+
+
+def test_integers_beyond_int64_widen_to_float(tmp_path):
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (n INTEGER);")
+    # INTEGER affinity keeps 1e20 as a REAL: it does not fit an int64
+    connection.executemany("INSERT INTO t VALUES (?);", [(1,), (None,), (1e20,), (7,)])
+    table = export_table(connection, "t", {"n": "INTEGER"}, chunk_size=2)
+    assert table["n"].kind == "float"
+    assert table["n"].values() == [1.0, None, 1e20, 7.0]
+    connection.close()
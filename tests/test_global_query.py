@@ -0,0 +1,75 @@
+import pytest
+
+from metadatabase import ConnectionPool, GlobalQuery
+
+QUERIES = [
+    "SELECT parent.id FROM parent LEFT JOIN child ON child.pid = parent.id WHERE child.flag IS NULL "
+    "ORDER BY parent.id",
+    "SELECT parent.id FROM parent LEFT JOIN child ON child.pid = parent.id WHERE coalesce(child.flag, 0) = 0 "
+    "ORDER BY parent.id",
+    "SELECT p.id, c.flag FROM parent AS p LEFT OUTER JOIN child AS c ON c.pid = p.id WHERE p.id > 1 "
+    "ORDER BY p.id",
+    "SELECT parent.id, child.flag FROM parent JOIN child ON child.pid = parent.id WHERE child.flag = 1 "
+    "AND parent.name LIKE 'b%' ORDER BY parent.id",
+    "SELECT count(*) FROM parent, child WHERE child.pid = parent.id AND flag BETWEEN 0 AND 1",
+]
+
+
+@pytest.fixture
+def sources(make_database):
+    make_database("parents.db", """
+        CREATE TABLE parent (id INTEGER PRIMARY KEY, name TEXT);
+        INSERT INTO parent VALUES (1, 'a'), (2, 'b'), (3, 'c'), (4, 'bb');
+    """)
+    make_database("children.db", """
+        CREATE TABLE child (id INTEGER PRIMARY KEY, pid INTEGER, flag INTEGER);
+        INSERT INTO child VALUES (1, 2, 1), (2, 4, 0), (3, 4, 1), (4, 3, 0);
+    """)
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_fallback_matches_attach(sources, metadata_db, sql):
+    # attach_limit=1 cannot attach both sources, so the tables are copied with pushdown
+    attached = GlobalQuery(metadata_db)
+    copied = GlobalQuery(metadata_db, attach_limit=1)
+    try:
+        assert copied.execute(sql).fetchall() == attached.execute(sql).fetchall()
+    finally:
+        attached.close()
+        copied.close()
+
+
+def test_no_pushdown_past_outer_join(sources, metadata_db):
+    global_query = GlobalQuery(metadata_db)
+    try:
+        sql = QUERIES[0]
+        tables = global_query.resolve(sql)
+        assert all(not where for _, where in global_query.pushdown(sql, tables).values())
+        assert global_query.execute(sql).fetchall() == [(1,)]
+    finally:
+        global_query.close()
+
+
+def test_inner_join_conditions_are_pushed(sources, metadata_db):
+    global_query = GlobalQuery(metadata_db)
+    try:
+        sql = QUERIES[3]
+        pushdown = global_query.pushdown(sql, global_query.resolve(sql))
+        assert pushdown["child"][1] == ["flag = 1"]
+        assert pushdown["parent"][1] == ["name LIKE 'b%'"]
+    finally:
+        global_query.close()
+
+
+def test_fallback_reads_sources_through_the_pool(sources, metadata_db):
+    pool = ConnectionPool(max_size=2)
+    global_query = GlobalQuery(metadata_db, attach_limit=1, pool=pool)
+    try:
+        for _ in range(3):
+            assert global_query.execute(QUERIES[4]).fetchall() == [(4,)]
+        # One metadata connection and one per source, reused by every later query
+        assert pool.stats()["created"] == 3
+        assert pool.stats()["idle"] == 3
+    finally:
+        global_query.close()
+        pool.close()
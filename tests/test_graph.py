@@ -0,0 +1,61 @@
+import sys
+
+import pytest
+
+from metadatabase import ForeignKeyGraph
+
+COMPANY = """
+    CREATE TABLE EMPLOYEE (Ssn TEXT PRIMARY KEY, Super_ssn TEXT REFERENCES EMPLOYEE(Ssn),
+                           Dno INTEGER REFERENCES DEPARTMENT(Dnumber));
+    CREATE TABLE DEPARTMENT (Dnumber INTEGER PRIMARY KEY, Mgr_ssn TEXT REFERENCES EMPLOYEE(Ssn));
+    CREATE TABLE PROJECT (Pnumber INTEGER PRIMARY KEY, Dnum INTEGER REFERENCES DEPARTMENT(Dnumber));
+    CREATE TABLE WORKS_ON (Essn TEXT REFERENCES EMPLOYEE(Ssn), Pno INTEGER REFERENCES PROJECT(Pnumber));
+    CREATE TABLE AUDIT_LOG (id INTEGER PRIMARY KEY, message TEXT);
+"""
+
+
+@pytest.fixture
+def company(make_database, metadata_db):
+    path = make_database("company.db", COMPANY)
+    return path, ForeignKeyGraph(metadata_db)
+
+
+def test_load_order_puts_referenced_tables_first(company):
+    path, graph = company
+    order = [[table for _, table in group] for group in graph.load_order()]
+    assert sorted(map(tuple, order)) == sorted([("AUDIT_LOG",), ("DEPARTMENT", "EMPLOYEE"), ("PROJECT",),
+                                                ("WORKS_ON",)])
+    position = {table: i for i, group in enumerate(order) for table in group}
+    assert position["DEPARTMENT"] < position["PROJECT"] < position["WORKS_ON"]
+
+
+def test_cycles(company):
+    path, graph = company
+    # EMPLOYEE and DEPARTMENT reference each other (EMPLOYEE also references itself)
+    assert graph.cycles() == [[(path, "DEPARTMENT"), (path, "EMPLOYEE")]]
+    assert graph.transitive_dependents("PROJECT") == [(path, "WORKS_ON")]
+
+
+def test_join_path(company):
+    path, graph = company
+    assert graph.join_path("WORKS_ON", "DEPARTMENT") in (
+        [("WORKS_ON", "Essn", "EMPLOYEE", "Ssn"), ("EMPLOYEE", "Dno", "DEPARTMENT", "Dnumber")],
+        [("WORKS_ON", "Pno", "PROJECT", "Pnumber"), ("PROJECT", "Dnum", "DEPARTMENT", "Dnumber")])
+    # Edges are followed either way
+    assert graph.join_path("DEPARTMENT", "PROJECT") == [("DEPARTMENT", "Dnumber", "PROJECT", "Dnum")]
+    assert graph.join_path("AUDIT_LOG", "EMPLOYEE") is None
+    with pytest.raises(ValueError, match="not registered"):
+        graph.join_path("AUDIT_LOG", "NOWHERE")
+
+
+def test_deep_chain_does_not_recurse(make_database, metadata_db):
+    # t0 <- t1 <- ... : a chain far deeper than the recursion limit
+    depth = sys.getrecursionlimit() + 500
+    make_database("chain.db", "CREATE TABLE t0 (id INTEGER PRIMARY KEY);\n" + "\n".join(
+        f"CREATE TABLE t{i} (id INTEGER PRIMARY KEY, parent INTEGER REFERENCES t{i - 1}(id));"
+        for i in range(1, depth)))
+    graph = ForeignKeyGraph(metadata_db)
+    order = [group[0][1] for group in graph.load_order()]
+    assert order == [f"t{i}" for i in range(depth)]
+    assert graph.cycles() == []
+    assert len(graph.join_path("t0", f"t{depth - 1}")) == depth - 1
@@ -0,0 +1,10 @@
+import subprocess
+import sys
+
+
+def test_import_loads_modules_on_first_use():
+    code = ("import sys, metadatabase; "
+            "print(sorted(m for m in sys.modules if m.startswith('metadatabase.') or m == 'asyncio')); "
+            "from metadatabase import DatabaseManager, serve; print('asyncio' in sys.modules)")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.splitlines() == ["[]", "True"]
@@ -0,0 +1,58 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from metadatabase import ConnectionPool, instruments
+from metadatabase.instrument import operation
+
+
+@pytest.fixture
+def tracing():
+    instruments.reset()
+    instruments.enable()
+    yield instruments
+    instruments.disable()
+    instruments.reset()
+
+
+def statement_operations(sql):
+    return {statement["operation"] for statement in instruments.metrics()["statements"] if statement["sql"] == sql}
+
+
+def test_executor_statements_are_credited_to_the_submitting_operation(tracing, tmp_path):
+    path = str(tmp_path / "work.db")
+
+    def work():
+        connection = instruments.attach(sqlite3.connect(path))
+        connection.execute("SELECT 42;").fetchall()
+        connection.close()
+        instruments.add_rows(3)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with operation("outer"):
+            executor.submit(instruments.bind(work)).result()
+
+    assert statement_operations("SELECT ?;") == {"outer"}
+    assert instruments.metrics()["operations"]["outer"]["rows"] == 3
+
+
+def test_pool_run_keeps_the_operation_of_each_task(tracing, tmp_path, metadata_db):
+    path = str(tmp_path / "work.db")
+    sqlite3.connect(path).close()
+    pool = ConnectionPool(max_size=2)
+
+    async def request(name):
+        # Concurrent tasks on one event loop each keep their own operation
+        with operation(name):
+            await asyncio.sleep(0)
+            return await pool.run(path, lambda connection: instruments.attach(connection).execute(
+                f"SELECT '{name}';").fetchall())
+
+    async def main():
+        return await asyncio.gather(request("first"), request("second"))
+
+    assert asyncio.run(main()) == [[("first",)], [("second",)]]
+    pool.close()
+    assert statement_operations("SELECT ?;") == {"first", "second"}
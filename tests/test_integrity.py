@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+import pytest
+
+from metadatabase import DatabaseManager
+
+SCHEMA = """
+    CREATE TABLE OFFICE (country TEXT, city TEXT, PRIMARY KEY (country, city));
+    CREATE TABLE STAFF (id INTEGER PRIMARY KEY, country TEXT, city TEXT,
+                        FOREIGN KEY (country, city) REFERENCES OFFICE (country, city));
+    INSERT INTO OFFICE VALUES ('NL', 'Delft'), ('FR', 'Paris');
+"""
+
+
+@pytest.fixture
+def staff_db(tmp_path, metadata_db):
+    # Not registered: validating reads the foreign keys from the database itself
+    path = str(tmp_path / "staff.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.close()
+    return path
+
+
+def test_composite_key_is_checked_as_a_tuple(staff_db, metadata_db):
+    connection = sqlite3.connect(staff_db)
+    # Both columns exist in OFFICE, but not together; a NULL in the key is not checked
+    connection.executescript("""
+        INSERT INTO STAFF VALUES (1, 'NL', 'Delft'), (2, 'NL', 'Paris'), (3, 'NL', 'Paris'), (4, NULL, 'Nowhere');
+    """)
+    connection.close()
+    db_manager = DatabaseManager(staff_db, read_only=True)
+    report = db_manager.validate_foreign_keys()
+    db_manager.close_connection()
+
+    assert len(report) == 1
+    result = report[0]
+    assert (result["column"], result["referenced_column"], result["method"]) == ("country, city", "country, city",
+                                                                                 "anti-join")
+    assert (result["violations"], result["missing_keys"], result["sample"]) == (2, 1, [[["NL", "Paris"], 2]])
+    assert not os.path.exists(metadata_db)
+
+
+def test_bulk_insert_validates_without_saving_metadata(staff_db, metadata_db):
+    db_manager = DatabaseManager(staff_db)
+    assert db_manager.bulk_insert("STAFF", [{"id": 1, "country": "FR", "city": "Paris"}],
+                                  progress=False, validate=True) == 1
+    with pytest.raises(sqlite3.IntegrityError, match="country, city"):
+        db_manager.bulk_insert("STAFF", [{"id": 2, "country": "FR", "city": "Delft"}], progress=False, validate=True)
+    assert db_manager.cursor.execute("SELECT id FROM STAFF;").fetchall() == [(1,)]
+    db_manager.close_connection()
+    assert not os.path.exists(metadata_db)
+
+
+def test_hash_set_applies_type_affinity(tmp_path, make_database):
+    # The parent lives in another registered database, so the keys are probed in a hash set; the
+    # TEXT '5' of the child equals the INTEGER 5 of the parent, as it does in SQLite
+    make_database("dept.db", """
+        CREATE TABLE DEPT (id INTEGER PRIMARY KEY, code TEXT UNIQUE);
+        INSERT INTO DEPT VALUES (5, '10'), (6, '11');
+    """)
+    path = str(tmp_path / "emp.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE EMP (id INTEGER PRIMARY KEY, dept TEXT REFERENCES DEPT (id), code REFERENCES DEPT (code));
+        INSERT INTO EMP VALUES (1, '5', 10), (2, '5', 11), (3, '7', 12), (4, 6, '11');
+    """)
+    connection.close()
+    db_manager = DatabaseManager(path, read_only=True)
+    report = {result["column"]: result for result in db_manager.validate_foreign_keys()}
+    db_manager.close_connection()
+
+    assert report["dept"]["method"] == "hash set"
+    assert (report["dept"]["violations"], report["dept"]["sample"]) == (1, [["7", 1]])
+    # A column with no type against a TEXT one compares numbers as text
+    assert (report["code"]["violations"], report["code"]["sample"]) == (1, [[12, 1]])
@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+from metadatabase import Job
+from metadatabase.jobs import combiner
+
+
+@pytest.fixture
+def sales(make_database):
+    paths = []
+    for name, rows in (("north.db", [("a", 1), ("b", 5), ("a", 2)]), ("south.db", [("a", 10), ("c", 7)])):
+        values = ", ".join(f"('{region}', {amount})" for region, amount in rows)
+        paths.append(make_database(name, f"""
+            CREATE TABLE sale (region TEXT, amount INTEGER);
+            INSERT INTO sale VALUES {values};
+        """))
+    return paths
+
+
+def partitions(metadata_db, name):
+    connection = sqlite3.connect(metadata_db)
+    try:
+        return connection.execute("SELECT database, status FROM JOB_PARTITIONS WHERE job=? ORDER BY part;",
+                                  (name,)).fetchall()
+    finally:
+        connection.close()
+
+
+def test_combiners():
+    assert combiner("sum")(None, 3) == 3
+    assert combiner("sum")(3, None) == 3
+    assert combiner("min")(4, 2) == 2
+    assert combiner("max")(None, None) is None
+    # top:K keeps the K largest of lists and of JSON arrays
+    assert combiner("top:2")([5, 1], "[3, null, 9]") == [9, 5]
+    with pytest.raises(ValueError, match="Unknown combiner"):
+        combiner("top:0")
+
+
+def test_group_by_merges_partitions(sales, metadata_db):
+    job = Job("by_region", "SELECT region, count(*), sum(amount), max(amount) FROM {table} GROUP BY region",
+              combine=("count", "sum", "max"), group_by=1, workers=2)
+    summary = job.run()
+    assert (summary["partitions"], summary["ran"], summary["failed"]) == (2, 2, {})
+    assert summary["rows"] == [["a", 3, 13, 10], ["b", 1, 5, 5], ["c", 1, 7, 7]]
+
+
+def test_failed_partition_is_recorded_and_rerun(sales, metadata_db):
+    north, south = sales
+    connection = sqlite3.connect(south)
+    connection.execute("UPDATE sale SET amount = x'00ff' WHERE region = 'c';")
+    connection.commit()
+
+    job = Job("largest", "SELECT max(amount) FROM {table}", combine=("max",), workers=2)
+    # The blob cannot be stored as JSON: its partition fails, the other one is checkpointed
+    summary = job.run()
+    assert list(summary["failed"]) == [f"{south}:sale"]
+    assert "TypeError" in summary["failed"][f"{south}:sale"]
+    assert summary["rows"] == [[5]]
+    assert partitions(metadata_db, "largest") == [(north, "done"), (south, "failed")]
+
+    # Running it again runs only the failed partition and resumes the other from its checkpoint
+    connection.execute("UPDATE sale SET amount = 7 WHERE region = 'c';")
+    connection.commit()
+    connection.close()
+    summary = job.run()
+    assert (summary["resumed"], summary["ran"], summary["failed"]) == (1, 1, {})
+    assert summary["rows"] == [[10]]
+    assert partitions(metadata_db, "largest") == [(north, "done"), (south, "done")]
+
+
+def test_checkpoints_belong_to_one_definition(sales, metadata_db):
+    Job("total", "SELECT sum(amount) FROM {table}", workers=1).run()
+    changed = Job("total", "SELECT count(*) FROM {table}", workers=1)
+    with pytest.raises(ValueError, match="another definition"):
+        changed.run()
+    # restart drops the old checkpoints and plans the job again
+    summary = changed.run(restart=True)
+    assert (summary["resumed"], summary["ran"], summary["rows"]) == (0, 2, [[5]])
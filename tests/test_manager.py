@@ -0,0 +1,169 @@
+import os
+import sqlite3
+
+import pytest
+
+from metadatabase import DatabaseManager, manager, register_all
+
+
+def test_metadata_cache_loads_one_table_at_a_time(tmp_path):
+    path = str(tmp_path / "source.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE a (id INTEGER PRIMARY KEY, code TEXT UNIQUE);
+        CREATE TABLE b (id INTEGER PRIMARY KEY, a_id INTEGER REFERENCES a(id));
+    """)
+    connection.close()
+
+    db_manager = DatabaseManager(path)
+    cache = db_manager.metadata
+    assert db_manager.table_exists("b")
+    assert cache.stats()["loads"] == 1
+    assert cache.foreign_keys("b") == [("a_id", "a", "id")]
+    assert cache.unique("a") == [("code",)]
+    assert cache.primary_key("a") == ["id"]
+    assert not db_manager.table_exists("c")
+    assert cache.stats()["loads"] == 3
+
+    # DDL on another connection shows up as a new schema_version
+    cache.check_interval = 0
+    other = sqlite3.connect(path)
+    other.execute("CREATE TABLE c (x)")
+    other.close()
+    assert db_manager.table_exists("c")
+    assert sorted(cache.table_names()) == ["a", "b", "c"]
+    db_manager.close_connection()
+
+
+@pytest.mark.parametrize("schema, order", [
+    ("CREATE TABLE t (a INTEGER PRIMARY KEY, b TEXT, v TEXT)", "a"),
+    ("CREATE TABLE t (a INT, b TEXT, v TEXT, PRIMARY KEY (b, a))", "b, a"),
+    ("CREATE TABLE t (a INT, b TEXT, v TEXT)", "rowid"),  # no primary key
+])
+def test_keyset_pages_cover_every_row_once(tmp_path, schema, order, capsys):
+    path = str(tmp_path / "source.db")
+    connection = sqlite3.connect(path)
+    connection.execute(schema + ";")
+    connection.executemany("INSERT INTO t VALUES (?, ?, ?);", [(i, f"k{i % 7}", f"row {i}") for i in range(45, 0, -1)])
+    connection.commit()
+    expected = connection.execute(f"SELECT a, b, v FROM t ORDER BY {order};").fetchall()
+    connection.close()
+
+    db_manager = DatabaseManager(path, read_only=True)
+    seen, after = [], None
+    while True:
+        query, params = db_manager.table_rows_query("t", page_size=10, after=after)
+        page = db_manager.connection.execute(query, params).fetchall()
+        if not page:
+            break
+        assert len(page) <= 10
+        seen += [row[:3] for row in page]
+        after = page[-1][3:]
+    assert seen == expected
+
+    # show_table_data prints one page and returns the key to continue from
+    last_key = db_manager.show_table_data("t", page_size=10)
+    assert "-- next page: --after" in capsys.readouterr().out
+    assert db_manager.show_table_data("t", page_size=10, after=last_key) is not None
+    db_manager.close_connection()
+
+
+@pytest.fixture
+def tenants(tmp_path, metadata_db, monkeypatch):
+    directory = tmp_path / "tenants"
+    directory.mkdir()
+    for i in range(5):
+        connection = sqlite3.connect(directory / f"tenant_{i}.db")
+        connection.execute(f"CREATE TABLE t{i} (id INTEGER PRIMARY KEY);")
+        connection.close()
+    batches = []
+    write_batch = manager._write_batch
+
+    def recording(metadata_connection, catalogs):
+        batches.append(len(catalogs))
+        return write_batch(metadata_connection, catalogs)
+
+    monkeypatch.setattr(manager, "_write_batch", recording)
+    # A relative directory: the names stored must not depend on the working directory
+    monkeypatch.chdir(tmp_path)
+    return directory, batches
+
+
+def registered(metadata_db):
+    connection = sqlite3.connect(metadata_db)
+    try:
+        return [name for (name,) in connection.execute("SELECT name FROM DATABASES ORDER BY name;")]
+    finally:
+        connection.close()
+
+
+def test_register_all_batches_and_skips_unchanged(tenants, metadata_db):
+    directory, batches = tenants
+    summary = register_all("tenants", workers=2, batch_size=2)
+    assert (summary["databases"], summary["changed"], summary["failed"]) == (5, 5, {})
+    assert sorted(batches) == [1, 2, 2]
+    assert registered(metadata_db) == [str(directory / f"tenant_{i}.db") for i in range(5)]
+
+    # Nothing changed: nothing is written
+    batches.clear()
+    summary = register_all(str(directory), workers=2, batch_size=2)
+    assert (summary["changed"], summary["rows"], batches) == (0, 0, [])
+
+    connection = sqlite3.connect(directory / "tenant_3.db")
+    connection.execute("CREATE TABLE extra (x);")
+    connection.close()
+    summary = register_all("tenants", workers=2, batch_size=2)
+    assert (summary["changed"], batches) == (1, [1])
+    assert len(registered(metadata_db)) == 5
+
+
+def test_register_all_reports_failures_and_goes_on(tenants, metadata_db, monkeypatch):
+    directory, batches = tenants
+    (directory / "broken.db").write_bytes(b"not a database" * 100)
+    harvest = manager._harvest_changed
+
+    def failing(db_name, *args):
+        if db_name.endswith("tenant_0.db"):
+            raise OSError("disk on fire")
+        return harvest(db_name, *args)
+
+    monkeypatch.setattr(manager, "_harvest_changed", failing)
+    summary = register_all("tenants", workers=2)
+    assert sorted(os.path.basename(db_name) for db_name in summary["failed"]) == ["broken.db", "tenant_0.db"]
+    assert summary["failed"][str(directory / "tenant_0.db")] == "disk on fire"
+    assert summary["changed"] == 4
+    assert registered(metadata_db) == [str(directory / f"tenant_{i}.db") for i in range(1, 5)]
+
+
+def test_save_metadata_writes_only_the_diff(make_database, metadata_db, monkeypatch):
+    path = make_database("diff.db", """
+        CREATE TABLE kept (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE altered (id INTEGER PRIMARY KEY);
+        CREATE TABLE dropped (id INTEGER PRIMARY KEY, kept_id INTEGER REFERENCES kept(id));
+    """)
+    metadata = sqlite3.connect(metadata_db)
+    rows = lambda sql: metadata.execute(sql, (path,)).fetchall()
+    kept_rowids = rows("SELECT rowid FROM COLUMNS WHERE database=? AND table_name='kept' ORDER BY rowid;")
+
+    # Unchanged: nothing is written (data_version moves when another connection commits)
+    data_version = metadata.execute("PRAGMA data_version;").fetchall()
+    db_manager = DatabaseManager(path)
+    assert db_manager.save_metadata() == 0
+    assert metadata.execute("PRAGMA data_version;").fetchall() == data_version
+
+    db_manager.connection.executescript("ALTER TABLE altered ADD COLUMN note TEXT; DROP TABLE dropped;")
+    fingerprints = []
+    schema_fingerprints = DatabaseManager.schema_fingerprints
+    monkeypatch.setattr(DatabaseManager, "schema_fingerprints",
+                        lambda self: fingerprints.append(1) or schema_fingerprints(self))
+    assert db_manager.save_metadata() > 0
+    assert fingerprints == [1]  # sqlite_master is hashed once per refresh
+    db_manager.close_connection()
+
+    assert rows("SELECT name FROM COLUMNS WHERE database=? AND table_name='altered' ORDER BY name;") == [
+        ("id",), ("note",)]
+    assert rows("SELECT rowid FROM COLUMNS WHERE database=? AND table_name='kept' ORDER BY rowid;") == kept_rowids
+    assert rows("SELECT name FROM TABLES WHERE database=? ORDER BY name;") == [("altered",), ("kept",)]
+    assert rows("SELECT count(*) FROM COLUMNS WHERE database=? AND table_name='dropped';") == [(0,)]
+    assert rows("SELECT count(*) FROM FOREIGN_KEY WHERE database=?;") == [(0,)]
+    metadata.close()
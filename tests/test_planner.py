@@ -0,0 +1,62 @@
+import types
+
+import pytest
+
+from metadatabase import JoinPlanner
+from metadatabase.demo import seed_company
+
+
+@pytest.fixture
+def company(tmp_path, metadata_db, capsys):
+    seed_company(str(tmp_path / "COMPANY.db"))
+    capsys.readouterr()
+    planner = JoinPlanner(metadata_db)
+    yield planner
+    planner.close()
+
+
+def test_cyclic_foreign_keys_need_explicit_joins(company):
+    # EMPLOYEE.Dno -> DEPARTMENT and DEPARTMENT.Mgr_ssn -> EMPLOYEE
+    with pytest.raises(ValueError, match="cycle"):
+        company.plan(["EMPLOYEE", "DEPARTMENT"])
+    plan = company.plan(["EMPLOYEE", "DEPARTMENT"], joins=[("EMPLOYEE", "Dno", "DEPARTMENT", "Dnumber")])
+    assert len(list(company.execute(plan))) == 8
+
+
+def test_foreign_key_joins_of_a_tree(company):
+    joins = company.foreign_key_joins(["WORKS_ON", "PROJECT", "DEPARTMENT"])
+    assert sorted(joins) == [("PROJECT", "Dnum", "DEPARTMENT", "Dnumber"), ("WORKS_ON", "Pno", "PROJECT", "Pnumber")]
+
+
+def test_execute_streams_the_same_rows_in_sqlite_and_python(tmp_path, make_database, metadata_db):
+    make_database("parents.db", """
+        CREATE TABLE parent (id INTEGER PRIMARY KEY, name TEXT);
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50)
+        INSERT INTO parent SELECT i, 'p' || i FROM n;
+    """)
+    make_database("children.db", """
+        CREATE TABLE child (id INTEGER PRIMARY KEY, pid INTEGER);
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 200)
+        INSERT INTO child SELECT i, i % 60 FROM n;
+    """)
+    joins = [("child", "pid", "parent", "id")]
+    results = []
+    for attach_limit in (None, 1):  # 1 forces the Python hash join
+        planner = JoinPlanner(metadata_db, attach_limit=attach_limit)
+        plan = planner.plan(["parent", "child"], joins)
+        rows = planner.execute(plan, chunk_size=7)
+        assert isinstance(rows, types.GeneratorType)
+        # Columns come in plan order: parent (id, name) and child (id, pid) in either order
+        if plan.tables[0] == "child":
+            rows = (row[2:] + row[:2] for row in rows)
+        results.append(sorted(rows, key=lambda row: row[2]))
+        planner.close()
+    assert results[0] == results[1]
+    assert len(results[0]) == sum(1 for i in range(1, 201) if 1 <= i % 60 <= 50)
+
+
+def test_unique_columns_are_fully_distinct(company):
+    rows = company.row_count("DEPARTMENT")
+    assert company.distinct_count("DEPARTMENT", "Dnumber") == rows
+    assert company.distinct_count("DEPARTMENT", "Dname") == rows
+    assert company.selectivity("DEPARTMENT", "Dname = 'Research'") == 1 / rows
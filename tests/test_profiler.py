@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from metadatabase.profiler import FrequentItems, HyperLogLog, profile_table
+
+
+@pytest.mark.parametrize("n", [50, 1000, 100000])
+def test_hyperloglog_error_bound(n):
+    sketch = HyperLogLog()
+    for i in range(n):
+        sketch.add(i)
+        sketch.add(i)  # repeats do not count
+    # Standard error 1.6% at precision 12: allow three of them
+    assert abs(sketch.count() - n) <= max(2, 0.05 * n)
+
+
+def test_hyperloglog_merge_is_the_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(30000):
+        left.add(i)
+        union.add(i)
+    for i in range(20000, 60000):
+        right.add(i)
+        union.add(i)
+    left.merge(right)
+    assert left.registers == union.registers
+    assert abs(left.count() - 60000) <= 0.05 * 60000
+
+
+def test_frequent_items_top_k():
+    sketch = FrequentItems(capacity=20)
+    # Values over 2 / capacity of the rows are reported whatever the order
+    stream = ["a"] * 600 + ["b"] * 400 + ["c"] * 300 + [f"rare {i}" for i in range(1000)]
+    for i, value in enumerate(stream):
+        sketch.add(stream[(i * 7919) % len(stream)])  # a fixed shuffle
+    top = sketch.top(3)
+    assert [value for value, _ in top] == ["a", "b", "c"]
+    # Counts are lower bounds, off by at most n / capacity
+    for value, count in top:
+        assert stream.count(value) - len(stream) / 20 <= count <= stream.count(value)
+    # Values under 1 / capacity of the rows are never reported
+    assert all(not value.startswith("rare") for value, _ in sketch.top(20))
+
+
+def test_profile_scans_the_table_once():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (k INTEGER, colour TEXT);")
+    connection.executemany("INSERT INTO t VALUES (?, ?);",
+                           [(i, None if i % 4 == 0 else ["red", "blue"][i % 2]) for i in range(1000)])
+    statements = []
+    connection.set_trace_callback(statements.append)
+    profile = profile_table(connection, "t")
+    assert not [sql for sql in statements if "count(" in sql]
+    assert profile["row_count"] == 1000 and profile["sampled_rows"] is None
+    k, colour = profile["columns"]
+    assert (k["min"], k["max"], k["null_frac"]) == (0, 999, 0.0)
+    assert abs(k["distinct_count"] - 1000) <= 50
+    assert colour["null_frac"] == 0.25 and colour["distinct_count"] == 2
+    assert [value for value, _ in colour["top_values"]] == ["blue", "red"]
+
+    # A sample needs the row count first
+    sampled = profile_table(connection, "t", sample_size=100)
+    assert sampled["row_count"] == 1000 and 0 < sampled["sampled_rows"] < 1000
+    connection.close()
@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from metadatabase import CatalogSearch, DatabaseManager, store
+
+
+@pytest.fixture(params=["fts5", "scan"])
+def search_mode(request, monkeypatch):
+    # "scan" is a SQLite build without FTS5: metadata.db gets no CATALOG_SEARCH / CATALOG_TRIGRAM
+    if request.param == "scan":
+        monkeypatch.setattr(store, "search_support", lambda metadata_cursor: set())
+    return request.param
+
+
+def names(results):
+    return sorted((result["kind"], result["table"], result["name"]) for result in results)
+
+
+def test_search_follows_catalog_changes(search_mode, make_database, metadata_db):
+    path = make_database("hr.db", """
+        CREATE TABLE EMPLOYEE (Ssn TEXT PRIMARY KEY, Salary INT, Super_ssn TEXT);
+        CREATE TABLE DEPARTMENT (Dnumber INT PRIMARY KEY, Mgr_ssn TEXT);
+    """)
+    with store.open_metadata(db_name=metadata_db) as metadata_connection:
+        indexes = store.search_indexes(metadata_connection.cursor())
+    assert bool(indexes) == (search_mode == "fts5")
+
+    search = CatalogSearch(metadata_db)
+    assert names(search.search("emp", kind="table", fuzzy=False)) == [("table", "EMPLOYEE", "EMPLOYEE")]
+    assert names(search.search("ssn", kind="column", fuzzy=False)) == [
+        ("column", "DEPARTMENT", "Mgr_ssn"), ("column", "EMPLOYEE", "Ssn"), ("column", "EMPLOYEE", "Super_ssn")]
+    assert names(search.search("*alar*", fuzzy=False)) == [("column", "EMPLOYEE", "Salary")]
+    assert ("column", "EMPLOYEE", "Salary") in names(search.search("salery", kind="column"))
+
+    # Drop a table and add a column: save_metadata refreshes the index with the diff
+    connection = sqlite3.connect(path)
+    connection.executescript("DROP TABLE DEPARTMENT; ALTER TABLE EMPLOYEE ADD COLUMN Dept_ssn TEXT;")
+    connection.close()
+    db_manager = DatabaseManager(path)
+    db_manager.save_metadata()
+    db_manager.close_connection()
+    assert names(search.search("ssn", kind="column", fuzzy=False)) == [
+        ("column", "EMPLOYEE", "Dept_ssn"), ("column", "EMPLOYEE", "Ssn"), ("column", "EMPLOYEE", "Super_ssn")]
+    assert search.search("*Mgr_*", fuzzy=False) == []
+    with store.open_metadata(db_name=metadata_db) as metadata_connection:
+        assert metadata_connection.execute("SELECT name FROM CATALOG_NAMES WHERE name='Mgr_ssn';").fetchall() == []
+        if indexes:
+            metadata_connection.execute("INSERT INTO CATALOG_SEARCH(CATALOG_SEARCH) VALUES ('integrity-check');")
+            metadata_connection.execute("INSERT INTO CATALOG_TRIGRAM(CATALOG_TRIGRAM) VALUES ('integrity-check');")
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import sqlite3
+from urllib.parse import quote
+
+import pytest
+
+from metadatabase import MetadataService
+
+
+async def get(port, path, method="GET"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"Transfer-Encoding: chunked" in head:
+        data = b""
+        while True:
+            size, _, body = body.partition(b"\r\n")
+            if int(size, 16) == 0:
+                break
+            data, body = data + body[:int(size, 16)], body[int(size, 16) + 2:]
+        body = data
+    return status, json.loads(body)
+
+
+@pytest.fixture
+def served(tmp_path, make_database, monkeypatch):
+    make_database("shop.db", """
+        CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT);
+        INSERT INTO item VALUES (1, 'a'), (2, 'b'), (3, 'c');
+        CREATE TABLE label (id INTEGER PRIMARY KEY, text TEXT);
+        INSERT INTO label VALUES (1, CAST(x'ff' AS TEXT));
+    """)
+    # Not registered, inside the directory the service may register from
+    os.makedirs(tmp_path / "inside")
+    connection = sqlite3.connect(tmp_path / "inside" / "new.db")
+    connection.execute("CREATE TABLE secret (x);")
+    connection.close()
+    # Neither registered nor inside it
+    connection = sqlite3.connect(tmp_path / "loose.db")
+    connection.execute("CREATE TABLE secret (x);")
+    connection.close()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def run(served, requests):
+    async def main():
+        service = MetadataService(workers=2, base_dir=str(served / "inside"))
+        _, port = await service.start("127.0.0.1", 0)
+        try:
+            return [await get(port, path, method) for method, path in requests]
+        finally:
+            await service.close()
+    return asyncio.run(main())
+
+
+def test_rows_of_registered_database(served):
+    name = quote(str(served / "shop.db"), safe="")
+    (status, body), = run(served, [("GET", f"/databases/{name}/tables/item/rows?page_size=2")])
+    assert status == 200
+    assert body == {"columns": ["id", "name"], "rows": [[1, "a"], [2, "b"]], "next_after": [2]}
+
+
+def test_only_registered_databases_are_served(served):
+    new = quote(str(served / "inside" / "new.db"), safe="")
+    traversal = quote(str(served / "inside" / ".." / "loose.db"), safe="")
+    results = run(served, [
+        ("GET", f"/databases/{new}/tables/secret/rows"),
+        ("GET", f"/databases/{quote('inside/../loose.db', safe='')}/tables/secret/rows"),
+        ("POST", f"/databases/{traversal}/metadata"),
+        # Registering a file inside base_dir is allowed, after which it is served
+        ("POST", f"/databases/{new}/metadata"),
+        ("GET", f"/databases/{new}/tables/secret/rows"),
+    ])
+    assert [status for status, _ in results] == [404, 404, 404, 200, 200]
+
+
+def raw(served, payload):
+    # Send bytes on a keep-alive connection and read until the service closes it
+    async def main():
+        service = MetadataService(workers=2, base_dir=str(served / "inside"))
+        _, port = await service.start("127.0.0.1", 0)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(payload)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+        finally:
+            await service.close()
+    return asyncio.run(main())
+
+
+def test_malformed_request_line_is_answered_and_closed(served):
+    response = raw(served, b"NONSENSE\r\n\r\nGET /databases HTTP/1.1\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 400 Bad Request")
+    assert response.count(b"HTTP/1.1") == 1
+
+
+def test_failed_stream_closes_the_connection(served):
+    # Text that is not UTF-8 fails in fetchmany once the 200 headers are out: the chunked body is
+    # cut short, with no error response written into it, and the next request is not read
+    name = quote(str(served / "shop.db"), safe="")
+    response = raw(served, f"GET /databases/{name}/tables/label/rows HTTP/1.1\r\n\r\n"
+                           f"GET /databases HTTP/1.1\r\n\r\n".encode())
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert response.count(b"HTTP/1.1") == 1
+    assert not response.endswith(b"0\r\n\r\n")
@@ -0,0 +1,26 @@
+import pytest
+
+from metadatabase import CatalogSnapshot, open_metadata, write_snapshot
+
+
+def test_snapshot_lookups_match_metadata(tmp_path, make_database, metadata_db):
+    make_database("a.db", """
+        CREATE TABLE Dept (id INTEGER PRIMARY KEY, name VARCHAR(20) UNIQUE);
+        CREATE TABLE emp (id INTEGER PRIMARY KEY, dept INT REFERENCES Dept(id), salary DECIMAL(5) DEFAULT 0);
+    """)
+    make_database("b.db", "CREATE TABLE EMP (ssn TEXT);")
+    with open_metadata(db_name=metadata_db) as metadata_connection:
+        path = write_snapshot(metadata_connection, str(tmp_path / "metadata.snapshot"))
+
+    with CatalogSnapshot(path) as snapshot:
+        a = str(tmp_path / "a.db")
+        for _ in range(2):  # the second round is answered from what the first decoded
+            assert snapshot.table_exists("DEPT") and not snapshot.table_exists("dep")
+            assert snapshot.columns("dept") == [
+                ("id", "INTEGER", 1, 0, 0, None), ("name", "VARCHAR(20)", 0, 0, 1, None)]
+            assert snapshot.column("Emp", "SALARY", database=a) == ("salary", "DECIMAL(5)", 0, 0, 0, "0")
+            assert snapshot.foreign_keys("emp", database=a) == [("dept", "Dept", "id")]
+            with pytest.raises(ValueError, match="several databases"):
+                snapshot.columns("emp")
+        snapshot.columns("dept").clear()
+        assert len(snapshot.columns("dept")) == 2
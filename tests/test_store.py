@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from metadatabase import ensure_metadata_schema, store
+
+
+def make_v1(path):
+    # A metadata.db as version 1 left it, with one foreign key whose column name is shared
+    connection = sqlite3.connect(path)
+    store.create_metadata_schema_v1(connection.cursor())
+    connection.executescript("""
+        INSERT INTO DATABASES VALUES ('COMPANY.db');
+        INSERT INTO TABLES VALUES ('EMPLOYEE', 'COMPANY.db'), ('DEPARTMENT', 'COMPANY.db');
+        INSERT INTO COLUMNS VALUES
+            ('Ssn', 'EMPLOYEE', 'CHAR(9)', 1, 1, 1, NULL),
+            ('Dno', 'EMPLOYEE', 'INT', 0, 1, 0, NULL),
+            ('Dnumber', 'DEPARTMENT', 'INT', 1, 1, 1, NULL),
+            ('Mgr_ssn', 'DEPARTMENT', 'CHAR(9)', 0, 1, 0, NULL);
+        INSERT INTO FOREIGN_KEY VALUES ('Dno', 'DEPARTMENT', 'Dnumber'), ('Mgr_ssn', 'EMPLOYEE', 'Ssn');
+        INSERT INTO DATABASE_FINGERPRINT VALUES ('COMPANY.db', 7);
+        PRAGMA user_version=1;
+    """)
+    connection.commit()
+    connection.close()
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    return connection
+
+
+def test_concurrent_migrations_run_each_step_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "metadata.db")
+    make_v1(path)
+
+    # Slow steps, so both connections are past their first read of user_version while one migrates
+    calls = []
+    for version, step in list(store.METADATA_MIGRATIONS.items()):
+        def slow(metadata_cursor, step=step, version=version):
+            calls.append(version)
+            time.sleep(0.05)
+            step(metadata_cursor)
+        monkeypatch.setitem(store.METADATA_MIGRATIONS, version, slow)
+
+    connections = [connect(path) for _ in range(2)]
+    barrier = threading.Barrier(len(connections))
+    errors = []
+
+    def migrate(connection):
+        barrier.wait()
+        try:
+            ensure_metadata_schema(connection)
+        except sqlite3.Error as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=migrate, args=(connection,)) for connection in connections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(calls) == list(range(2, store.METADATA_SCHEMA_VERSION + 1))
+    connection = connections[0]
+    assert connection.execute("PRAGMA user_version;").fetchall()[0][0] == store.METADATA_SCHEMA_VERSION
+    assert connection.execute("SELECT col, table_name FROM FOREIGN_KEY ORDER BY col;").fetchall() == [
+        ("Dno", "EMPLOYEE"), ("Mgr_ssn", "DEPARTMENT")]
+    for connection in connections:
+        connection.close()
+
+
+def test_migration_failure_rolls_back_the_step(tmp_path, monkeypatch):
+    path = str(tmp_path / "metadata.db")
+    make_v1(path)
+
+    def broken(metadata_cursor):
+        metadata_cursor.execute("CREATE TABLE JOBS (name TEXT);")
+        metadata_cursor.execute("SELECT * FROM no_such_table;")
+    monkeypatch.setitem(store.METADATA_MIGRATIONS, 5, broken)
+
+    connection = connect(path)
+    with pytest.raises(sqlite3.OperationalError):
+        ensure_metadata_schema(connection)
+    assert connection.execute("PRAGMA user_version;").fetchall()[0][0] == 4
+    assert connection.execute("SELECT name FROM sqlite_master WHERE name='JOBS';").fetchall() == []
+    connection.close()
+
+
+def test_migrate_v1_to_current(tmp_path):
+    path = str(tmp_path / "metadata.db")
+    make_v1(path)
+    connection = connect(path)
+    assert ensure_metadata_schema(connection) == 1
+    assert ensure_metadata_schema(connection) == store.METADATA_SCHEMA_VERSION
+
+    rows = lambda sql: connection.execute(sql).fetchall()
+    assert rows("PRAGMA user_version;") == [(store.METADATA_SCHEMA_VERSION,)]
+    # v2: database-qualified keys, foreign keys owned by their table, fingerprints cleared
+    assert rows("SELECT database, name FROM TABLES ORDER BY name;") == [
+        ("COMPANY.db", "DEPARTMENT"), ("COMPANY.db", "EMPLOYEE")]
+    assert rows("SELECT database, table_name, name, type FROM COLUMNS WHERE name='Dno';") == [
+        ("COMPANY.db", "EMPLOYEE", "Dno", "INT")]
+    assert rows("SELECT col, refrenced_table, refrenced_col, database, table_name FROM FOREIGN_KEY ORDER BY col;") == [
+        ("Dno", "DEPARTMENT", "Dnumber", "COMPANY.db", "EMPLOYEE"),
+        ("Mgr_ssn", "EMPLOYEE", "Ssn", "COMPANY.db", "DEPARTMENT")]
+    assert rows("SELECT * FROM DATABASE_FINGERPRINT;") == []
+    # v4: the registered names are indexed; v3, v5 and v6 add empty tables
+    assert rows("SELECT kind, count(*) FROM CATALOG_ENTRIES GROUP BY kind ORDER BY kind;") == [
+        ("column", 4), ("database", 1), ("table", 2)]
+    for table in ("TABLE_STATS", "COLUMN_STATS", "JOBS", "JOB_PARTITIONS", "CHANGE_LOG"):
+        assert rows(f"SELECT count(*) FROM {table};") == [(0,)]
+    connection.close()
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+
+import pytest
+
+from metadatabase import CatalogWatcher, DatabaseManager
+
+
+@pytest.fixture
+def watched(make_database, metadata_db, monkeypatch):
+    first = make_database("first.db", "CREATE TABLE a (id INTEGER PRIMARY KEY, v TEXT);")
+    second = make_database("second.db", "CREATE TABLE b (id INTEGER PRIMARY KEY);")
+    harvested = []
+    changed_catalog = DatabaseManager.changed_catalog
+
+    def recording(self, *args, **kwargs):
+        harvested.append(self.db_name)
+        return changed_catalog(self, *args, **kwargs)
+
+    monkeypatch.setattr(DatabaseManager, "changed_catalog", recording)
+    watcher = CatalogWatcher(metadata_db)
+    # The first poll only learns the files' state
+    assert watcher.poll() == []
+    yield watcher, first, second, harvested
+    watcher.close()
+
+
+def change(path, script):
+    # Run a script, then move the file's mtime on: a write within one clock tick that keeps the
+    # size would otherwise look like no change at all
+    before = os.stat(path)
+    connection = sqlite3.connect(path)
+    connection.executescript(script)
+    connection.close()
+    os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns + 1000))
+
+
+def events(polled):
+    return [(event["database"], event["kind"], event["action"], event["table"]) for event in polled]
+
+
+def change_log(metadata_db):
+    connection = sqlite3.connect(metadata_db)
+    try:
+        return connection.execute("SELECT database, kind, action, table_name FROM CHANGE_LOG ORDER BY id;").fetchall()
+    finally:
+        connection.close()
+
+
+def test_schema_changes_reharvest_only_the_changed_database(watched, metadata_db):
+    watcher, first, second, harvested = watched
+    change(first, "CREATE TABLE c (id INTEGER PRIMARY KEY);")
+    assert events(watcher.poll()) == [(first, "schema", "created", "c")]
+    change(first, "ALTER TABLE a ADD COLUMN w INTEGER;")
+    assert events(watcher.poll()) == [(first, "schema", "altered", "a")]
+    change(first, "DROP TABLE c;")
+    assert events(watcher.poll()) == [(first, "schema", "dropped", "c")]
+    assert harvested == [first] * 3
+
+    # The catalog follows, and every change is logged once
+    connection = sqlite3.connect(metadata_db)
+    assert connection.execute("SELECT name FROM COLUMNS WHERE database=? AND table_name='a' ORDER BY name;",
+                              (first,)).fetchall() == [("id",), ("v",), ("w",)]
+    assert connection.execute("SELECT count(*) FROM TABLES WHERE database=? AND name='c';", (first,)).fetchall() == [
+        (0,)]
+    connection.close()
+    assert watcher.poll() == []
+    assert change_log(metadata_db) == [(first, "schema", "created", "c"), (first, "schema", "altered", "a"),
+                                       (first, "schema", "dropped", "c")]
+
+
+def test_data_changes_and_missing_files(watched, metadata_db):
+    watcher, first, second, harvested = watched
+    change(second, "INSERT INTO b VALUES (1);")
+    assert events(watcher.poll()) == [(second, "data", None, None)]
+    # A touch without a commit is not a data change
+    stat = os.stat(second)
+    os.utime(second, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert watcher.poll() == []
+
+    os.remove(second)
+    assert events(watcher.poll()) == [(second, "missing", None, None)]
+    assert watcher.poll() == []
+    assert harvested == []
+    assert change_log(metadata_db) == [(second, "data", None, None), (second, "missing", None, None)]